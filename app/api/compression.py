@@ -0,0 +1,24 @@
+
+"""
+gzip для ответов /api крупнее порога (по Accept-Encoding клиента). UI-статика сжата
+заранее (static_assets) и сюда не попадает.
+"""
+from starlette.middleware.gzip import GZipMiddleware
+
+from ..config import settings
+
+class ApiGZipMiddleware:
+    def __init__(self, app, prefix: str = "/api/", minimum_size: int | None = None, compresslevel: int = 6):
+        self.app = app
+        self.prefix = prefix
+        self.gzip = GZipMiddleware(
+            app,
+            minimum_size=settings.api_gzip_min_bytes if minimum_size is None else minimum_size,
+            compresslevel=compresslevel,
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith(self.prefix):
+            await self.gzip(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
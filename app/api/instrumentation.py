@@ -0,0 +1,145 @@
+
+"""
+Метрики HTTP по маршрутам: гистограмма латентности, число SQL-запросов и время в БД
+на запрос (счётчики из app.telemetry). Чистый ASGI middleware — не буферизует тело
+ответа, так что стриминг (NDJSON) меряется целиком. Экспорт — Prometheus text format.
+"""
+import logging
+import threading
+import time
+
+from .. import telemetry
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250, 1000)
+
+# не считаем сам /metrics и служебные страницы документации
+SKIP_PATHS = {"/metrics", "/docs", "/redoc", "/openapi.json"}
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, buckets: tuple):
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, buckets: tuple, value: float) -> None:
+        for i, le in enumerate(buckets):
+            if value <= le:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests: dict[tuple, int] = {}          # (method, route, status) -> n
+        self.latency: dict[tuple, _Histogram] = {}    # (method, route)
+        self.queries: dict[tuple, _Histogram] = {}    # (method, route) — SQL-запросов на запрос
+        self.db_seconds: dict[tuple, float] = {}      # (method, route)
+        self.over_threshold: dict[tuple, int] = {}    # (method, route)
+
+    def observe(self, method: str, route: str, status: int, seconds: float, queries: int, db_s: float) -> None:
+        key = (method, route)
+        with self._lock:
+            self.requests[(method, route, str(status))] = self.requests.get((method, route, str(status)), 0) + 1
+            self.latency.setdefault(key, _Histogram(LATENCY_BUCKETS)).observe(LATENCY_BUCKETS, seconds)
+            self.queries.setdefault(key, _Histogram(QUERY_BUCKETS)).observe(QUERY_BUCKETS, queries)
+            self.db_seconds[key] = self.db_seconds.get(key, 0.0) + db_s
+            if queries > settings.request_query_warn:
+                self.over_threshold[key] = self.over_threshold.get(key, 0) + 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self.__init__()
+
+    def render(self) -> str:
+        with self._lock:
+            out: list[str] = []
+            _counter(out, "awm_http_requests_total", "HTTP requests by route and status.",
+                     [(("method", "route", "status"), k, v) for k, v in self.requests.items()])
+            _histograms(out, "awm_http_request_duration_seconds", "Request latency by route.",
+                        LATENCY_BUCKETS, self.latency)
+            _histograms(out, "awm_http_request_db_queries", "SQL statements per request by route.",
+                        QUERY_BUCKETS, self.queries)
+            _counter(out, "awm_http_request_db_seconds_total", "Time spent in SQL by route.",
+                     [(("method", "route"), k, v) for k, v in self.db_seconds.items()])
+            _counter(out, "awm_http_request_query_threshold_exceeded_total",
+                     "Requests that ran more SQL statements than REQUEST_QUERY_WARN (N+1 suspects).",
+                     [(("method", "route"), k, v) for k, v in self.over_threshold.items()])
+            return "\n".join(out) + "\n"
+
+def _esc(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_esc(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}"
+
+def _le(v) -> str:
+    return 'le="%s"' % v
+
+def _num(v: float) -> str:
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+def _counter(out: list, name: str, help_: str, samples: list) -> None:
+    out += [f"# HELP {name} {help_}", f"# TYPE {name} counter"]
+    for names, values, v in sorted(samples, key=lambda s: s[1]):
+        out.append(f"{name}{_labels(names, values)} {_num(v)}")
+
+def _histograms(out: list, name: str, help_: str, buckets: tuple, series: dict) -> None:
+    out += [f"# HELP {name} {help_}", f"# TYPE {name} histogram"]
+    names = ("method", "route")
+    for key in sorted(series):
+        h = series[key]
+        for le, n in zip(buckets, h.counts):
+            out.append(f"{name}_bucket{_labels(names, key, _le(le))} {n}")
+        out.append(f"{name}_bucket{_labels(names, key, _le('+Inf'))} {h.count}")
+        out.append(f"{name}_sum{_labels(names, key)} {_num(h.sum)}")
+        out.append(f"{name}_count{_labels(names, key)} {h.count}")
+
+REGISTRY = Registry()
+
+class RequestMetricsMiddleware:
+    """
+    Меряет каждый HTTP-запрос: латентность до последнего байта тела, SQL-запросы и время в БД.
+    Маршрут берётся из scope["route"] (шаблон пути, например /admin/runs/{run_id}), так что
+    кардинальность меток ограничена числом маршрутов.
+    """
+
+    def __init__(self, app, registry: Registry = REGISTRY):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in SKIP_PATHS:
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        t0 = time.perf_counter()
+        with telemetry.stage(scope["path"], memory=False) as st:
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                elapsed = time.perf_counter() - t0
+                route = getattr(scope.get("route"), "path", None) or "<unmatched>"
+                method = scope["method"]
+                self.registry.observe(method, route, status, elapsed, st.queries, st.db_time)
+                if st.queries > settings.request_query_warn:
+                    logger.warning(
+                        "%s %s ran %d SQL statements (db %.3fs, total %.3fs) — N+1 suspect",
+                        method, route, st.queries, st.db_time, elapsed,
+                    )
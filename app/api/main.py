@@ -1,20 +1,52 @@
 from __future__ import annotations
-from fastapi import FastAPI, Depends, HTTPException
-from fastapi.responses import HTMLResponse
+import orjson
+from fastapi import APIRouter, FastAPI, Depends, HTTPException, Request, UploadFile, File
+from fastapi.responses import HTMLResponse, JSONResponse, ORJSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from ..db import get_db, init_db
+from .. import profiler
+from ..config import settings
+from ..db import SessionLocal, dispose_async_engine, get_async_db, get_db, init_db
 from ..services import purchase_orders as po_svc
 from ..services import accounting as acc_svc
+from ..services import changes as changes_svc
 from ..services import sales as sales_svc
-from ..models import PurchaseOrderItem
+from ..services import backfill as backfill_svc
+from ..services import ingest as ingest_svc
+from ..services import jobs as jobs_svc
+from ..services import scheduler as scheduler_svc
+from . import schemas
+from .compression import ApiGZipMiddleware
+from .instrumentation import REGISTRY, RequestMetricsMiddleware
+from .static_assets import ASSETS, REVALIDATE, Asset, add_asset, asset_response, externalize_scripts
 
 app = FastAPI(title="AWM API")
+app.add_middleware(ApiGZipMiddleware)
+app.add_middleware(RequestMetricsMiddleware)  # внешний: меряет и время сжатия
+
+# /api/*: orjson вместо json + jsonable_encoder
+api = APIRouter(prefix="/api", default_response_class=ORJSONResponse)
 
 @app.on_event("startup")
 def _startup_create_tables():
     init_db()
+    if settings.scheduler_enabled:
+        scheduler_svc.start_scheduler(run_now=settings.scheduler_run_on_start)
+
+@app.on_event("shutdown")
+def _shutdown_scheduler():
+    scheduler_svc.stop_scheduler()
+
+@app.on_event("shutdown")
+async def _shutdown_async_engine():
+    await dispose_async_engine()
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def metrics():
+    """Prometheus: латентность, SQL-запросы и время в БД по маршрутам."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 # ---------- Pydantic models ----------
 class POItemIn(BaseModel):
@@ -41,6 +73,44 @@ class LabelingIn(BaseModel):
     cost_total: float
 
 # ---------- Layout ----------
+# Страницы статичны: HTML, CSS и JS собираются один раз при импорте (см. static_assets),
+# CSS/JS отдаются по адресам с хэшем содержимого и кэшируются навсегда.
+LAYOUT_CSS = """
+body{margin:0;font-family:system-ui,-apple-system,Segoe UI,Roboto,sans-serif;
+background:#121212;color:#fff;display:flex;height:100vh;}
+.sidebar{width:260px;background:#1e1e1e;padding:20px;display:flex;flex-direction:column}
+.menu-item{color:#bbb;text-decoration:none;padding:10px 0;display:block;border-left:3px solid transparent}
+.menu-item.active{color:#fff;font-weight:600;border-left:3px solid #007bff}
+.menu-item:hover{color:#fff}
+.content{flex:1;overflow-y:auto;padding:20px 30px}
+.card{background:#1e1e1e;border-radius:10px;padding:16px;margin-bottom:20px;
+box-shadow:0 0 10px rgba(0,0,0,.3)}
+.table-wrap{width:100%;overflow:auto}
+table{width:100%;border-collapse:collapse;color:#fff;min-width:900px}
+th,td{border-bottom:1px solid #333;padding:8px;text-align:left;white-space:nowrap}
+th{background:#2a2a2a;position:sticky;top:0}
+input,button,select,textarea{background:#2a2a2a;color:#fff;border:1px solid #444;
+border-radius:6px;padding:8px}
+button:hover{background:#007bff;border-color:#007bff}
+.row{display:flex;gap:10px;flex-wrap:wrap;align-items:center}
+.badge{background:#222;border:1px solid #444;border-radius:999px;padding:2px 8px}
+"""
+LAYOUT_CSS_URL = add_asset("app", "css", LAYOUT_CSS, "text/css")
+
+# общий JS всех страниц; fetchAll проходит по страницам ответа {items, next_cursor}
+LAYOUT_JS = """
+const PAGE=200;
+async function fetchAll(url){
+const out=[];let cursor=null;
+do{
+const r=await fetch(url+(cursor?(url.includes('?')?'&':'?')+'cursor='+encodeURIComponent(cursor):''));
+if(!r.ok)throw new Error(await r.text());
+const page=await r.json();out.push(...page.items);cursor=page.next_cursor;
+}while(cursor);
+return out;}
+"""
+LAYOUT_JS_URL = add_asset("app", "js", LAYOUT_JS, "text/javascript")
+
 def render_layout(active: str, content_html: str, title="AWM"):
     menu = [
         ("Dashboard", "/", "dashboard"),
@@ -64,46 +134,50 @@ def render_layout(active: str, content_html: str, title="AWM"):
     return f"""
 <!doctype html><html><head><meta charset='utf-8'/>
 <title>{title}</title>
-<style>
-body{{margin:0;font-family:system-ui,-apple-system,Segoe UI,Roboto,sans-serif;
-background:#121212;color:#fff;display:flex;height:100vh;}}
-.sidebar{{width:260px;background:#1e1e1e;padding:20px;display:flex;flex-direction:column}}
-.menu-item{{color:#bbb;text-decoration:none;padding:10px 0;display:block;border-left:3px solid transparent}}
-.menu-item.active{{color:#fff;font-weight:600;border-left:3px solid #007bff}}
-.menu-item:hover{{color:#fff}}
-.content{{flex:1;overflow-y:auto;padding:20px 30px}}
-.card{{background:#1e1e1e;border-radius:10px;padding:16px;margin-bottom:20px;
-box-shadow:0 0 10px rgba(0,0,0,.3)}}
-.table-wrap{{width:100%;overflow:auto}}
-table{{width:100%;border-collapse:collapse;color:#fff;min-width:900px}}
-th,td{{border-bottom:1px solid #333;padding:8px;text-align:left;white-space:nowrap}}
-th{{background:#2a2a2a;position:sticky;top:0}}
-input,button,select,textarea{{background:#2a2a2a;color:#fff;border:1px solid #444;
-border-radius:6px;padding:8px}}
-button:hover{{background:#007bff;border-color:#007bff}}
-.row{{display:flex;gap:10px;flex-wrap:wrap;align-items:center}}
-.badge{{background:#222;border:1px solid #444;border-radius:999px;padding:2px 8px}}
-</style></head><body>
+<link rel='stylesheet' href='{LAYOUT_CSS_URL}'>
+<script src='{LAYOUT_JS_URL}'></script></head><body>
 <div class='sidebar'><h2 style='color:#fff;margin-bottom:20px;'>AWM</h2>{sidebar}</div>
 <div class='content'>{content_html}</div></body></html>
 """
 
+def page(path: str, active: str, title: str = "AWM"):
+    """
+    Регистрирует UI-страницу: функция возвращает HTML контента, страница собирается один раз
+    (inline-скрипты выносятся в JS-ассеты) и отдаётся с ETag (повторный заход — 304) и gzip/br.
+    """
+    def decorator(fn):
+        html = render_layout(active, externalize_scripts(fn(), active), title)
+        asset = Asset(html.encode(), "text/html")
+
+        def endpoint(request: Request):
+            return asset_response(request, asset, REVALIDATE)
+
+        app.get(path, response_class=HTMLResponse, name=fn.__name__)(endpoint)
+        return fn
+    return decorator
+
+@app.get("/static/{filename}", include_in_schema=False)
+def static_asset(filename: str, request: Request):
+    asset = ASSETS.get(filename)
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return asset_response(request, asset)
+
 # ---------- Dashboard ----------
-@app.get("/", response_class=HTMLResponse)
+@page("/", "dashboard")
 def dashboard_page():
-    html = """
+    return """
     <h1>Dashboard</h1>
     <div class='card'>
       <p>Добро пожаловать в Amazon Wholesale Manager.</p>
       <p>Используйте левое меню для навигации.</p>
     </div>
     """
-    return HTMLResponse(render_layout("dashboard", html))
 
 # ---------- Purchase Orders ----------
-@app.get("/po", response_class=HTMLResponse)
+@page("/po", "po", "Purchase Orders")
 def po_page():
-    html = """
+    return """
 <h1>Purchase Orders</h1>
 <div class='card'>
 <h3>New Purchase Order</h3>
@@ -174,18 +248,17 @@ tr.innerHTML='<td>'+po.id+'</td><td>'+po.name+'</td><td>'+(po.supplier||'')+'</t
 loadPOs();addItem();
 </script>
 """
-    return HTMLResponse(render_layout("po", html, "Purchase Orders"))
 
 # ---------- Label / Prep ----------
-@app.get("/label", response_class=HTMLResponse)
+@page("/label", "label", "Label / Prep")
 def label_page():
-    html = """
+    return """
 <h1>Label / Prep</h1>
 <div class='card'><div class='table-wrap'><table id='labelTbl'>
 <thead><tr><th>ID</th><th>ASIN</th><th>Title</th><th>Qty</th><th>Price</th><th>Prep center</th><th>Prep cost</th><th></th></tr></thead><tbody></tbody></table></div></div>
 <script>
 async function loadItems(){
-const r=await fetch('/api/po/items');const data=await r.json();
+const data=await fetchAll('/api/po/items?fields=asin,listing_title,quantity,purchase_price');
 const tb=document.querySelector('#labelTbl tbody');tb.innerHTML='';
 for(const it of data){
 const tr=document.createElement('tr');
@@ -203,18 +276,17 @@ if(!rr.ok)alert(await rr.text());else alert('Saved');}));
 }
 loadItems();
 </script>"""
-    return HTMLResponse(render_layout("label", html, "Label / Prep"))
 
 # ---------- Transportation ----------
-@app.get("/transport", response_class=HTMLResponse)
+@page("/transport", "transport", "Transportation Costs")
 def transport_page():
-    html = """
+    return """
 <h1>Transportation Costs</h1>
 <div class='card'><div class='table-wrap'><table id='transTbl'>
 <thead><tr><th>ID</th><th>ASIN</th><th>Title</th><th>Qty</th><th>Price</th><th>Shipping to FBA</th><th>Note</th><th></th></tr></thead><tbody></tbody></table></div></div>
 <script>
 async function loadItems(){
-const r=await fetch('/api/po/items');const data=await r.json();
+const data=await fetchAll('/api/po/items?fields=asin,listing_title,quantity,purchase_price');
 const tb=document.querySelector('#transTbl tbody');tb.innerHTML='';
 for(const it of data){
 const tr=document.createElement('tr');
@@ -232,18 +304,17 @@ if(!rr.ok)alert(await rr.text());else alert('Saved');}));
 }
 loadItems();
 </script>"""
-    return HTMLResponse(render_layout("transport", html, "Transportation Costs"))
 
 # ---------- Inventory ----------
-@app.get("/inventory", response_class=HTMLResponse)
+@page("/inventory", "inventory", "Inventory")
 def inventory_page():
-    html = """
+    return """
 <h1>Inventory</h1>
 <div class='card'><div class='table-wrap'><table id='invTbl'>
 <thead><tr><th>ID</th><th>ASIN</th><th>Title</th><th>Qty</th><th>Unit COGS</th><th>Total</th></tr></thead><tbody></tbody></table></div></div>
 <script>
 async function loadItems(){
-const r=await fetch('/api/po/items');const data=await r.json();
+const data=await fetchAll('/api/po/items?fields=asin,listing_title,quantity,unit_cogs');
 const tb=document.querySelector('#invTbl tbody');tb.innerHTML='';
 for(const it of data){
 const unit=Number(it.unit_cogs||0);const total=unit*Number(it.quantity||0);
@@ -254,11 +325,10 @@ tb.appendChild(tr);}
 }
 loadItems();
 </script>"""
-    return HTMLResponse(render_layout("inventory", html, "Inventory"))
 # ---------- ACCOUNTING: GL ----------
-@app.get("/accounting/gl", response_class=HTMLResponse)
+@page("/accounting/gl", "gl", "Accounting - GL")
 def accounting_gl_page():
-    html = """
+    return """
 <h1>General Ledger (GL)</h1>
 <div class='card'>
 <form class='row' onsubmit='return goFilter()'>
@@ -292,7 +362,9 @@ def accounting_gl_page():
 <table id='glTbl'>
 <thead><tr><th>ID</th><th>Date</th><th>NC</th><th>Account</th><th>Description</th>
 <th>Amount</th><th>Dr/Cr</th><th>Month</th><th>Year</th></tr></thead><tbody></tbody></table>
-</div></div>
+</div>
+<button type='button' id='glMore' onclick='moreGL()' style='display:none;margin-top:10px;'>Load more</button>
+</div>
 <script>
 function goFilter(){
  const m=document.getElementById('m').value.trim();
@@ -311,56 +383,69 @@ async function addGL(e){
  if(r.ok){alert('Added');loadGL();e.target.reset();}else alert(await r.text());
  return false;
 }
+let glQs='',glCursor=null;
 async function loadGL(m,y){
  const qs=new URLSearchParams();if(m)qs.set('month',m);if(y)qs.set('year',y);
- const r=await fetch('/api/accounting/gl'+(qs.toString()?('?'+qs.toString()):''));const d=await r.json();
- const tb=document.querySelector('#glTbl tbody');tb.innerHTML='';
- for(const t of d){
+ glQs=qs.toString();glCursor=null;document.querySelector('#glTbl tbody').innerHTML='';
+ await moreGL();
+}
+async function moreGL(){
+ const qs=new URLSearchParams(glQs);qs.set('limit',PAGE);if(glCursor)qs.set('cursor',glCursor);
+ const r=await fetch('/api/accounting/gl?'+qs.toString());const d=await r.json();
+ const tb=document.querySelector('#glTbl tbody');
+ for(const t of d.items){
  const tr=document.createElement('tr');
  tr.innerHTML='<td>'+t.id+'</td><td>'+t.date+'</td><td>'+t.nc+'</td>'
  +'<td>'+t.account_name+'</td><td>'+(t.description||'')+'</td>'
  +'<td>'+Number(t.amount||0).toFixed(2)+'</td><td>'+t.drcr+'</td>'
  +'<td>'+t.month+'</td><td>'+t.year+'</td>';tb.appendChild(tr);
  }
+ glCursor=d.next_cursor;document.getElementById('glMore').style.display=glCursor?'inline-block':'none';
 }
 loadGL();
 </script>
 """
-    return HTMLResponse(render_layout("gl", html, "Accounting - GL"))
 
 # ---------- ACCOUNTING: Prepayments ----------
-@app.get("/accounting/prepayments", response_class=HTMLResponse)
+@page("/accounting/prepayments", "prepayments", "Accounting - Prepayments")
 def accounting_prepayments_page():
-    html = """
+    return """
 <h1>Prepayments</h1>
 <div class='card'><div class='table-wrap'>
 <table id='prepTbl'><thead><tr>
 <th>ID</th><th>Date</th><th>Account</th><th>Description</th>
-<th>Amount</th><th>Status</th></tr></thead><tbody></tbody></table></div></div>
+<th>Amount</th><th>Status</th></tr></thead><tbody></tbody></table></div>
+<button type='button' id='prepMore' onclick='loadPrepayments()' style='display:none;margin-top:10px;'>Load more</button>
+</div>
 <script>
+let prepCursor=null;
 async function loadPrepayments(){
-const r=await fetch('/api/accounting/prepayments');const d=await r.json();
-const tb=document.querySelector('#prepTbl tbody');tb.innerHTML='';
-for(const p of d){
+const qs=new URLSearchParams();qs.set('limit',PAGE);if(prepCursor)qs.set('cursor',prepCursor);
+const r=await fetch('/api/accounting/prepayments?'+qs.toString());const d=await r.json();
+const tb=document.querySelector('#prepTbl tbody');
+for(const p of d.items){
 const tr=document.createElement('tr');
 tr.innerHTML='<td>'+p.id+'</td><td>'+p.date+'</td><td>'+p.account+'</td>'
 +'<td>'+(p.description||'')+'</td><td>'+Number(p.amount||0).toFixed(2)+'</td>'
 +'<td>'+(p.status||'')+'</td>';tb.appendChild(tr);}
+prepCursor=d.next_cursor;document.getElementById('prepMore').style.display=prepCursor?'inline-block':'none';
 }
 loadPrepayments();
 </script>
 """
-    return HTMLResponse(render_layout("prepayments", html, "Accounting - Prepayments"))
 
 # ---------- ACCOUNTING: TB ----------
-@app.get("/accounting/tb", response_class=HTMLResponse)
+@page("/accounting/tb", "tb", "Accounting - TB")
 def accounting_tb_page():
-    html = """
+    return """
 <h1>Trial Balance (TB)</h1>
 <div class='card'>
 <form class='row' onsubmit='return goFilterTB()'>
   <input id='m' placeholder='Month (1-12)'>
   <input id='y' placeholder='Year (YYYY)'>
+  <label><input id='ytd' type='checkbox'> YTD</label>
+  <input id='from' placeholder='From (YYYY-MM)'>
+  <input id='to' placeholder='To (YYYY-MM)'>
   <button type='submit'>Filter</button>
 </form>
 </div>
@@ -371,30 +456,30 @@ def accounting_tb_page():
 </div></div>
 <script>
 function goFilterTB(){
- const m=document.getElementById('m').value.trim();
- const y=document.getElementById('y').value.trim();
- loadTB(m||null,y||null);return false;
+ const v=id=>document.getElementById(id).value.trim();
+ loadTB({month:v('m'),year:v('y'),start:v('from'),end:v('to'),ytd:document.getElementById('ytd').checked?'1':''});
+ return false;
 }
-async function loadTB(m,y){
- const qs=new URLSearchParams();if(m)qs.set('month',m);if(y)qs.set('year',y);
- const r=await fetch('/api/accounting/tb'+(qs.toString()?('?'+qs.toString()):''));const d=await r.json();
+async function loadTB(f){
+ const qs=new URLSearchParams();for(const[k,v]of Object.entries(f||{}))if(v)qs.set(k,v);
+ const r=await fetch('/api/accounting/tb'+(qs.toString()?('?'+qs.toString()):''));
+ if(!r.ok){alert(await r.text());return;}const d=await r.json();
  const tb=document.querySelector('#tbTbl tbody');tb.innerHTML='';
  for(const a of d){
  const tr=document.createElement('tr');
- tr.innerHTML='<td>'+a.account_name+'</td>'
- +'<td>'+Number(a.total_dr||0).toFixed(2)+'</td>'
- +'<td>'+Number(a.total_cr||0).toFixed(2)+'</td>'
+ tr.innerHTML='<td>'+a.account+'</td>'
+ +'<td>'+Number(a.dr||0).toFixed(2)+'</td>'
+ +'<td>'+Number(a.cr||0).toFixed(2)+'</td>'
  +'<td>'+Number(a.balance||0).toFixed(2)+'</td>';
  tb.appendChild(tr);}
 }
 loadTB();
 </script>
 """
-    return HTMLResponse(render_layout("tb", html, "Accounting - TB"))
 # ---------- SALES ----------
-@app.get("/sales", response_class=HTMLResponse)
+@page("/sales", "sales", "Sales")
 def sales_page():
-    html = """
+    return """
 <h1>Sales</h1>
 <div class='card'>
 <form class='row' onsubmit='return goFilter()'>
@@ -418,7 +503,9 @@ ID/Date/ASIN/Units/Amount/FBA/Amazon Fee.</p>
 <th>ID</th><th>Date</th><th>ASIN</th><th>Description</th><th>Amount</th><th>TYPE</th><th>Party</th><th>Month</th>
 <th>Units sold</th><th>COGS</th><th>FBA</th><th>Amazon fee</th><th>AFTER FEES</th><th>NET per unit</th>
 <th>Payment to Supplier</th><th>Prep</th><th>Shipping</th><th>PO</th></tr></thead><tbody></tbody></table>
-</div></div>
+</div>
+<button type='button' id='salesMore' onclick='moreSales()' style='display:none;margin-top:10px;'>Load more</button>
+</div>
 <script>
 function goFilter(){const m=document.getElementById('m').value.trim();
 const y=document.getElementById('y').value.trim();loadSales(m||null,y||null);return false;}
@@ -426,55 +513,25 @@ function setStatus(msg,ok=true){
 const el=document.getElementById('impstatus');
 el.style.display='inline-block';el.style.borderColor=ok?'#2e7d32':'#b71c1c';
 el.style.color=ok?'#a5d6a7':'#ef9a9a';el.textContent=msg;}
-function parseCSV(txt){
-const rows=[];let row=[],cur='',q=false;
-for(let i=0;i<txt.length;i++){
-const ch=txt[i];
-if(ch=='"'){if(q&&txt[i+1]=='"'){cur+='"';i++;}else q=!q;continue;}
-if(!q&&(ch==','||ch==';')){row.push(cur);cur='';continue;}
-if(!q&&(ch=='\\n'||ch=='\\r')){if(cur||row.length){row.push(cur);rows.push(row);row=[];cur='';}continue;}
-cur+=ch;}if(cur||row.length){row.push(cur);rows.push(row);}return rows;}
-function parseFloatSafe(v){if(!v)return 0;v=String(v).replace(',','.');const n=parseFloat(v);return isNaN(n)?0:n;}
-function parseIntSafe(v){const n=parseInt(v,10);return isNaN(n)?0:n;}
-function toISODate(s){if(!s)return null;s=s.trim();
-if(/^\\d{4}-\\d{2}-\\d{2}/.test(s))return s.slice(0,10);
-const m1=s.match(/^(\\d{1,2})\\.(\\d{1,2})\\.(\\d{4})/);if(m1)return m1[3]+'-'+m1[2].padStart(2,'0')+'-'+m1[1].padStart(2,'0');
-const m2=s.match(/^(\\d{1,2})\\/(\\d{1,2})\\/(\\d{4})/);if(m2)return m2[3]+'-'+m2[1].padStart(2,'0')+'-'+m2[2].padStart(2,'0');
-return s;}
 async function importSellerboard(){
 const f=document.getElementById('sbfile').files[0];
 if(!f){alert('Choose CSV');return;}
-const text=await f.text();const rows=parseCSV(text);if(rows.length<2){setStatus('Empty file',false);return;}
-const head=rows[0].map(x=>x.trim().toLowerCase());
-function find(...names){for(const n of names){const i=head.indexOf(n.toLowerCase());if(i>=0)return i;}return -1;}
-const idx={id:find('id','order id','номер заказа'),date:find('date','дата'),asin:find('asin'),
-desc:find('title','описание'),units:find('units','qty','кол-во'),amount:find('sales','amount','выручка'),
-fba:find('fba','fba fee'),amz:find('amazon fee','commission')};
-if(idx.id<0||idx.date<0||idx.asin<0){setStatus('Не найдены ключевые колонки',false);return;}
-const recs=[];
-for(let r=1;r<rows.length;r++){
-const c=rows[r];if(!c||!c.length)continue;
-const asin=c[idx.asin]?.trim();if(!asin)continue;
-const units=parseIntSafe(c[idx.units]);
-const fba=parseFloatSafe(c[idx.fba]);
-const amz=parseFloatSafe(c[idx.amz]);
-const rec={external_id:c[idx.id],date:toISODate(c[idx.date]),asin:asin,
-description:c[idx.desc]||'',amount:parseFloatSafe(c[idx.amount]),
-type:'Order',party:'Amazon',units_sold:units||1,
-fba_fee_per_unit:units?fba/units:0,amazon_fee_per_unit:units?amz/units:0,
-cogs_per_unit:0,after_fees_per_unit:0,net_per_unit:0,
-pay_supplier_per_unit:0,prep_per_unit:0,ship_to_amz_per_unit:0};
-recs.push(rec);}
-if(!recs.length){setStatus('No valid rows',false);return;}
-const r=await fetch('/api/sales/import',{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify({records:recs})});
-if(!r.ok){setStatus('Import failed',false);return;}
-const d=await r.json();setStatus('Imported: '+d.imported,true);loadSales();
+setStatus('Uploading…',true);
+const fd=new FormData();fd.append('file',f);
+const r=await fetch('/api/sales/upload',{method:'POST',body:fd});
+if(!r.ok){setStatus('Import failed: '+await r.text(),false);return;}
+const d=await r.json();setStatus('Imported: '+d.imported+' (new '+d.inserted+', updated '+d.updated+', skipped '+d.skipped+')',true);loadSales();
 }
+let salesQs='',salesCursor=null;
 async function loadSales(m,y){
 const qs=new URLSearchParams();if(m)qs.set('month',m);if(y)qs.set('year',y);
-const r=await fetch('/api/sales'+(qs.toString()?('?'+qs.toString()):''));const d=await r.json();
-const tb=document.querySelector('#salesTbl tbody');tb.innerHTML='';
-for(const s of d){
+salesQs=qs.toString();salesCursor=null;document.querySelector('#salesTbl tbody').innerHTML='';
+await moreSales();}
+async function moreSales(){
+const qs=new URLSearchParams(salesQs);qs.set('limit',PAGE);if(salesCursor)qs.set('cursor',salesCursor);
+const r=await fetch('/api/sales?'+qs.toString());const d=await r.json();
+const tb=document.querySelector('#salesTbl tbody');
+for(const s of d.items){
 const tr=document.createElement('tr');
 tr.innerHTML='<td>'+s.id+'</td><td>'+s.date+'</td><td>'+s.asin+'</td>'
 +'<td>'+(s.description||'')+'</td><td>'+Number(s.amount||0).toFixed(2)+'</td>'
@@ -489,18 +546,68 @@ tr.innerHTML='<td>'+s.id+'</td><td>'+s.date+'</td><td>'+s.asin+'</td>'
 +'<td>'+Number(s.prep_per_unit||0).toFixed(2)+'</td>'
 +'<td>'+Number(s.ship_to_amz_per_unit||0).toFixed(2)+'</td>'
 +'<td>'+(s.po_id||'')+'</td>';tb.appendChild(tr);}
+salesCursor=d.next_cursor;document.getElementById('salesMore').style.display=salesCursor?'inline-block':'none';
 }
 loadSales();
 </script>
 """
-    return HTMLResponse(render_layout("sales", html, "Sales"))
 
 # ---------- API ENDPOINTS ----------
-@app.get("/api/po/items")
-def api_po_items(db: Session = Depends(get_db)):
-    return db.query(PurchaseOrderItem).all()
+# Списки уже собраны сервисами в словари: ORJSONResponse напрямую, без прохода
+# jsonable_encoder по каждой строке (response_model — только для схемы в /docs).
+def _page(list_fn, db: Session, *args, limit: int | None, cursor: str | None):
+    try:
+        return ORJSONResponse(list_fn(db, *args, limit=limit, cursor=cursor))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-@app.post("/api/purchase-orders")
+async def _apage(list_fn, db: AsyncSession, *args, limit: int | None, cursor: str | None):
+    try:
+        return ORJSONResponse(await list_fn(db, *args, limit=limit, cursor=cursor))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _ndjson(iter_fn, *args) -> StreamingResponse:
+    """
+    Строки отдаются по мере чтения с курсора БД. Сессия своя: зависимость get_db
+    закрывается до того, как начнёт отправляться тело StreamingResponse.
+    """
+    def gen():
+        db = SessionLocal()
+        try:
+            for row in iter_fn(db, *args):
+                yield orjson.dumps(row) + b"\n"
+        finally:
+            db.close()
+    return StreamingResponse(gen(), media_type="application/x-ndjson")
+
+@api.get("/po/items", response_model=schemas.POItemsPage)
+def api_po_items(
+    request: Request,
+    po_id: int | None = None,
+    status: str | None = None,
+    asin: str | None = None,
+    open_only: bool = False,
+    fields: str | None = None,
+    limit: int | None = None,
+    cursor: str | None = None,
+    db: Session = Depends(get_db),
+):
+    """
+    Позиции PO постранично: ?po_id=&status=NEW|CLOSED&asin=<префикс>&open_only=1&fields=asin,quantity.
+    ETag — по счётчикам изменений purchase_orders/purchase_order_items: опрос без изменений = 304.
+    """
+    etag = changes_svc.etag(db, "purchase_orders", "purchase_order_items")
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in [t.strip() for t in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    try:
+        page = po_svc.list_po_items(db, po_id, status, asin, open_only, fields, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return ORJSONResponse(page, headers=headers)
+
+@api.post("/purchase-orders")
 def api_po_create(body: POCreate, db: Session = Depends(get_db)):
     try:
         po = po_svc.create_purchase_order(db, body.model_dump())
@@ -508,45 +615,200 @@ def api_po_create(body: POCreate, db: Session = Depends(get_db)):
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-@app.get("/api/purchase-orders")
-def api_po_list(db: Session = Depends(get_db)):
-    return po_svc.list_purchase_orders(db)
+@api.post("/purchase-orders/bulk")
+def api_po_create_bulk(body: list[POCreate], db: Session = Depends(get_db)):
+    """Несколько PO за одну транзакцию: либо создаются все, либо ни одного."""
+    try:
+        pos = po_svc.create_purchase_orders(db, [b.model_dump() for b in body])
+        return {"ok": True, "po_ids": [p.id for p in pos]}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@api.post("/purchase-orders/import")
+def api_po_import_csv(file: UploadFile = File(...), db: Session = Depends(get_db)):
+    """Supplier invoice CSV: строка на позицию, группировка в PO по po_name + invoice_number."""
+    try:
+        pos = po_svc.create_purchase_orders(db, po_svc.parse_po_csv(file.file))
+        return {"ok": True, "po_ids": [p.id for p in pos]}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@api.get("/purchase-orders", response_model=list[schemas.POListItem])
+async def api_po_list(db: AsyncSession = Depends(get_async_db)):
+    return ORJSONResponse(await po_svc.list_purchase_orders_async(db))
 
-@app.post("/api/po/labeling")
+@api.post("/po/labeling")
 def api_po_labeling(body: LabelingIn, db: Session = Depends(get_db)):
     lc = po_svc.add_labeling_cost(db, body.po_item_id, body.note, body.cost_total)
     return {"ok": True, "labeling_id": lc.id}
 
 # Accounting
-@app.post("/api/accounting/gl")
+@api.post("/accounting/gl")
 def api_gl_add(txn: dict, db: Session = Depends(get_db)):
-    return acc_svc.add_gl_transaction(db, txn)
+    try:
+        r = acc_svc.create_gl(db, txn)
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Missing field: {e}")
+    return {"ok": True, "id": r.id}
 
-@app.get("/api/accounting/gl")
-def api_gl_list(month: int | None = None, year: int | None = None, db: Session = Depends(get_db)):
-    return acc_svc.list_gl(db, month, year)
+@api.put("/accounting/gl/{txn_id}")
+def api_gl_update(txn_id: int, txn: dict, db: Session = Depends(get_db)):
+    try:
+        r = acc_svc.update_gl(db, txn_id, txn)
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Missing field: {e}")
+    if r is None:
+        raise HTTPException(status_code=404, detail="GL transaction not found")
+    return {"ok": True, "id": r.id}
 
-@app.get("/api/accounting/prepayments")
-def api_prepayments_list(db: Session = Depends(get_db)):
-    return acc_svc.list_prepayments(db)
+@api.delete("/accounting/gl/{txn_id}")
+def api_gl_delete(txn_id: int, db: Session = Depends(get_db)):
+    if not acc_svc.delete_gl(db, txn_id):
+        raise HTTPException(status_code=404, detail="GL transaction not found")
+    return {"ok": True}
 
-@app.get("/api/accounting/tb")
-def api_tb_list(month: int | None = None, year: int | None = None, db: Session = Depends(get_db)):
-    return acc_svc.trial_balance(db, month, year)
+@api.get("/accounting/gl", response_model=schemas.GLPage)
+async def api_gl_list(
+    month: int | None = None,
+    year: int | None = None,
+    limit: int | None = None,
+    cursor: str | None = None,
+    format: str = "json",
+    db: AsyncSession = Depends(get_async_db),
+):
+    if format == "ndjson":
+        return _ndjson(acc_svc.iter_gl, month, year)
+    return await _apage(acc_svc.list_gl_async, db, month, year, limit=limit, cursor=cursor)
+
+@api.get("/accounting/prepayments", response_model=schemas.PrepaymentPage)
+def api_prepayments_list(
+    month: int | None = None,
+    year: int | None = None,
+    limit: int | None = None,
+    cursor: str | None = None,
+    format: str = "json",
+    db: Session = Depends(get_db),
+):
+    if format == "ndjson":
+        return _ndjson(acc_svc.iter_prepayments, month, year)
+    return _page(acc_svc.list_prepayments, db, month, year, limit=limit, cursor=cursor)
+
+@api.get("/accounting/tb", response_model=list[schemas.TBRow])
+async def api_tb_list(
+    month: int | None = None,
+    year: int | None = None,
+    start: str | None = None,
+    end: str | None = None,
+    ytd: bool = False,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """TB за месяц/год, за диапазон ?start=YYYY-MM&end=YYYY-MM или нарастающим итогом ?ytd=1&year=."""
+    try:
+        return ORJSONResponse(await acc_svc.tb_async(db, month, year, start=start, end=end, ytd=ytd))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 # Sales
-@app.post("/api/sales/import")
+@api.post("/sales/import")
 def api_sales_import(data: dict, db: Session = Depends(get_db)):
     recs = data.get("records", [])
-    imported = sales_svc.import_sales(db, recs)
-    return {"imported": imported}
+    res = sales_svc.upsert_sales(db, recs)
+    return {"imported": res["inserted"] + res["updated"], **res}
+
+@api.post("/sales/upload")
+def api_sales_upload(file: UploadFile = File(...), db: Session = Depends(get_db)):
+    """Sellerboard CSV (multipart): разбирается на сервере потоково и пишется пачками."""
+    try:
+        res = sales_svc.import_sellerboard_csv(db, file.file)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"imported": res["inserted"] + res["updated"], **res}
+
+@api.get("/sales", response_model=schemas.SalesPage)
+async def api_sales_list(
+    month: int | None = None,
+    year: int | None = None,
+    limit: int | None = None,
+    cursor: str | None = None,
+    format: str = "json",
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Постранично: ?limit=&cursor= (next_cursor из прошлого ответа); ?format=ndjson — всё потоком."""
+    if format == "ndjson":
+        return _ndjson(sales_svc.iter_sales, month, year)
+    return await _apage(sales_svc.list_sales_async, db, month, year, limit=limit, cursor=cursor)
 
-@app.get("/api/sales")
-def api_sales_list(month: int | None = None, year: int | None = None, db: Session = Depends(get_db)):
-    return sales_svc.list_sales(db, month, year)
+app.include_router(api)
 
 # ---------- ADMIN ----------
 @app.post("/admin/init-db")
 def admin_init_db():
-    init_db()
-    return {"ok": True, "message": "DB initialized"}
+    return {"ok": True, "message": "DB initialized", "applied_migrations": init_db()}
+
+@app.get("/admin/gl-balances/verify")
+def admin_gl_balances_verify(db: Session = Depends(get_db)):
+    mismatches = acc_svc.verify_gl_balances(db)
+    return {"ok": not mismatches, "mismatches": mismatches}
+
+@app.post("/admin/gl-balances/rebuild")
+def admin_gl_balances_rebuild(db: Session = Depends(get_db)):
+    return {"ok": True, "rows": acc_svc.rebuild_gl_balances(db)}
+
+@app.post("/admin/metrics/backfill", status_code=202)
+def admin_metrics_backfill(start: str, end: str, workers: int | None = None):
+    """
+    Пересчёт метрик за диапазон месяцев ?start=YYYY-MM&end=YYYY-MM — в фоне;
+    статус и отчёт — GET /admin/runs/{run_id}.
+    """
+    active = jobs_svc.active_run_id(backfill_svc.JOB)
+    if active is not None:
+        return JSONResponse({"ok": False, "detail": "backfill already running", "run_id": active}, status_code=409)
+    try:
+        run_id = backfill_svc.trigger_backfill(start, end, workers)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"ok": True, "run_id": run_id, "status": "queued"}
+
+@app.get("/admin/ingest/quarantine")
+def admin_ingest_quarantine(db: Session = Depends(get_db)):
+    """SKU из отчётов Amazon, которых нет в products, со счётчиками отброшенных строк."""
+    return ingest_svc.list_quarantine(db)
+
+@app.get("/admin/ingest/watermarks")
+def admin_ingest_watermarks(db: Session = Depends(get_db)):
+    """До какого момента (max at / settlement-id) загружен каждый тип отчёта."""
+    return ingest_svc.list_watermarks(db)
+
+@app.post("/admin/run-sync", status_code=202)
+def admin_run_sync():
+    """Ставит синхронизацию (fetch -> ingest -> metrics) в фон; статус — GET /admin/runs/{run_id}."""
+    active = jobs_svc.active_run_id(scheduler_svc.JOB)
+    if active is not None:
+        return JSONResponse({"ok": False, "detail": "sync already running", "run_id": active}, status_code=409)
+    return {"ok": True, "run_id": scheduler_svc.trigger_sync("manual"), "status": "queued"}
+
+@app.get("/admin/runs")
+def admin_runs(limit: int = 50, db: Session = Depends(get_db)):
+    return jobs_svc.list_runs(db, limit=limit)
+
+@app.get("/admin/runs/stages/{stage}")
+def admin_stage_history(stage: str, limit: int = 30, db: Session = Depends(get_db)):
+    """Телеметрия одного этапа (fetch, ingest:orders, metrics ...) по последним прогонам."""
+    return jobs_svc.stage_history(db, stage, limit)
+
+@app.get("/admin/runs/{run_id}")
+def admin_run(run_id: int, db: Session = Depends(get_db)):
+    run = jobs_svc.get_run(db, run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
+    return run
+
+@app.get("/admin/sql-profile")
+def admin_sql_profile():
+    """Последние медленные запросы и кандидаты в N+1 (с функцией сервиса-источника)."""
+    return profiler.recent()
+
+@app.post("/admin/recalculate-pos")
+def admin_recalculate_pos(db: Session = Depends(get_db)):
+    n = po_svc.recalculate_all_purchase_orders(db)
+    return {"ok": True, "purchase_orders": n}
@@ -0,0 +1,105 @@
+
+"""
+Схемы ответов /api — для OpenAPI. Списки отдаются готовыми словарями через ORJSONResponse,
+в обход response_model/jsonable_encoder, поэтому схемы должны совпадать с *_dict в сервисах.
+"""
+from pydantic import BaseModel
+
+class SaleOut(BaseModel):
+    id: int
+    external_id: str | None
+    date: str
+    asin: str
+    description: str | None
+    amount: float | None
+    type: str | None
+    party: str | None
+    month: int
+    units_sold: int | None
+    cogs_per_unit: float | None
+    fba_fee_per_unit: float | None
+    amazon_fee_per_unit: float | None
+    after_fees_per_unit: float | None
+    net_per_unit: float | None
+    pay_supplier_per_unit: float | None
+    prep_per_unit: float | None
+    ship_to_amz_per_unit: float | None
+    po_id: int | None
+    po_item_id: int | None
+
+class SalesPage(BaseModel):
+    items: list[SaleOut]
+    next_cursor: str | None
+
+class GLOut(BaseModel):
+    id: int
+    date: str
+    nc_code: str
+    account_name: str
+    reference: str | None
+    description: str | None
+    amount: float | None
+    dr: float | None
+    cr: float | None
+    value: float | None
+    month: int
+    year: int
+
+class GLPage(BaseModel):
+    items: list[GLOut]
+    next_cursor: str | None
+
+class PrepaymentOut(BaseModel):
+    id: int
+    date: str
+    party: str
+    description: str | None
+    amount: float | None
+    balance: float | None
+    month: int
+    year: int
+
+class PrepaymentPage(BaseModel):
+    items: list[PrepaymentOut]
+    next_cursor: str | None
+
+class TBRow(BaseModel):
+    account: str
+    dr: float
+    cr: float
+    value: float
+    balance: float
+
+class POListItem(BaseModel):
+    id: int
+    name: str
+    supplier: str | None
+    order_date: str | None
+    status: str
+    subtotal: float | None
+    sales_tax: float | None
+    shipping: float | None
+    discount: float | None
+    labeling_total: float | None
+    total_expense: float | None
+
+class POItemOut(BaseModel):
+    """?fields= сужает набор колонок — в ответе только id и запрошенные."""
+    id: int
+    po_id: int | None = None
+    product_id: int | None = None
+    asin: str | None = None
+    listing_title: str | None = None
+    amazon_link: str | None = None
+    supplier_mfr_code: str | None = None
+    quantity: int | None = None
+    purchase_price: float | None = None
+    sales_tax: float | None = None
+    shipping: float | None = None
+    discount: float | None = None
+    unit_cogs: float | None = None
+    extended_total: float | None = None
+
+class POItemsPage(BaseModel):
+    items: list[POItemOut]
+    next_cursor: str | None
@@ -0,0 +1,97 @@
+
+"""
+Статика UI, собранная один раз при импорте: страницы и их CSS/JS лежат в памяти
+вместе с заранее сжатыми gzip/brotli вариантами и сильными ETag.
+
+- ассеты (/static/<name>.<hash>.<ext>) — адрес меняется вместе с содержимым, поэтому
+  Cache-Control: immutable на год: повторная навигация не делает запросов вовсе;
+- HTML-страницы — адрес постоянный, поэтому no-cache + ETag: повторный заход = 304.
+"""
+import gzip
+import hashlib
+import re
+from typing import Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен: без него отдаём gzip
+    brotli = None
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+# меньше этого сжатие не окупает заголовки
+MIN_COMPRESS = 512
+
+class Asset:
+    __slots__ = ("body", "media_type", "hash", "gzip", "br")
+
+    def __init__(self, body: bytes, media_type: str):
+        self.body = body
+        self.media_type = media_type
+        self.hash = hashlib.sha256(body).hexdigest()[:16]
+        self.gzip: Optional[bytes] = None
+        self.br: Optional[bytes] = None
+        if len(body) >= MIN_COMPRESS:
+            self.gzip = gzip.compress(body, compresslevel=9, mtime=0)
+            if brotli is not None:
+                self.br = brotli.compress(body, quality=11)
+
+# имя файла (app.1a2b3c.css) -> Asset
+ASSETS: dict[str, Asset] = {}
+
+def add_asset(name: str, ext: str, body: str, media_type: str) -> str:
+    """Регистрирует ассет и возвращает его URL с хэшем содержимого."""
+    asset = Asset(body.encode(), media_type)
+    filename = f"{name}.{asset.hash}.{ext}"
+    ASSETS[filename] = asset
+    return f"/static/{filename}"
+
+_SCRIPT = re.compile(r"<script>(.*?)</script>", re.S)
+
+def externalize_scripts(html: str, name: str) -> str:
+    """Inline <script> страницы -> отдельные кэшируемые JS-ассеты на том же месте документа."""
+    n = 0
+
+    def repl(m: re.Match) -> str:
+        nonlocal n
+        n += 1
+        url = add_asset(f"{name}-{n}" if n > 1 else name, "js", m.group(1), "text/javascript")
+        return f"<script src='{url}'></script>"
+
+    return _SCRIPT.sub(repl, html)
+
+def _not_modified(request: Request, asset: Asset) -> bool:
+    inm = request.headers.get("if-none-match")
+    if not inm:
+        return False
+    for tag in inm.split(","):
+        tag = tag.strip().removeprefix("W/").strip('"')
+        if tag == "*" or tag.split("-")[0] == asset.hash:
+            return True
+    return False
+
+def _accepts(request: Request, coding: str) -> bool:
+    for part in request.headers.get("accept-encoding", "").split(","):
+        token, _, params = part.strip().partition(";")
+        if token.strip() == coding:
+            return params.replace(" ", "") not in ("q=0", "q=0.0")
+    return False
+
+def asset_response(request: Request, asset: Asset, cache_control: str = IMMUTABLE) -> Response:
+    """304 по If-None-Match, иначе лучший из заранее сжатых вариантов по Accept-Encoding."""
+    headers = {"Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if _not_modified(request, asset):
+        headers["ETag"] = f'"{asset.hash}"'
+        return Response(status_code=304, headers=headers)
+    body, suffix = asset.body, ""
+    if asset.br is not None and _accepts(request, "br"):
+        body, suffix, headers["Content-Encoding"] = asset.br, "-br", "br"
+    elif asset.gzip is not None and _accepts(request, "gzip"):
+        body, suffix, headers["Content-Encoding"] = asset.gzip, "-gz", "gzip"
+    # у каждого представления свой сильный ETag; при сравнении важен только хэш
+    headers["ETag"] = f'"{asset.hash}{suffix}"'
+    return Response(body, media_type=asset.media_type, headers=headers)
@@ -9,7 +9,25 @@ class Settings(BaseModel):
     app_name: str = os.getenv("APP_NAME", "AWM")
     app_env: str = os.getenv("APP_ENV", "dev")
     db_url: str = os.getenv("DB_URL", "sqlite:///./awm.db")
+    db_pool_size: int = int(os.getenv("DB_POOL_SIZE", "5"))              # только серверные БД
+    db_max_overflow: int = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    db_pool_recycle: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))     # сек
+    db_pool_timeout: int = int(os.getenv("DB_POOL_TIMEOUT", "30"))       # сек
+    sqlite_busy_timeout_ms: int = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    sqlite_cache_mb: int = int(os.getenv("SQLITE_CACHE_MB", "64"))
+    sqlite_mmap_mb: int = int(os.getenv("SQLITE_MMAP_MB", "256"))
     schedule_cron_daily: str = os.getenv("SCHEDULE_CRON_DAILY", "0 3 * * *")
+    scheduler_enabled: bool = os.getenv("SCHEDULER_ENABLED", "0") == "1"
+    scheduler_run_on_start: bool = os.getenv("SCHEDULER_RUN_ON_START", "0") == "1"
+    telemetry_tracemalloc: bool = os.getenv("TELEMETRY_TRACEMALLOC", "0") == "1"
+    api_gzip_min_bytes: int = int(os.getenv("API_GZIP_MIN_BYTES", "1024"))    # сжимать ответы /api крупнее
+    request_query_warn: int = int(os.getenv("REQUEST_QUERY_WARN", "25"))   # SQL-запросов на HTTP-запрос
+    sql_slow_ms: float = float(os.getenv("SQL_SLOW_MS", "250"))
+    sql_profile_sample: float = float(os.getenv("SQL_PROFILE_SAMPLE", "0.1"))   # доля единиц работы для поиска N+1
+    sql_nplus1_min: int = int(os.getenv("SQL_NPLUS1_MIN", "10"))               # повторов одной формы запроса
+    report_parser: str = os.getenv("REPORT_PARSER", "python")  # python | pandas
+    ingest_lookback_days: int = int(os.getenv("INGEST_LOOKBACK_DAYS", "30"))        # первый прогон без watermark
+    ingest_overlap_minutes: int = int(os.getenv("INGEST_OVERLAP_MINUTES", "60"))    # перекрытие окон (поздние строки)
     spapi_refresh_token: str | None = os.getenv("SPAPI_REFRESH_TOKEN")
     spapi_client_id: str | None = os.getenv("SPAPI_CLIENT_ID")
     spapi_client_secret: str | None = os.getenv("SPAPI_CLIENT_SECRET")
@@ -17,5 +35,12 @@ class Settings(BaseModel):
     aws_secret_key: str | None = os.getenv("AWS_SECRET_KEY")
     aws_role_arn: str | None = os.getenv("AWS_ROLE_ARN")
     marketplace_id: str = os.getenv("MARKETPLACE_ID", "ATVPDKIKX0DER")
+    spapi_endpoint: str = os.getenv("SPAPI_ENDPOINT", "https://sellingpartnerapi-na.amazon.com")
+    spapi_lwa_endpoint: str = os.getenv("SPAPI_LWA_ENDPOINT", "https://api.amazon.com/auth/o2/token")
+    spapi_poll_interval: float = float(os.getenv("SPAPI_POLL_INTERVAL", "15"))
+    report_dir: str = os.getenv("REPORT_DIR", "./data/reports")
+    report_cache_dir: str = os.getenv("REPORT_CACHE_DIR", "./data/report_cache")
+    report_cache_max_mb: int = int(os.getenv("REPORT_CACHE_MAX_MB", "2048"))
+    report_cache_max_age_days: float = float(os.getenv("REPORT_CACHE_MAX_AGE_DAYS", "90"))
 
 settings = Settings()
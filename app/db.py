@@ -1,13 +1,89 @@
-from sqlalchemy import create_engine
+import logging
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, URL, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, Session
+from starlette.concurrency import run_in_threadpool
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
 
 # --- Конфигурация БД ---
-SQLALCHEMY_DATABASE_URL = "sqlite:///./awm.db"
+SQLALCHEMY_DATABASE_URL = settings.db_url
+
+
+def _sqlite_pragmas(dbapi_conn, _record):
+    """
+    WAL: чтения дашборда не ждут длинный ingest (один писатель + параллельные читатели);
+    synchronous=NORMAL в WAL безопасен для целостности и сильно дешевле FULL на commit.
+    """
+    cur = dbapi_conn.cursor()
+    try:
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout_ms)}")
+        cur.execute(f"PRAGMA cache_size=-{int(settings.sqlite_cache_mb * 1024)}")  # отрицательное = КиБ
+        cur.execute(f"PRAGMA mmap_size={int(settings.sqlite_mmap_mb * 1024 * 1024)}")
+        cur.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cur.close()
+
+
+def _pool_kw(kw: dict) -> dict:
+    """Пул соединений серверной БД из DB_POOL_*; pre_ping — от обрывов после простоя."""
+    kw.setdefault("pool_size", settings.db_pool_size)
+    kw.setdefault("max_overflow", settings.db_max_overflow)
+    kw.setdefault("pool_recycle", settings.db_pool_recycle)
+    kw.setdefault("pool_timeout", settings.db_pool_timeout)
+    kw.setdefault("pool_pre_ping", True)
+    return kw
+
+
+def make_engine(url: str | None = None, **kw) -> Engine:
+    """
+    Engine по DB_URL. SQLite — pragmas на каждое соединение; серверные БД (PostgreSQL) —
+    пул соединений, см. _pool_kw().
+    """
+    url = make_url(url or settings.db_url)
+    if url.get_backend_name() == "sqlite":
+        kw.setdefault("connect_args", {"check_same_thread": False})
+        eng = create_engine(url, **kw)
+        if url.database and url.database != ":memory:":
+            event.listen(eng, "connect", _sqlite_pragmas)
+        return eng
+    return create_engine(url, **_pool_kw(kw))
+
+
+# async-драйвер для того же DB_URL
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg"}
+
+
+def async_url(url: str | URL) -> URL:
+    """sqlite:///x.db -> sqlite+aiosqlite:///x.db, postgresql+psycopg2://... -> postgresql+asyncpg://..."""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {backend}")
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
+
+def make_async_engine(url: str | None = None, **kw) -> AsyncEngine:
+    """
+    AsyncEngine для read-эндпоинтов: запрос не занимает поток из threadpool на время похода в БД.
+    Те же pragmas / настройки пула, что у make_engine().
+    """
+    url = async_url(url or settings.db_url)
+    if url.get_backend_name() == "sqlite":
+        eng = create_async_engine(url, **kw)
+        if url.database and url.database != ":memory:":
+            event.listen(eng.sync_engine, "connect", _sqlite_pragmas)
+        return eng
+    return create_async_engine(url, **_pool_kw(kw))
+
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    connect_args={"check_same_thread": False},  # для SQLite
-)
+engine = make_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
@@ -20,10 +96,79 @@ def get_db():
         db.close()
 
 
+# async engine создаётся при первом async-запросе: CLI, планировщик и sync-пути
+# не требуют async-драйвера
+_async_engine: AsyncEngine | None = None
+_async_session: async_sessionmaker | None = None
+_async_unavailable = False
+
+
+def get_async_engine() -> AsyncEngine | None:
+    """AsyncEngine для DB_URL; None — async-драйвер не настроен или не установлен."""
+    global _async_engine, _async_session, _async_unavailable
+    if _async_engine is None and not _async_unavailable:
+        try:
+            _async_engine = make_async_engine()
+        except (ValueError, ImportError) as e:
+            logger.warning("async DB engine unavailable (%s); async endpoints use the sync session", e)
+            _async_unavailable = True
+            return None
+        _async_session = async_sessionmaker(_async_engine, autoflush=False, expire_on_commit=False)
+    return _async_engine
+
+
+async def dispose_async_engine() -> None:
+    global _async_engine, _async_session
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = _async_session = None
+
+
+class _ThreadedSession:
+    """
+    Замена AsyncSession без async-драйвера: sync Session, запрос выполняется в threadpool,
+    результат буферизуется там же (итерация по нему уже не ходит в БД из event loop).
+    Async-сервисы используют только await db.execute(stmt).
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    async def execute(self, statement, params=None):
+        def run():
+            return self.db.execute(statement, params).freeze()
+        return (await run_in_threadpool(run))()
+
+
+async def get_async_db():
+    """Dependency для async-эндпоинтов (только чтение)."""
+    if get_async_engine() is not None:
+        async with _async_session() as db:
+            yield db
+        return
+    db = SessionLocal()
+    try:
+        yield _ThreadedSession(db)
+    finally:
+        await run_in_threadpool(db.close)
+
+
 def init_db():
     """
-    Создаёт недостающие таблицы. Импортирует модели только внутри функции,
-    чтобы избежать циклического импорта.
+    Приводит схему к актуальной версии (app.migrations). На актуальной БД — один
+    запрос к schema_version. Импорт внутри функции, чтобы избежать циклического импорта.
+    """
+    from app.migrations import migrate  # импорт внутри функции, не вверху
+    return migrate(engine)
+
+
+def dialect_insert(db: Session, table):
+    """
+    INSERT с поддержкой ON CONFLICT для текущего диалекта (SQLite / PostgreSQL).
+    Оба варианта дают .on_conflict_do_update()/.on_conflict_do_nothing() и .excluded.
     """
-    from app.models import Base  # импорт внутри функции, не вверху
-    Base.metadata.create_all(bind=engine)
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
@@ -0,0 +1,158 @@
+
+"""
+Версионные миграции схемы. Применённые версии хранятся в schema_version; на старте
+init_db() читает max(version) и, если БД актуальна, больше ничего не делает.
+
+Миграция — функция от Connection, выполняется в своей транзакции. Все миграции
+идемпотентны (проверяют наличие колонки/индекса), потому что базовая (1) создаёт
+таблицы по текущим моделям, и на новой БД последующим шагам делать уже нечего.
+Новая миграция — функция + строка в MIGRATIONS с следующим номером.
+"""
+import logging
+from datetime import datetime
+from typing import Callable, Optional
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+from .models import Base
+
+logger = logging.getLogger(__name__)
+
+# отдельные метаданные: таблица служебная, в Base (и create_all) не входит
+_meta = MetaData()
+schema_version = Table(
+    "schema_version", _meta,
+    Column("version", Integer, primary_key=True),
+    Column("name", String(128), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+# -------- helpers --------
+
+def _has_column(conn: Connection, table: str, column: str) -> bool:
+    return any(c["name"] == column for c in inspect(conn).get_columns(table))
+
+def _add_column(conn: Connection, table: str, column: str) -> bool:
+    """ALTER TABLE ADD COLUMN по описанию колонки в моделях (без NOT NULL/DEFAULT — для старых строк)."""
+    if _has_column(conn, table, column):
+        return False
+    col = Base.metadata.tables[table].c[column]
+    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {col.name} {col.type.compile(conn.dialect)}"))
+    return True
+
+def _create_index(conn: Connection, table: str, name: str) -> None:
+    """Индекс, объявленный в моделях (Index(...) или index=True), если его ещё нет."""
+    index = next(i for i in Base.metadata.tables[table].indexes if i.name == name)
+    index.create(conn, checkfirst=True)
+
+# -------- миграции --------
+
+def _baseline(conn: Connection) -> None:
+    """Недостающие таблицы по текущим моделям (на новой БД — вся схема)."""
+    Base.metadata.create_all(conn)
+
+def _dedupe_keys(conn: Connection) -> None:
+    """
+    Колонки и уникальные ключи, появившиеся после создания старых БД: external_key для
+    дедупа ingest (sales/fees), уникальность снимков остатков, статистика job_runs/job_run_stages.
+    """
+    for table in ("sales", "fees"):
+        if _add_column(conn, table, "external_key"):
+            conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS uq_{table}_external_key ON {table} (external_key)"))
+    existing = {i["name"] for i in inspect(conn).get_indexes("inventory_snapshots")}
+    existing |= {u["name"] for u in inspect(conn).get_unique_constraints("inventory_snapshots")}
+    if "uq_inventory_snapshots_product_fc_at" not in existing:
+        # дубликаты от старого ingest мешают уникальному индексу — оставляем первую строку
+        conn.execute(text(
+            "DELETE FROM inventory_snapshots WHERE id NOT IN ("
+            "SELECT MIN(id) FROM inventory_snapshots GROUP BY product_id, fc, at)"
+        ))
+        conn.execute(text(
+            "CREATE UNIQUE INDEX uq_inventory_snapshots_product_fc_at ON inventory_snapshots (product_id, fc, at)"
+        ))
+    _add_column(conn, "job_runs", "peak_rss_mb")
+    for column in ("queries", "db_s", "peak_mem_mb", "spans"):
+        _add_column(conn, "job_run_stages", column)
+
+def _read_indexes(conn: Connection) -> None:
+    """Индексы под горячие фильтры (период + сортировка) и внешние ключи позиций PO."""
+    _create_index(conn, "sales_records", "ix_sales_records_period_date")
+    _create_index(conn, "gl_transactions", "ix_gl_transactions_period_account")
+    _create_index(conn, "prepayments", "ix_prepayments_period")
+    _create_index(conn, "purchase_order_items", "ix_purchase_order_items_po_id")
+    _create_index(conn, "labeling_costs", "ix_labeling_costs_po_item_id")
+
+def _gl_balances(conn: Connection) -> None:
+    """Первичное заполнение gl_balances для БД, где GL был до появления таблицы (раньше — на каждом старте)."""
+    from .services.accounting import ensure_gl_balances
+    with Session(bind=conn) as db:
+        ensure_gl_balances(db)
+
+def _table_versions(conn: Connection) -> None:
+    """Счётчики изменений таблиц для ETag списков."""
+    Base.metadata.tables["table_versions"].create(conn, checkfirst=True)
+
+def _sales_external_id_unique(conn: Connection) -> None:
+    """
+    Уникальный external_id в sales_records — цель ON CONFLICT в upsert_sales. В моделях он
+    unique давно, но старые БД создавались с обычным индексом ix_sales_records_external_id.
+    """
+    index = next(
+        (i for i in inspect(conn).get_indexes("sales_records") if i["name"] == "ix_sales_records_external_id"), None
+    )
+    if index is not None and index["unique"]:
+        return
+    # дубликаты от старых загрузок мешают уникальному индексу — оставляем последнюю строку
+    conn.execute(text(
+        "DELETE FROM sales_records WHERE external_id IS NOT NULL AND id NOT IN ("
+        "SELECT MAX(id) FROM sales_records WHERE external_id IS NOT NULL GROUP BY external_id)"
+    ))
+    if index is not None:
+        conn.execute(text("DROP INDEX ix_sales_records_external_id"))
+    _create_index(conn, "sales_records", "ix_sales_records_external_id")
+
+def _revision_columns(conn: Connection) -> None:
+    """updated_at/prev_at в sales и fees: ревизии строк отчётов для инкрементального пересчёта метрик."""
+    for table in ("sales", "fees"):
+        _add_column(conn, table, "updated_at")
+        _add_column(conn, table, "prev_at")
+
+MIGRATIONS: list[tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "baseline", _baseline),
+    (2, "dedupe keys and job stats columns", _dedupe_keys),
+    (3, "read path indexes", _read_indexes),
+    (4, "gl_balances backfill", _gl_balances),
+    (5, "table change counters", _table_versions),
+    (6, "unique sales_records.external_id", _sales_external_id_unique),
+    (7, "sales/fees revision columns", _revision_columns),
+]
+LATEST = MIGRATIONS[-1][0]
+
+# -------- runner --------
+
+def current_version(conn: Connection) -> int:
+    if not inspect(conn).has_table("schema_version"):
+        return 0
+    return conn.scalar(select(func.max(schema_version.c.version))) or 0
+
+def migrate(engine: Engine, target: Optional[int] = None) -> list[int]:
+    """Применяет миграции новее текущей версии (до target). Возвращает применённые версии."""
+    target = LATEST if target is None else target
+    with engine.connect() as conn:
+        version = current_version(conn)
+    if version >= target:
+        return []
+    with engine.begin() as conn:
+        schema_version.create(conn, checkfirst=True)
+    applied = []
+    for number, name, fn in MIGRATIONS:
+        if number <= version or number > target:
+            continue
+        with engine.begin() as conn:
+            fn(conn)
+            conn.execute(schema_version.insert().values(version=number, name=name, applied_at=datetime.utcnow()))
+        logger.info("schema migration %d (%s) applied", number, name)
+        applied.append(number)
+    return applied
@@ -9,6 +9,8 @@ from sqlalchemy import (
     Enum,
     ForeignKey,
     Text,
+    Index,
+    UniqueConstraint,
 )
 from sqlalchemy.orm import declarative_base, relationship
 import enum
@@ -23,6 +25,13 @@ class POStatus(enum.Enum):
     CLOSED = "CLOSED"
 
 
+class FeeType(enum.Enum):
+    FBA = "FBA"
+    REFERRAL = "REFERRAL"
+    STORAGE = "STORAGE"
+    OTHER = "OTHER"
+
+
 # ---------- ПОСТАВЩИК ----------
 class Supplier(Base):
     __tablename__ = "suppliers"
@@ -60,6 +69,104 @@ class Product(Base):
         return f"<Product(asin={self.asin}, cost={self.cost})>"
 
 
+# ---------- AMAZON: ОСТАТКИ / ПРОДАЖИ / КОМИССИИ (из отчётов SP-API) ----------
+class InventorySnapshot(Base):
+    __tablename__ = "inventory_snapshots"
+    __table_args__ = (UniqueConstraint("product_id", "fc", "at", name="uq_inventory_snapshots_product_fc_at"),)
+
+    id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, ForeignKey("products.id"), index=True, nullable=False)
+    qty = Column(Integer, default=0)
+    fc = Column(String(64), default="FBA")
+    at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class Sale(Base):
+    __tablename__ = "sales"
+
+    id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, ForeignKey("products.id"), index=True, nullable=False)
+    units = Column(Integer, default=0)
+    price = Column(Float, default=0.0)
+    at = Column(DateTime, default=datetime.utcnow, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)  # когда загружено (для инкрементального пересчёта)
+    updated_at = Column(DateTime)                           # когда строку изменила ревизия из отчёта
+    prev_at = Column(DateTime)                              # at до ревизии (строка могла уйти в другой месяц)
+    external_key = Column(String(255), unique=True)         # натуральный ключ строки отчёта (дедуп при ingest)
+
+
+class Fee(Base):
+    __tablename__ = "fees"
+
+    id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, ForeignKey("products.id"), index=True, nullable=False)
+    type = Column(Enum(FeeType), default=FeeType.OTHER)
+    amount = Column(Float, default=0.0)
+    at = Column(DateTime, default=datetime.utcnow, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime)
+    prev_at = Column(DateTime)
+    external_key = Column(String(255), unique=True)
+
+
+# ---------- WATERMARK ИНКРЕМЕНТАЛЬНОГО INGEST (по типу отчёта) ----------
+class IngestWatermark(Base):
+    __tablename__ = "ingest_watermarks"
+
+    report_type = Column(String(64), primary_key=True)    # inventory / orders / settlement
+    last_at = Column(DateTime)                            # max(at) загруженных строк
+    last_settlement_id = Column(String(64))               # для settlement: последний обработанный settlement-id
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+# ---------- КАРАНТИН: строки отчётов с неизвестным SKU ----------
+class IngestQuarantine(Base):
+    __tablename__ = "ingest_quarantine"
+    __table_args__ = (UniqueConstraint("report_type", "sku", name="uq_ingest_quarantine_report_sku"),)
+
+    id = Column(Integer, primary_key=True)
+    report_type = Column(String(64), nullable=False)      # inventory / orders / settlement
+    sku = Column(String(255), nullable=False)
+    row_count = Column(Integer, default=0)                # сколько строк отброшено за всё время
+    first_seen = Column(DateTime, default=datetime.utcnow)
+    last_seen = Column(DateTime, default=datetime.utcnow)
+
+
+# ---------- КЭШ ДОКУМЕНТОВ ОТЧЁТОВ (файлы лежат в REPORT_CACHE_DIR по sha256) ----------
+class ReportDocument(Base):
+    __tablename__ = "report_documents"
+    __table_args__ = (
+        UniqueConstraint("report_type", "window_start", "window_end", "sha256", name="uq_report_documents_key"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    report_type = Column(String(64), nullable=False)      # inventory / orders / settlement
+    window_start = Column(DateTime)                       # окно данных, запрошенное у SP-API
+    window_end = Column(DateTime)
+    sha256 = Column(String(64), nullable=False, index=True)  # хэш распакованного содержимого
+    path = Column(String(1024))                           # None — файл вытеснен из кэша
+    size = Column(Integer, default=0)                     # байт на диске (gzip)
+    fetched_at = Column(DateTime, default=datetime.utcnow)
+    ingested_at = Column(DateTime)
+    rows = Column(Integer)                                # сколько строк записал ingest
+
+
+# ---------- МЕТРИКИ ПО SKU ЗА ПЕРИОД ----------
+class MetricSnapshot(Base):
+    __tablename__ = "metric_snapshots"
+    __table_args__ = (UniqueConstraint("product_id", "period", name="uq_metric_snapshots_product_period"),)
+
+    id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    period = Column(String(7), nullable=False, index=True)  # YYYY-MM
+    revenue = Column(Float, default=0.0)
+    cogs = Column(Float, default=0.0)
+    fees = Column(Float, default=0.0)
+    profit = Column(Float, default=0.0)
+    roi = Column(Float, default=0.0)
+    at = Column(DateTime, default=datetime.utcnow)          # время расчёта
+
+
 # ---------- PURCHASE ORDER ----------
 class PurchaseOrder(Base):
     __tablename__ = "purchase_orders"
@@ -90,7 +197,7 @@ class PurchaseOrderItem(Base):
     __tablename__ = "purchase_order_items"
 
     id = Column(Integer, primary_key=True)
-    po_id = Column(Integer, ForeignKey("purchase_orders.id"))
+    po_id = Column(Integer, ForeignKey("purchase_orders.id"), index=True)
     product_id = Column(Integer, ForeignKey("products.id"), nullable=True)
 
     asin = Column(String(64), nullable=False)
@@ -119,7 +226,7 @@ class LabelingCost(Base):
     __tablename__ = "labeling_costs"
 
     id = Column(Integer, primary_key=True)
-    po_item_id = Column(Integer, ForeignKey("purchase_order_items.id"))
+    po_item_id = Column(Integer, ForeignKey("purchase_order_items.id"), index=True)
     note = Column(String(255))
     cost_total = Column(Float, default=0.0)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -131,6 +238,7 @@ class LabelingCost(Base):
 # ---------- GENERAL LEDGER (GL) ----------
 class GLTransaction(Base):
     __tablename__ = "gl_transactions"
+    __table_args__ = (Index("ix_gl_transactions_period_account", "year", "month", "account_name"),)
 
     id = Column(Integer, primary_key=True)
     date = Column(DateTime, default=datetime.utcnow, nullable=False)
@@ -151,9 +259,29 @@ class GLTransaction(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
 
+# ---------- GL BALANCES (обороты по счёту за месяц, ведутся инкрементально) ----------
+class GLBalance(Base):
+    __tablename__ = "gl_balances"
+    __table_args__ = (
+        UniqueConstraint("account_name", "year", "month", name="uq_gl_balances_account_period"),
+        Index("ix_gl_balances_period", "year", "month"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    account_name = Column(String(255), nullable=False)
+    year = Column(Integer, nullable=False)
+    month = Column(Integer, nullable=False)
+
+    dr = Column(Float, default=0.0)
+    cr = Column(Float, default=0.0)
+    value = Column(Float, default=0.0)
+    txn_count = Column(Integer, default=0)                # сколько проводок вошло в строку
+
+
 # ---------- PREPAYMENTS ----------
 class Prepayment(Base):
     __tablename__ = "prepayments"
+    __table_args__ = (Index("ix_prepayments_period", "year", "month"),)
 
     id = Column(Integer, primary_key=True)
     date = Column(DateTime, default=datetime.utcnow, nullable=False)
@@ -171,9 +299,10 @@ class Prepayment(Base):
 # ---------- SALES ----------
 class SalesRecord(Base):
     __tablename__ = "sales_records"
+    __table_args__ = (Index("ix_sales_records_period_date", "year", "month", "date"),)
 
     id = Column(Integer, primary_key=True)               # наш внутренний ID
-    external_id = Column(String(128), index=True)        # ID из Amazon/Sellerboard
+    external_id = Column(String(128), unique=True, index=True)  # ID из Amazon/Sellerboard
     date = Column(DateTime, nullable=False)
 
     asin = Column(String(64), index=True, nullable=False)
@@ -202,3 +331,58 @@ class SalesRecord(Base):
     po_item_id = Column(Integer, ForeignKey("purchase_order_items.id"), nullable=True)
 
     created_at = Column(DateTime, default=datetime.utcnow)
+
+
+# ---------- ЗАПУСКИ ФОНОВЫХ ЗАДАЧ (daily sync и т.п.) ----------
+class JobRun(Base):
+    __tablename__ = "job_runs"
+
+    id = Column(Integer, primary_key=True)
+    job = Column(String(64), nullable=False, index=True)   # daily_sync
+    trigger = Column(String(32))                           # cron / manual / startup
+    status = Column(String(16), nullable=False, default="queued")  # queued / running / success / failed / skipped
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    rows = Column(Integer, default=0)
+    error = Column(Text)
+    peak_rss_mb = Column(Float)                            # пиковый RSS процесса к концу прогона
+
+    stages = relationship("JobRunStage", back_populates="run", order_by="JobRunStage.id", cascade="all, delete-orphan")
+
+
+class JobRunStage(Base):
+    __tablename__ = "job_run_stages"
+
+    id = Column(Integer, primary_key=True)
+    run_id = Column(Integer, ForeignKey("job_runs.id"), index=True, nullable=False)
+    stage = Column(String(64), nullable=False)             # fetch / ingest:orders / metrics ...
+    status = Column(String(16), nullable=False, default="running")
+    started_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime)
+    rows = Column(Integer, default=0)                      # строк обработано этапом
+    error = Column(Text)
+    queries = Column(Integer)                              # SQL-запросов (executemany = 1)
+    db_s = Column(Float)                                   # время внутри cursor.execute
+    peak_mem_mb = Column(Float)                            # пик tracemalloc (TELEMETRY_TRACEMALLOC=1)
+    spans = Column(Text)                                   # JSON: {"parse": s, "write": s, ...}
+
+    run = relationship("JobRun", back_populates="stages")
+
+
+# ---------- СЧЁТЧИКИ ИЗМЕНЕНИЙ ТАБЛИЦ (ETag для списков, см. services/changes.py) ----------
+class TableVersion(Base):
+    __tablename__ = "table_versions"
+
+    name = Column(String(64), primary_key=True)           # имя таблицы
+    version = Column(Integer, nullable=False, default=0)  # +1 на каждый пишущий flush / statement
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+# ---------- БЛОКИРОВКА ОТ ПЕРЕКРЫТИЯ ЗАПУСКОВ (работает и между процессами) ----------
+class JobLock(Base):
+    __tablename__ = "job_locks"
+
+    name = Column(String(64), primary_key=True)
+    run_id = Column(Integer)
+    acquired_at = Column(DateTime, default=datetime.utcnow)
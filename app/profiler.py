@@ -0,0 +1,130 @@
+
+"""
+Профайлер SQL поверх событий Engine (вызывается из app.telemetry):
+
+- slow-query log: запрос дольше SQL_SLOW_MS пишется в лог вместе с функцией сервиса,
+  из которой он пришёл (проход по стеку делается только для медленных запросов);
+- N+1: в пределах единицы работы (HTTP-запрос, этап задачи) считаются одинаковые по форме
+  запросы; форма, повторившаяся SQL_NPLUS1_MIN раз, — кандидат в N+1.
+
+Подсчёт форм включается для доли единиц работы SQL_PROFILE_SAMPLE (решение принимается
+один раз на единицу), так что под нагрузкой накладные расходы — один random() на запрос.
+"""
+import logging
+import random
+import re
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Iterator, Optional
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# последние находки — для /admin/sql-profile
+RECENT = 100
+_slow: deque = deque(maxlen=RECENT)
+_nplus1: deque = deque(maxlen=RECENT)
+_lock = threading.Lock()
+
+class _Unit:
+    __slots__ = ("name", "shapes", "origins")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.shapes: dict[str, int] = {}
+        self.origins: dict[str, str] = {}
+
+_unit: ContextVar[Optional[_Unit]] = ContextVar("profiler_unit", default=None)
+
+# -------- форма запроса --------
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PARAMS = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)|\(\s*%\(\w+\)s(?:\s*,\s*%\(\w+\)s)*\s*\)")
+_SPACE = re.compile(r"\s+")
+
+@lru_cache(maxsize=2048)
+def shape(statement: str) -> str:
+    """Нормализованный текст: литералы -> ?, списки IN (?, ?, ...) -> (?), пробелы схлопнуты."""
+    s = _STRING.sub("?", statement)
+    s = _NUMBER.sub("?", s)
+    s = _PARAMS.sub("(?)", s)
+    return _SPACE.sub(" ", s).strip()
+
+# -------- источник запроса --------
+
+_SKIP_MODULES = ("app.profiler", "app.telemetry", "app.db")
+
+def origin(depth: int = 2) -> str:
+    """
+    Ближайшая функция app.services.* в стеке (иначе — первая функция app.*),
+    в виде "module.func:line".
+    """
+    f = sys._getframe(depth)
+    fallback = None
+    while f is not None:
+        mod = f.f_globals.get("__name__", "")
+        if mod.startswith("app.services."):
+            return f"{mod}.{f.f_code.co_name}:{f.f_lineno}"
+        if fallback is None and mod.startswith("app.") and not mod.startswith(_SKIP_MODULES):
+            fallback = f"{mod}.{f.f_code.co_name}:{f.f_lineno}"
+        f = f.f_back
+    return fallback or "?"
+
+# -------- хуки --------
+
+def record(statement: str, elapsed: float, executemany: bool) -> None:
+    """Вызывается после каждого запроса (см. telemetry._after_cursor_execute)."""
+    if elapsed * 1000 >= settings.sql_slow_ms:
+        where = origin()
+        logger.warning("slow SQL %.0fms in %s: %s", elapsed * 1000, where, _SPACE.sub(" ", statement)[:500])
+        with _lock:
+            _slow.append({"at": time.time(), "ms": round(elapsed * 1000, 1), "origin": where,
+                          "statement": shape(statement)[:1000]})
+    u = _unit.get()
+    if u is None or executemany:   # executemany — один батч, а не N+1
+        return
+    key = shape(statement)
+    n = u.shapes.get(key, 0) + 1
+    u.shapes[key] = n
+    if n == settings.sql_nplus1_min:
+        u.origins[key] = origin()
+
+@contextmanager
+def unit(name: str) -> Iterator[None]:
+    """Единица работы для поиска N+1; попадает в выборку с вероятностью SQL_PROFILE_SAMPLE."""
+    rate = settings.sql_profile_sample
+    if rate <= 0 or (rate < 1 and random.random() >= rate):
+        yield
+        return
+    u = _Unit(name)
+    token = _unit.set(u)
+    try:
+        yield
+    finally:
+        _unit.reset(token)
+        _report(u)
+
+def _report(u: _Unit) -> None:
+    for key, where in u.origins.items():
+        n = u.shapes[key]
+        logger.warning("N+1 candidate in %s: %d× from %s: %s", u.name, n, where, key[:300])
+        with _lock:
+            _nplus1.append({"at": time.time(), "unit": u.name, "count": n, "origin": where,
+                            "statement": key[:1000]})
+
+def recent() -> dict:
+    with _lock:
+        return {
+            "slow_ms": settings.sql_slow_ms,
+            "sample": settings.sql_profile_sample,
+            "nplus1_min": settings.sql_nplus1_min,
+            "slow": list(reversed(_slow)),
+            "nplus1": list(reversed(_nplus1)),
+        }
@@ -1,38 +1,69 @@
 from __future__ import annotations
-from typing import Optional, List, Dict
+from typing import Iterator, Optional, List, Dict
 from datetime import datetime
 from sqlalchemy.orm import Session
-from sqlalchemy import func, select
+from sqlalchemy import Row, delete, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.models import GLTransaction, Prepayment
+from app.db import dialect_insert
+from app.models import GLTransaction, GLBalance, Prepayment
+from app.services.paging import keyset_page, keyset_page_async, iter_rows
 
 # ------- GL -------
-def list_gl(db: Session, month: Optional[int] = None, year: Optional[int] = None) -> List[dict]:
-    q = db.query(GLTransaction)
+_GL_COLUMNS = (
+    GLTransaction.id, GLTransaction.date, GLTransaction.nc_code, GLTransaction.account_name,
+    GLTransaction.reference, GLTransaction.description, GLTransaction.amount, GLTransaction.dr,
+    GLTransaction.cr, GLTransaction.value, GLTransaction.month, GLTransaction.year,
+)
+
+def _gl_query(month: Optional[int], year: Optional[int]):
+    q = select(*_GL_COLUMNS)
     if year:
-        q = q.filter(GLTransaction.year == year)
+        q = q.where(GLTransaction.year == year)
     if month:
-        q = q.filter(GLTransaction.month == month)
-    q = q.order_by(GLTransaction.date.desc(), GLTransaction.id.desc())
-    out = []
-    for r in q.all():
-        out.append({
-            "id": r.id,
-            "date": r.date.isoformat(),
-            "nc_code": r.nc_code,
-            "account_name": r.account_name,
-            "reference": r.reference,
-            "description": r.description,
-            "amount": r.amount,
-            "dr": r.dr,
-            "cr": r.cr,
-            "value": r.value,
-            "month": r.month,
-            "year": r.year
-        })
-    return out
+        q = q.where(GLTransaction.month == month)
+    return q
 
-def create_gl(db: Session, payload: dict) -> GLTransaction:
+def _gl_dict(r: Row) -> dict:
+    return {
+        "id": r.id,
+        "date": r.date.isoformat(),
+        "nc_code": r.nc_code,
+        "account_name": r.account_name,
+        "reference": r.reference,
+        "description": r.description,
+        "amount": r.amount,
+        "dr": r.dr,
+        "cr": r.cr,
+        "value": r.value,
+        "month": r.month,
+        "year": r.year
+    }
+
+def list_gl(
+    db: Session,
+    month: Optional[int] = None,
+    year: Optional[int] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+) -> dict:
+    return keyset_page(db, _gl_query(month, year), GLTransaction.date, GLTransaction.id, _gl_dict, limit, cursor)
+
+async def list_gl_async(
+    db: AsyncSession,
+    month: Optional[int] = None,
+    year: Optional[int] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+) -> dict:
+    return await keyset_page_async(
+        db, _gl_query(month, year), GLTransaction.date, GLTransaction.id, _gl_dict, limit, cursor
+    )
+
+def iter_gl(db: Session, month: Optional[int] = None, year: Optional[int] = None) -> Iterator[dict]:
+    return iter_rows(db, _gl_query(month, year), GLTransaction.date, GLTransaction.id, _gl_dict)
+
+def _gl_fields(payload: dict) -> dict:
     def f(x, default=0.0):
         if x in (None, ""): return default
         try: return float(str(x).replace(",", "."))
@@ -48,42 +79,178 @@ def create_gl(db: Session, payload: dict) -> GLTransaction:
         except:
             dt_obj = datetime.utcnow()
 
-    r = GLTransaction(
+    amount = f(payload.get("amount"))
+    dr, cr = f(payload.get("dr")), f(payload.get("cr"))
+    # форма GL на странице шлёт amount + drcr ("Dr"/"Cr") вместо dr/cr
+    drcr = (payload.get("drcr") or "").lower()
+    if drcr == "dr" and not dr:
+        dr = amount
+    elif drcr == "cr" and not cr:
+        cr = amount
+
+    return dict(
         date=dt_obj,
-        nc_code=payload["nc_code"],
+        nc_code=payload.get("nc_code") or payload["nc"],
         account_name=payload["account_name"],
         reference=payload.get("reference"),
         description=payload.get("description"),
-        amount=f(payload.get("amount")),
-        dr=f(payload.get("dr")),
-        cr=f(payload.get("cr")),
+        amount=amount,
+        dr=dr,
+        cr=cr,
         value=f(payload.get("value")),
         month=int(payload.get("month") or dt_obj.month),
         year=int(payload.get("year") or dt_obj.year),
     )
+
+def create_gl(db: Session, payload: dict) -> GLTransaction:
+    r = GLTransaction(**_gl_fields(payload))
     db.add(r)
+    _apply_balance(db, r, +1)
     db.commit()
     db.refresh(r)
     return r
 
-def tb(db: Session, month: Optional[int], year: Optional[int]) -> List[Dict]:
-    """
-    Trial Balance — агрегируем GL по account_name (или по nc_code).
-    """
-    q = db.query(
-        GLTransaction.account_name.label("account"),
-        func.coalesce(func.sum(GLTransaction.dr), 0.0).label("dr_sum"),
-        func.coalesce(func.sum(GLTransaction.cr), 0.0).label("cr_sum"),
-        func.coalesce(func.sum(GLTransaction.value), 0.0).label("val_sum"),
+def update_gl(db: Session, txn_id: int, payload: dict) -> Optional[GLTransaction]:
+    r = db.get(GLTransaction, txn_id)
+    if r is None:
+        return None
+    _apply_balance(db, r, -1)
+    for k, v in _gl_fields(payload).items():
+        setattr(r, k, v)
+    _apply_balance(db, r, +1)
+    db.commit()
+    db.refresh(r)
+    return r
+
+def delete_gl(db: Session, txn_id: int) -> bool:
+    r = db.get(GLTransaction, txn_id)
+    if r is None:
+        return False
+    _apply_balance(db, r, -1)
+    db.delete(r)
+    db.commit()
+    return True
+
+# ------- GL balances (материализованные обороты по счёту/месяцу) -------
+def _apply_balance(db: Session, r: GLTransaction, sign: int) -> None:
+    """Добавляет (sign=+1) или вычитает (sign=-1) проводку из строки gl_balances её периода."""
+    stmt = dialect_insert(db, GLBalance.__table__).values(
+        account_name=r.account_name,
+        year=r.year,
+        month=r.month,
+        dr=sign * (r.dr or 0.0),
+        cr=sign * (r.cr or 0.0),
+        value=sign * (r.value or 0.0),
+        txn_count=sign,
     )
-    if year:
-        q = q.filter(GLTransaction.year == year)
-    if month:
-        q = q.filter(GLTransaction.month == month)
-    q = q.group_by(GLTransaction.account_name).order_by(GLTransaction.account_name.asc())
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[GLBalance.account_name, GLBalance.year, GLBalance.month],
+        set_={
+            "dr": GLBalance.dr + stmt.excluded.dr,
+            "cr": GLBalance.cr + stmt.excluded.cr,
+            "value": GLBalance.value + stmt.excluded.value,
+            "txn_count": GLBalance.txn_count + stmt.excluded.txn_count,
+        },
+    )
+    db.execute(stmt)
+    if sign < 0:
+        db.execute(delete(GLBalance).where(
+            GLBalance.account_name == r.account_name,
+            GLBalance.year == r.year,
+            GLBalance.month == r.month,
+            GLBalance.txn_count <= 0,
+        ))
 
+def _gl_period_sums():
+    return (
+        select(
+            GLTransaction.account_name,
+            GLTransaction.year,
+            GLTransaction.month,
+            func.coalesce(func.sum(GLTransaction.dr), 0.0),
+            func.coalesce(func.sum(GLTransaction.cr), 0.0),
+            func.coalesce(func.sum(GLTransaction.value), 0.0),
+            func.count(),
+        )
+        .group_by(GLTransaction.account_name, GLTransaction.year, GLTransaction.month)
+    )
+
+def rebuild_gl_balances(db: Session) -> int:
+    """Полный пересчёт gl_balances из gl_transactions. Возвращает число строк."""
+    db.execute(delete(GLBalance))
+    db.execute(insert(GLBalance).from_select(
+        ["account_name", "year", "month", "dr", "cr", "value", "txn_count"], _gl_period_sums()
+    ))
+    db.commit()
+    return db.scalar(select(func.count()).select_from(GLBalance)) or 0
+
+def verify_gl_balances(db: Session, tolerance: float = 1e-6) -> List[Dict]:
+    """Сверяет gl_balances с агрегатом по gl_transactions; возвращает расхождения."""
+    expected = {
+        (a, y, m): (dr, cr, val, n) for a, y, m, dr, cr, val, n in db.execute(_gl_period_sums())
+    }
+    actual = {
+        (b.account_name, b.year, b.month): (b.dr or 0.0, b.cr or 0.0, b.value or 0.0, b.txn_count or 0)
+        for b in db.scalars(select(GLBalance))
+    }
+    zero = (0.0, 0.0, 0.0, 0)
     out = []
-    for row in q.all():
+    for key in sorted(expected.keys() | actual.keys()):
+        e, a = expected.get(key, zero), actual.get(key, zero)
+        if any(abs(x - y) > tolerance for x, y in zip(e, a)):
+            out.append({
+                "account_name": key[0], "year": key[1], "month": key[2],
+                "expected": dict(zip(("dr", "cr", "value", "txn_count"), e)),
+                "actual": dict(zip(("dr", "cr", "value", "txn_count"), a)),
+            })
+    return out
+
+def ensure_gl_balances(db: Session) -> None:
+    """Первичное заполнение gl_balances для БД, где GL уже был до появления таблицы."""
+    if db.scalar(select(GLBalance.id).limit(1)) is None and db.scalar(select(GLTransaction.id).limit(1)) is not None:
+        rebuild_gl_balances(db)
+
+def _period(s: str) -> int:
+    """'YYYY-MM' -> YYYY*100+MM"""
+    try:
+        y, m = s.split("-")
+        return int(y) * 100 + int(m)
+    except Exception:
+        raise ValueError(f"Bad period: {s}. Use YYYY-MM.")
+
+def _tb_query(
+    month: Optional[int],
+    year: Optional[int],
+    start: Optional[str],
+    end: Optional[str],
+    ytd: bool,
+):
+    q = select(
+        GLBalance.account_name.label("account"),
+        func.coalesce(func.sum(GLBalance.dr), 0.0).label("dr_sum"),
+        func.coalesce(func.sum(GLBalance.cr), 0.0).label("cr_sum"),
+        func.coalesce(func.sum(GLBalance.value), 0.0).label("val_sum"),
+    )
+    period = GLBalance.year * 100 + GLBalance.month
+    if ytd:
+        if not year:
+            raise ValueError("ytd requires year.")
+        q = q.where(period.between(year * 100 + 1, year * 100 + (month or 12)))
+    elif start or end:
+        if start:
+            q = q.where(period >= _period(start))
+        if end:
+            q = q.where(period <= _period(end))
+    else:
+        if year:
+            q = q.where(GLBalance.year == year)
+        if month:
+            q = q.where(GLBalance.month == month)
+    return q.group_by(GLBalance.account_name).order_by(GLBalance.account_name.asc())
+
+def _tb_rows(result) -> List[Dict]:
+    out = []
+    for row in result:
         out.append({
             "account": row.account,
             "dr": float(row.dr_sum or 0),
@@ -93,27 +260,70 @@ def tb(db: Session, month: Optional[int], year: Optional[int]) -> List[Dict]:
         })
     return out
 
+def tb(
+    db: Session,
+    month: Optional[int] = None,
+    year: Optional[int] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    ytd: bool = False,
+) -> List[Dict]:
+    """
+    Trial Balance по gl_balances (account × период), без сканирования gl_transactions.
+    month/year — как раньше; start/end ('YYYY-MM') — диапазон месяцев включительно;
+    ytd=True — с января year по month (или по декабрь).
+    """
+    return _tb_rows(db.execute(_tb_query(month, year, start, end, ytd)))
+
+async def tb_async(
+    db: AsyncSession,
+    month: Optional[int] = None,
+    year: Optional[int] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    ytd: bool = False,
+) -> List[Dict]:
+    return _tb_rows(await db.execute(_tb_query(month, year, start, end, ytd)))
+
 # ------- Prepayments -------
-def list_prepayments(db: Session, month: Optional[int] = None, year: Optional[int] = None) -> List[dict]:
-    q = db.query(Prepayment)
+_PREPAYMENT_COLUMNS = (
+    Prepayment.id, Prepayment.date, Prepayment.party, Prepayment.description,
+    Prepayment.amount, Prepayment.balance, Prepayment.month, Prepayment.year,
+)
+
+def _prepayments_query(month: Optional[int], year: Optional[int]):
+    q = select(*_PREPAYMENT_COLUMNS)
     if year:
-        q = q.filter(Prepayment.year == year)
+        q = q.where(Prepayment.year == year)
     if month:
-        q = q.filter(Prepayment.month == month)
-    q = q.order_by(Prepayment.date.desc(), Prepayment.id.desc())
-    out = []
-    for r in q.all():
-        out.append({
-            "id": r.id,
-            "date": r.date.isoformat(),
-            "party": r.party,
-            "description": r.description,
-            "amount": r.amount,
-            "balance": r.balance,
-            "month": r.month,
-            "year": r.year
-        })
-    return out
+        q = q.where(Prepayment.month == month)
+    return q
+
+def _prepayment_dict(r: Row) -> dict:
+    return {
+        "id": r.id,
+        "date": r.date.isoformat(),
+        "party": r.party,
+        "description": r.description,
+        "amount": r.amount,
+        "balance": r.balance,
+        "month": r.month,
+        "year": r.year
+    }
+
+def list_prepayments(
+    db: Session,
+    month: Optional[int] = None,
+    year: Optional[int] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+) -> dict:
+    return keyset_page(
+        db, _prepayments_query(month, year), Prepayment.date, Prepayment.id, _prepayment_dict, limit, cursor
+    )
+
+def iter_prepayments(db: Session, month: Optional[int] = None, year: Optional[int] = None) -> Iterator[dict]:
+    return iter_rows(db, _prepayments_query(month, year), Prepayment.date, Prepayment.id, _prepayment_dict)
 
 def create_prepayment(db: Session, payload: dict) -> Prepayment:
     def f(x, default=0.0):
@@ -0,0 +1,114 @@
+
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Callable, Optional
+
+from ..db import SessionLocal, engine
+from . import jobs
+from .metrics import compute_month_metrics, upsert_metric_rows
+
+logger = logging.getLogger(__name__)
+
+JOB = "metrics_backfill"
+
+# запуски из API — в своём потоке (как ручной sync), HTTP-запрос не ждёт весь диапазон
+_runner = ThreadPoolExecutor(max_workers=1, thread_name_prefix="backfill")
+
+def month_range(start: str, end: str) -> list[tuple[int, int]]:
+    """'YYYY-MM'..'YYYY-MM' включительно -> [(year, month), ...]"""
+    try:
+        y, m = (int(x) for x in start.split("-"))
+        end_y, end_m = (int(x) for x in end.split("-"))
+    except Exception:
+        raise ValueError("Use YYYY-MM for start/end.")
+    if not (1 <= m <= 12 and 1 <= end_m <= 12) or (y, m) > (end_y, end_m):
+        raise ValueError(f"Bad month range: {start}..{end}")
+    out = []
+    while (y, m) <= (end_y, end_m):
+        out.append((y, m))
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+    return out
+
+def _init_worker():
+    # дочерний процесс не должен пользоваться соединениями, унаследованными от родителя
+    engine.dispose(close=False)
+
+def _compute_month(ym: tuple[int, int]) -> tuple[tuple[int, int], list[dict], float]:
+    """Единица работы: только чтение, своя сессия. Запись делает родительский процесс."""
+    t0 = time.perf_counter()
+    db = SessionLocal()
+    try:
+        rows = compute_month_metrics(db, *ym)
+    finally:
+        db.close()
+    return ym, rows, time.perf_counter() - t0
+
+def backfill_metrics(
+    start: str,
+    end: str,
+    workers: Optional[int] = None,
+    progress: Optional[Callable[[dict], None]] = None,
+) -> list[dict]:
+    """
+    Пересчёт метрик за диапазон месяцев. Агрегаты считаются параллельно в пуле процессов
+    (по месяцу на задачу), а пишет их один писатель в этом процессе — по коммиту на месяц,
+    так что SQLite не дерётся за блокировку записи. workers<=1 — всё последовательно.
+    Воркеры стартуют через spawn: fork из многопоточного процесса (uvicorn, фоновые задачи)
+    может унаследовать чужую захваченную блокировку и повиснуть.
+    Возвращает по месяцам: period, rows, compute_s, write_s.
+    """
+    months = month_range(start, end)
+    workers = workers if workers is not None else min(len(months), os.cpu_count() or 1)
+    report = []
+
+    db = SessionLocal()
+    try:
+        def write(ym, rows, compute_s):
+            t0 = time.perf_counter()
+            upsert_metric_rows(db, rows)
+            db.commit()
+            entry = {
+                "period": f"{ym[0]}-{ym[1]:02d}",
+                "rows": len(rows),
+                "compute_s": round(compute_s, 3),
+                "write_s": round(time.perf_counter() - t0, 3),
+                "done": len(report) + 1,
+                "total": len(months),
+            }
+            report.append(entry)
+            logger.info(
+                "metrics backfill %(period)s: %(rows)d rows, compute %(compute_s).3fs, "
+                "write %(write_s).3fs [%(done)d/%(total)d]", entry,
+            )
+            if progress:
+                progress(entry)
+
+        if workers <= 1:
+            for ym in months:
+                write(*_compute_month(ym))
+        else:
+            with ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_worker, mp_context=multiprocessing.get_context("spawn"),
+            ) as pool:
+                for fut in as_completed([pool.submit(_compute_month, ym) for ym in months]):
+                    write(*fut.result())
+    finally:
+        db.close()
+    return sorted(report, key=lambda e: e["period"])
+
+def run_backfill(run_id: int, start: str, end: str, workers: Optional[int] = None) -> str:
+    """backfill_metrics как прогон job_runs (этап metrics_backfill) под своей блокировкой."""
+    def body(ctx: jobs.RunContext):
+        with ctx.stage(JOB) as st:
+            st.rows = sum(e["rows"] for e in backfill_metrics(start, end, workers))
+    return jobs.execute_run(run_id, JOB, body)
+
+def trigger_backfill(start: str, end: str, workers: Optional[int] = None) -> int:
+    """Проверяет диапазон (ValueError), ставит прогон в очередь и сразу возвращает его id."""
+    month_range(start, end)
+    run_id = jobs.create_run(JOB, "manual")
+    _runner.submit(run_backfill, run_id, start, end, workers)
+    return run_id
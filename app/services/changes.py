@@ -0,0 +1,62 @@
+
+"""
+Счётчики изменений таблиц (table_versions) — дешёвый ETag для списков: клиент, опрашивающий
+неизменившиеся данные, получает 304 после одного SELECT по первичному ключу.
+
+Счётчик увеличивается в той же транзакции, что и запись (откат откатывает и его):
+- ORM unit of work — событие after_flush по new/dirty/deleted;
+- INSERT/UPDATE/DELETE через Session.execute — событие do_orm_execute.
+Запись в отслеживаемые таблицы должна идти через Session (так и устроены сервисы).
+"""
+from datetime import datetime
+from typing import Iterable
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from ..db import dialect_insert
+from ..models import TableVersion
+
+TRACKED = frozenset({"purchase_orders", "purchase_order_items"})
+
+def bump(session: Session, tables: Iterable[str]) -> None:
+    conn = session.connection()
+    now = datetime.utcnow()
+    for name in sorted(set(tables) & TRACKED):
+        stmt = dialect_insert(session, TableVersion.__table__).values(name=name, version=1, updated_at=now)
+        conn.execute(stmt.on_conflict_do_update(
+            index_elements=["name"],
+            set_={"version": TableVersion.__table__.c.version + 1, "updated_at": now},
+        ))
+
+def versions(db: Session, tables: Iterable[str]) -> dict[str, int]:
+    names = list(tables)
+    found = dict(db.execute(select(TableVersion.name, TableVersion.version).where(TableVersion.name.in_(names))).all())
+    return {n: found.get(n, 0) for n in names}
+
+def etag(db: Session, *tables: str) -> str:
+    """Слабый ETag по версиям таблиц (представление может быть сжато по-разному)."""
+    v = versions(db, tables)
+    return 'W/"' + ".".join(f"{v[t]}" for t in tables) + '"'
+
+@event.listens_for(Session, "after_flush")
+def _after_flush(session: Session, _ctx) -> None:
+    tables = {
+        obj.__table__.name
+        for objs in (session.new, session.dirty, session.deleted)
+        for obj in objs
+        if getattr(obj, "__table__", None) is not None
+    }
+    if tables & TRACKED:
+        bump(session, tables)
+
+@event.listens_for(Session, "do_orm_execute")
+def _orm_execute(state):
+    if not (state.is_insert or state.is_update or state.is_delete):
+        return None
+    table = getattr(state.statement, "table", None)
+    if table is None or table.name not in TRACKED:
+        return None
+    result = state.invoke_statement()
+    bump(state.session, [table.name])
+    return result
@@ -1,8 +1,19 @@
 
+from collections import Counter
+from itertools import islice
+from sqlalchemy import or_, select
 from sqlalchemy.orm import Session
-from typing import Iterable
-from datetime import datetime
-from ..models import Product, Supplier, InventorySnapshot, Sale, Fee, FeeType
+from typing import Iterable, Iterator, Optional
+from datetime import datetime, timedelta, timezone
+from .. import telemetry
+from ..config import settings
+from ..db import dialect_insert
+from ..spapi import columnar
+from ..spapi.parser import REPORT_PARSERS, ReportSource
+from ..models import Product, Supplier, InventorySnapshot, Sale, Fee, FeeType, IngestQuarantine, IngestWatermark
+
+INSERT_BATCH = 5000
+QUARANTINE_CHUNK = 500
 
 def upsert_supplier(db: Session, name: str) -> Supplier:
     s = db.query(Supplier).filter_by(name=name).one_or_none()
@@ -27,29 +38,310 @@ def upsert_product(db: Session, sku: str, asin: str, title: str, supplier: Suppl
     db.refresh(p)
     return p
 
-def ingest_inventory_snapshots(db: Session, rows: Iterable[dict]) -> None:
-    for r in rows:
-        # expected keys: sku, qty, fc, at
-        sku = r["sku"]; qty = int(r["qty"]); fc = r.get("fc", "FBA"); at = r.get("at") or datetime.utcnow()
-        p = db.query(Product).filter_by(sku=sku).one_or_none()
-        if not p:
-            # Skip unknown SKU for now
+# -------- bulk ingest --------
+
+def load_sku_map(db: Session) -> dict[str, int]:
+    """sku -> product_id, одним запросом на весь прогон."""
+    return dict(db.execute(select(Product.sku, Product.id).where(Product.sku.is_not(None))).all())
+
+def _batched(rows: Iterable[dict], size: int) -> Iterator[list[dict]]:
+    it = iter(rows)
+    while chunk := list(islice(it, size)):
+        yield chunk
+
+def _quarantine(db: Session, report_type: str, unknown: Counter) -> None:
+    """Копит счётчики строк с неизвестными SKU в ingest_quarantine."""
+    now = datetime.utcnow()
+    items = list(unknown.items())
+    for i in range(0, len(items), QUARANTINE_CHUNK):
+        stmt = dialect_insert(db, IngestQuarantine.__table__).values([
+            {"report_type": report_type, "sku": sku, "row_count": n, "first_seen": now, "last_seen": now}
+            for sku, n in items[i:i + QUARANTINE_CHUNK]
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[IngestQuarantine.report_type, IngestQuarantine.sku],
+            set_={
+                "row_count": IngestQuarantine.row_count + stmt.excluded.row_count,
+                "last_seen": stmt.excluded.last_seen,
+            },
+        )
+        db.execute(stmt)
+
+def _fee_type(v) -> FeeType:
+    try:
+        return FeeType(v or "OTHER")
+    except ValueError:
+        return FeeType.OTHER
+
+def _naive_utc(at) -> Optional[datetime]:
+    if at is None or at != at:  # None / NaT
+        return None
+    return at.astimezone(timezone.utc).replace(tzinfo=None) if at.tzinfo else at
+
+# expected keys: sku, qty, fc, at
+def _inventory_values(r: dict, pid: int, now: datetime) -> dict:
+    return {"product_id": pid, "qty": int(r["qty"]), "fc": r.get("fc") or "FBA", "at": r.get("at") or now}
+
+# expected keys: sku, units, price, at [, order_id]
+def _sale_values(r: dict, pid: int, now: datetime) -> dict:
+    return {
+        "product_id": pid, "units": int(r["units"]), "price": float(r["price"]),
+        "at": r.get("at") or now, "created_at": now,
+    }
+
+# expected keys: sku, type, amount, at [, order_id, settlement_id]
+def _fee_values(r: dict, pid: int, now: datetime) -> dict:
+    return {
+        "product_id": pid, "type": _fee_type(r.get("type")), "amount": float(r["amount"]),
+        "at": r.get("at") or now, "created_at": now,
+    }
+
+def _key_ts(at) -> str:
+    at = _naive_utc(at)
+    return at.strftime("%Y-%m-%dT%H:%M:%S") if at else ""
+
+# натуральный ключ строки: одна и та же строка из пересекающихся окон даёт тот же ключ
+def _sale_key(r: dict) -> str:
+    if r.get("order_id"):
+        return f"{r['order_id']}|{r['sku']}"
+    return f"{r['sku']}|{_key_ts(r.get('at'))}|{int(r['units'])}|{float(r['price']):.2f}"
+
+def _fee_key(r: dict) -> str:
+    return "|".join((
+        r.get("settlement_id") or "", r.get("order_id") or "", r["sku"],
+        _fee_type(r.get("type")).value, f"{float(r['amount']):.2f}", _key_ts(r.get("at")),
+    ))
+
+# report_type -> (таблица, строка отчёта -> values, натуральный ключ строки, колонки уникального ключа,
+#                 колонки, которые обновляет повторно пришедшая строка; None — ON CONFLICT DO NOTHING;
+#                 у таблиц с обновлением есть updated_at/prev_at)
+# orders: *_BY_LAST_UPDATE присылает ревизии заказа (Pending без цены -> Shipped с ценой)
+REPORT_TABLES = {
+    "inventory": (InventorySnapshot.__table__, _inventory_values, None, ["product_id", "fc", "at"], None),
+    "orders": (Sale.__table__, _sale_values, _sale_key, ["external_key"], ["units", "price", "at"]),
+    "settlement": (Fee.__table__, _fee_values, _fee_key, ["external_key"], None),
+}
+
+def _conflict_stmt(db: Session, table, conflict_cols: list[str], update_cols: Optional[list[str]], now: datetime):
+    stmt = dialect_insert(db, table)
+    if not update_cols:
+        return stmt.on_conflict_do_nothing(index_elements=conflict_cols)
+    # UPDATE только при реальном изменении: неизменённый повтор остаётся дубликатом в rowcount.
+    # updated_at — для инкрементального пересчёта метрик, prev_at — прежний at (SET читает старую строку)
+    return stmt.on_conflict_do_update(
+        index_elements=conflict_cols,
+        set_={**{c: stmt.excluded[c] for c in update_cols}, "updated_at": now, "prev_at": table.c.at},
+        where=or_(*(table.c[c].is_distinct_from(stmt.excluded[c]) for c in update_cols)),
+    )
+
+class _Batch:
+    """
+    Общая часть ingest_chunks/ingest_frames: значения строк с натуральными ключами,
+    INSERT ... ON CONFLICT (DO NOTHING или DO UPDATE изменившихся колонок) и отметки для watermark.
+    Одинаковые строки внутри документа различаются номером вхождения (key#1, key#2 ...).
+    inserted — новые и изменённые строки, duplicates — пришедшие повторно без изменений.
+    """
+
+    def __init__(self, db: Session, report_type: str):
+        self.db = db
+        self.report_type = report_type
+        self.table, self.to_values, self.key_fn, conflict_cols, update_cols = REPORT_TABLES[report_type]
+        self.now = datetime.utcnow()
+        self.stmt = _conflict_stmt(db, self.table, conflict_cols, update_cols, self.now)
+        self.seen: Counter = Counter()
+        self.rows = self.inserted = self.already_ingested = 0
+        self.max_at: Optional[datetime] = None
+        self.settlement_id: Optional[str] = None
+        # settlement-id не больше watermark уже загружены целиком (документ коммитится вместе с watermark)
+        wm = get_watermark(db, report_type) if report_type == "settlement" else None
+        self.done_settlement_id = wm.last_settlement_id if wm is not None else None
+
+    def settled(self, sid) -> bool:
+        """Строка из settlement, загруженного предыдущим документом."""
+        done = self.done_settlement_id
+        return bool(sid) and done is not None and _id_order(sid) <= _id_order(done)
+
+    def values(self, r: dict, pid: int) -> dict:
+        v = self.to_values(r, pid, self.now)
+        if self.key_fn is not None:
+            base = self.key_fn(r)
+            n = self.seen[base]
+            self.seen[base] += 1
+            v["external_key"] = f"{base}#{n}" if n else base
+        at = _naive_utc(r.get("at"))
+        if at is not None:
+            v["at"] = at
+            if self.max_at is None or at > self.max_at:
+                self.max_at = at
+        sid = r.get("settlement_id")
+        if sid and (self.settlement_id is None or _id_order(sid) > _id_order(self.settlement_id)):
+            self.settlement_id = sid
+        return v
+
+    def write(self, values: list[dict]) -> None:
+        if values:
+            with telemetry.span("write"):
+                self.inserted += self.db.execute(self.stmt, values).rowcount
+            self.rows += len(values)
+
+    def finish(self, unknown: Counter) -> dict:
+        with telemetry.span("write"):
+            if unknown:
+                _quarantine(self.db, self.report_type, unknown)
+            advance_watermark(self.db, self.report_type, self.max_at, self.settlement_id)
+            self.db.commit()
+        return {
+            "inserted": self.inserted,
+            "duplicates": self.rows - self.inserted,
+            "already_ingested": self.already_ingested,
+            "quarantined": sum(unknown.values()),
+            "unknown_skus": len(unknown),
+        }
+
+def _id_order(v: str):
+    # settlement-id числовой; сравниваем как числа, иначе как строки
+    return (0, int(v), "") if v.isdigit() else (1, 0, v)
+
+# -------- watermarks --------
+
+def get_watermark(db: Session, report_type: str) -> Optional[IngestWatermark]:
+    return db.get(IngestWatermark, report_type)
+
+def advance_watermark(
+    db: Session, report_type: str, last_at: Optional[datetime], settlement_id: Optional[str] = None
+) -> None:
+    """Двигает watermark только вперёд; коммит — вместе со строками отчёта."""
+    if last_at is None and settlement_id is None:
+        return
+    wm = db.get(IngestWatermark, report_type) or IngestWatermark(report_type=report_type)
+    db.add(wm)
+    if last_at is not None and (wm.last_at is None or last_at > wm.last_at):
+        wm.last_at = last_at
+    if settlement_id and (not wm.last_settlement_id or _id_order(settlement_id) > _id_order(wm.last_settlement_id)):
+        wm.last_settlement_id = settlement_id
+    wm.updated_at = datetime.utcnow()
+
+def fetch_window(db: Session, report_type: str, end: datetime) -> tuple[datetime, datetime]:
+    """
+    Окно запроса отчёта: от watermark минус перекрытие (опоздавшие строки; дубли отсекает
+    натуральный ключ) до end. Без watermark — INGEST_LOOKBACK_DAYS назад.
+    """
+    wm = get_watermark(db, report_type)
+    if wm is None or wm.last_at is None:
+        return end - timedelta(days=settings.ingest_lookback_days), end
+    start = wm.last_at - timedelta(minutes=settings.ingest_overlap_minutes)
+    return min(start, end - timedelta(minutes=settings.ingest_overlap_minutes)), end
+
+def list_watermarks(db: Session) -> list[dict]:
+    return [
+        {
+            "report_type": w.report_type,
+            "last_at": w.last_at.isoformat() if w.last_at else None,
+            "last_settlement_id": w.last_settlement_id,
+            "updated_at": w.updated_at.isoformat() if w.updated_at else None,
+        }
+        for w in db.scalars(select(IngestWatermark).order_by(IngestWatermark.report_type))
+    ]
+
+# -------- ingest --------
+
+def ingest_chunks(
+    db: Session,
+    report_type: str,
+    chunks: Iterable[list[dict]],
+    sku_map: Optional[dict[str, int]] = None,
+) -> dict:
+    """
+    Пишет отчёт по мере поступления пачек (например, из spapi.parser.iter_*_chunks):
+    SKU резолвятся по карте (без запроса на строку), каждая пачка — один executemany
+    INSERT ... ON CONFLICT по натуральному ключу, неизвестные SKU уходят в карантин,
+    строки settlement, уже загруженных по watermark, пропускаются.
+    В памяти держится одна пачка. Watermark типа отчёта двигается в том же коммите.
+    """
+    if sku_map is None:
+        sku_map = load_sku_map(db)
+    batch = _Batch(db, report_type)
+    unknown: Counter = Counter()
+    for chunk in telemetry.timed_iter(chunks, "parse"):
+        telemetry.add_rows(len(chunk))
+        values = []
+        for r in chunk:
+            if batch.settled(r.get("settlement_id")):
+                batch.already_ingested += 1
+                continue
+            pid = sku_map.get(r["sku"])
+            if pid is None:
+                unknown[r["sku"]] += 1
+                continue
+            values.append(batch.values(r, pid))
+        batch.write(values)
+    return batch.finish(unknown)
+
+def ingest_frames(
+    db: Session,
+    report_type: str,
+    frames: Iterable,
+    sku_map: Optional[dict[str, int]] = None,
+) -> dict:
+    """
+    То же, что ingest_chunks, но для колоночных пачек (DataFrame) из spapi.columnar:
+    SKU резолвятся через Series.map, неизвестные считаются value_counts, без цикла по строкам.
+    """
+    if sku_map is None:
+        sku_map = load_sku_map(db)
+    batch = _Batch(db, report_type)
+    unknown: Counter = Counter()
+    for df in telemetry.timed_iter(frames, "parse"):
+        telemetry.add_rows(len(df))
+        if batch.done_settlement_id is not None and "settlement_id" in df:
+            done = df["settlement_id"].isin([v for v in df["settlement_id"].unique() if batch.settled(v)])
+            batch.already_ingested += int(done.sum())
+            df = df.loc[~done]
+        pid = df["sku"].map(sku_map)
+        known = pid.notna()
+        if not known.all():
+            unknown.update(df.loc[~known, "sku"].value_counts().to_dict())
+        df = df.loc[known].copy()
+        if df.empty:
             continue
-        db.add(InventorySnapshot(product_id=p.id, qty=qty, fc=fc, at=at))
-    db.commit()
+        df["product_id"] = pid[known].astype("int64")
+        at = df["at"].dt.tz_convert(None) if df["at"].dt.tz is not None else df["at"]
+        df["at"] = at.astype(object).where(at.notna(), None)
+        batch.write([batch.values(r, r["product_id"]) for r in df.to_dict("records")])
+    return batch.finish(unknown)
 
-def ingest_sales(db: Session, rows: Iterable[dict]) -> None:
-    for r in rows:
-        sku = r["sku"]; units = int(r["units"]); price = float(r["price"]); at = r.get("at") or datetime.utcnow()
-        p = db.query(Product).filter_by(sku=sku).one_or_none()
-        if not p: continue
-        db.add(Sale(product_id=p.id, units=units, price=price, at=at))
-    db.commit()
+def ingest_report(
+    db: Session, report_type: str, source: ReportSource, sku_map: Optional[dict[str, int]] = None
+) -> dict:
+    """Документ отчёта целиком: парсер выбирается настройкой REPORT_PARSER (python | pandas)."""
+    if settings.report_parser == "pandas" and columnar.available():
+        return ingest_frames(db, report_type, columnar.read_report_frames(source, report_type), sku_map)
+    return ingest_chunks(db, report_type, REPORT_PARSERS[report_type](source), sku_map)
 
-def ingest_fees(db: Session, rows: Iterable[dict]) -> None:
-    for r in rows:
-        sku = r["sku"]; ftype = FeeType(r.get("type", "OTHER")); amount = float(r["amount"]); at = r.get("at") or datetime.utcnow()
-        p = db.query(Product).filter_by(sku=sku).one_or_none()
-        if not p: continue
-        db.add(Fee(product_id=p.id, type=ftype, amount=amount, at=at))
-    db.commit()
+def ingest_inventory_snapshots(
+    db: Session, rows: Iterable[dict], batch_size: int = INSERT_BATCH, sku_map: Optional[dict] = None
+) -> dict:
+    return ingest_chunks(db, "inventory", _batched(rows, batch_size), sku_map)
+
+def ingest_sales(
+    db: Session, rows: Iterable[dict], batch_size: int = INSERT_BATCH, sku_map: Optional[dict] = None
+) -> dict:
+    return ingest_chunks(db, "orders", _batched(rows, batch_size), sku_map)
+
+def ingest_fees(
+    db: Session, rows: Iterable[dict], batch_size: int = INSERT_BATCH, sku_map: Optional[dict] = None
+) -> dict:
+    return ingest_chunks(db, "settlement", _batched(rows, batch_size), sku_map)
+
+def list_quarantine(db: Session) -> list[dict]:
+    q = select(IngestQuarantine).order_by(IngestQuarantine.row_count.desc())
+    return [
+        {
+            "report_type": r.report_type,
+            "sku": r.sku,
+            "row_count": r.row_count,
+            "first_seen": r.first_seen.isoformat() if r.first_seen else None,
+            "last_seen": r.last_seen.isoformat() if r.last_seen else None,
+        }
+        for r in db.scalars(q)
+    ]
@@ -0,0 +1,225 @@
+
+"""
+История запусков фоновых задач (job_runs / job_run_stages) и блокировка от перекрытия.
+Записи ведутся отдельными короткими сессиями, чтобы откат ETL-транзакции их не стирал.
+"""
+import json
+import logging
+import traceback
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Iterator, Optional
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.orm import Session, selectinload
+
+from .. import telemetry
+from ..db import SessionLocal, dialect_insert
+from ..models import JobLock, JobRun, JobRunStage
+
+logger = logging.getLogger(__name__)
+
+# блокировка старше этого считается брошенной (процесс упал посреди прогона)
+LOCK_TTL = timedelta(hours=6)
+
+def create_run(job: str, trigger: str) -> int:
+    with SessionLocal() as db:
+        run = JobRun(job=job, trigger=trigger, status="queued")
+        db.add(run)
+        db.commit()
+        return run.id
+
+def _set_run(run_id: int, **values) -> None:
+    with SessionLocal() as db:
+        db.execute(update(JobRun).where(JobRun.id == run_id).values(**values))
+        db.commit()
+
+# -------- lock --------
+
+def acquire_lock(name: str, run_id: int) -> bool:
+    """
+    INSERT ... ON CONFLICT DO NOTHING по первичному ключу: атомарно и в SQLite, и в PostgreSQL.
+    Брошенная блокировка (старше LOCK_TTL) перехватывается, её прогон помечается failed.
+    """
+    now = datetime.utcnow()
+    with SessionLocal() as db:
+        stmt = dialect_insert(db, JobLock.__table__).values(name=name, run_id=run_id, acquired_at=now)
+        if db.execute(stmt.on_conflict_do_nothing(index_elements=["name"])).rowcount == 1:
+            db.commit()
+            return True
+        stale = db.scalar(select(JobLock.run_id).where(JobLock.name == name, JobLock.acquired_at < now - LOCK_TTL))
+        taken = db.execute(
+            update(JobLock)
+            .where(JobLock.name == name, JobLock.acquired_at < now - LOCK_TTL)
+            .values(run_id=run_id, acquired_at=now)
+        ).rowcount == 1
+        if taken and stale is not None:
+            db.execute(
+                update(JobRun).where(JobRun.id == stale, JobRun.status == "running")
+                .values(status="failed", finished_at=now, error="abandoned (lock expired)")
+            )
+        db.commit()
+        return taken
+
+def release_lock(name: str, run_id: int) -> None:
+    with SessionLocal() as db:
+        db.execute(delete(JobLock).where(JobLock.name == name, JobLock.run_id == run_id))
+        db.commit()
+
+def active_run_id(name: str) -> Optional[int]:
+    with SessionLocal() as db:
+        return db.scalar(select(JobLock.run_id).where(
+            JobLock.name == name, JobLock.acquired_at >= datetime.utcnow() - LOCK_TTL,
+        ))
+
+# -------- stages --------
+
+class RunContext:
+    """Передаётся в тело задачи: stage() пишет строку job_run_stages с телеметрией на каждый этап."""
+
+    def __init__(self, run_id: int):
+        self.run_id = run_id
+        self.rows = 0
+        self.failed: list[str] = []
+        self.stats: list[telemetry.StageStats] = []
+
+    @contextmanager
+    def stage(self, name: str, swallow: bool = False) -> Iterator[telemetry.StageStats]:
+        """
+        with ctx.stage("ingest:orders") as st: ...; st.rows = n
+        swallow=True — ошибка этапа записывается, но прогон продолжается со следующего этапа.
+        """
+        with SessionLocal() as db:
+            rec = JobRunStage(run_id=self.run_id, stage=name, status="running", started_at=datetime.utcnow())
+            db.add(rec)
+            db.commit()
+            stage_id = rec.id
+        values = {}
+        try:
+            with telemetry.stage(name) as st:
+                yield st
+            values = {"status": "success"}
+        except Exception as e:
+            values = {"status": "failed", "error": "".join(traceback.format_exception_only(e)).strip()}
+            self.failed.append(name)
+            logger.exception("run %d: stage %s failed", self.run_id, name)
+            if not swallow:
+                raise
+        finally:
+            self.rows += st.rows
+            self.stats.append(st)
+            with SessionLocal() as db:
+                db.execute(update(JobRunStage).where(JobRunStage.id == stage_id).values(
+                    finished_at=datetime.utcnow(), rows=st.rows, queries=st.queries,
+                    db_s=round(st.db_time, 4), peak_mem_mb=st.peak_mem,
+                    spans=json.dumps({k: round(v, 4) for k, v in st.spans.items()}) if st.spans else None,
+                    **values,
+                ))
+                db.commit()
+
+    def summary(self) -> str:
+        return " | ".join(st.summary() for st in self.stats)
+
+def execute_run(run_id: int, job: str, fn) -> str:
+    """
+    Выполняет fn(ctx) под блокировкой job. Если уже идёт другой прогон — этот помечается skipped.
+    Возвращает итоговый статус.
+    """
+    if not acquire_lock(job, run_id):
+        _set_run(run_id, status="skipped", finished_at=datetime.utcnow(),
+                 error=f"another {job} run is in progress (run {active_run_id(job)})")
+        logger.info("run %d skipped: %s already running", run_id, job)
+        return "skipped"
+    ctx = RunContext(run_id)
+    _set_run(run_id, status="running", started_at=datetime.utcnow())
+    status, error = "success", None
+    try:
+        fn(ctx)
+        if ctx.failed:
+            status, error = "failed", "failed stages: " + ", ".join(ctx.failed)
+    except Exception as e:
+        status, error = "failed", "".join(traceback.format_exception_only(e)).strip()
+        logger.exception("run %d (%s) failed", run_id, job)
+    finally:
+        _set_run(run_id, status=status, error=error, rows=ctx.rows, finished_at=datetime.utcnow(),
+                 peak_rss_mb=telemetry.max_rss_mb())
+        release_lock(job, run_id)
+        logger.info("%s run %d %s: %s", job, run_id, status, ctx.summary())
+    return status
+
+# -------- чтение --------
+
+def _dt(v: Optional[datetime]) -> Optional[str]:
+    return v.isoformat() if v else None
+
+def _duration(a: Optional[datetime], b: Optional[datetime]) -> Optional[float]:
+    return round((b - a).total_seconds(), 3) if a and b else None
+
+def _run_dict(r: JobRun, with_stages: bool) -> dict:
+    out = {
+        "id": r.id,
+        "job": r.job,
+        "trigger": r.trigger,
+        "status": r.status,
+        "created_at": _dt(r.created_at),
+        "started_at": _dt(r.started_at),
+        "finished_at": _dt(r.finished_at),
+        "duration_s": _duration(r.started_at, r.finished_at),
+        "rows": r.rows,
+        "error": r.error,
+        "peak_rss_mb": r.peak_rss_mb,
+    }
+    if with_stages:
+        out["stages"] = [
+            {
+                "stage": s.stage,
+                "status": s.status,
+                "started_at": _dt(s.started_at),
+                "finished_at": _dt(s.finished_at),
+                "duration_s": _duration(s.started_at, s.finished_at),
+                "error": s.error,
+                **_stage_stats(s),
+            }
+            for s in r.stages
+        ]
+    return out
+
+def _stage_stats(s: JobRunStage) -> dict:
+    duration = _duration(s.started_at, s.finished_at)
+    return {
+        "rows": s.rows,
+        "rows_per_s": round(s.rows / duration, 1) if s.rows and duration else None,
+        "queries": s.queries,
+        "db_s": s.db_s,
+        "peak_mem_mb": s.peak_mem_mb,
+        "spans": json.loads(s.spans) if s.spans else {},
+    }
+
+def get_run(db: Session, run_id: int) -> Optional[dict]:
+    r = db.scalars(select(JobRun).where(JobRun.id == run_id).options(selectinload(JobRun.stages))).one_or_none()
+    return _run_dict(r, True) if r else None
+
+def list_runs(db: Session, job: Optional[str] = None, limit: int = 50) -> list[dict]:
+    q = select(JobRun).order_by(JobRun.id.desc()).limit(limit)
+    if job:
+        q = q.where(JobRun.job == job)
+    return [_run_dict(r, False) for r in db.scalars(q)]
+
+def stage_history(db: Session, stage: str, limit: int = 30) -> list[dict]:
+    """Один этап по последним прогонам — чтобы регрессии было видно от прогона к прогону."""
+    q = (
+        select(JobRunStage)
+        .where(JobRunStage.stage == stage, JobRunStage.finished_at.is_not(None))
+        .order_by(JobRunStage.id.desc())
+        .limit(limit)
+    )
+    return [
+        {
+            "run_id": s.run_id,
+            "status": s.status,
+            "started_at": _dt(s.started_at),
+            "duration_s": _duration(s.started_at, s.finished_at),
+            **_stage_stats(s),
+        }
+        for s in db.scalars(q)
+    ]
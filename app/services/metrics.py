@@ -1,52 +1,134 @@
 
+from typing import Optional
 from sqlalchemy.orm import Session
-from sqlalchemy import select, func
+from sqlalchemy import select, func, or_, union
 from datetime import datetime
-from ..models import Product, Sale, Fee, MetricSnapshot, FeeType
+from .. import telemetry
+from ..db import dialect_insert
+from ..models import Product, Sale, Fee, MetricSnapshot
+
+UPSERT_CHUNK = 500
 
 def compute_month_key(dt: datetime) -> str:
     return dt.strftime("%Y-%m")
 
-def recompute_metrics_for_month(db: Session, year: int, month: int) -> None:
-    # Aggregate revenue, cogs (cost * units), fees per product for given month
+def month_bounds(year: int, month: int) -> tuple[datetime, datetime]:
     start = datetime(year, month, 1)
     if month == 12:
         end = datetime(year + 1, 1, 1)
     else:
         end = datetime(year, month + 1, 1)
-    period = start.strftime("%Y-%m")
+    return start, end
+
+def _changed_since(model, last_run: datetime, start: datetime, end: datetime):
+    """Строки, загруженные или изменённые ревизией после last_run, которые в месяце сейчас или были до ревизии."""
+    return select(model.product_id).where(
+        func.coalesce(model.updated_at, model.created_at) > last_run,
+        or_(
+            (model.at >= start) & (model.at < end),
+            (model.prev_at >= start) & (model.prev_at < end),
+        ),
+    )
 
-    products = db.scalars(select(Product)).all()
-    for p in products:
-        # revenue
-        revenue = db.scalar(
-            select(func.coalesce(func.sum(Sale.price * Sale.units), 0.0))
-            .where(Sale.product_id == p.id, Sale.at >= start, Sale.at < end)
-        ) or 0.0
+def _touched_products(db: Session, start: datetime, end: datetime, period: str):
+    """
+    select(product_id) товаров, у которых после прошлого расчёта периода появились или
+    изменились продажи/комиссии этого месяца (в т.ч. ушедшие из него ревизией).
+    None — период ещё не считался (нужен полный расчёт).
+    """
+    last_run = db.scalar(select(func.max(MetricSnapshot.at)).where(MetricSnapshot.period == period))
+    if last_run is None:
+        return None
+    return union(_changed_since(Sale, last_run, start, end), _changed_since(Fee, last_run, start, end))
 
-        units = db.scalar(
-            select(func.coalesce(func.sum(Sale.units), 0))
-            .where(Sale.product_id == p.id, Sale.at >= start, Sale.at < end)
-        ) or 0
+def revised_periods(db: Session, since: datetime) -> list[tuple[int, int]]:
+    """(year, month), из которых ревизии после since увели строки: их метрики тоже устарели."""
+    prev = union(
+        select(Sale.prev_at).where(Sale.updated_at > since, Sale.prev_at.is_not(None)),
+        select(Fee.prev_at).where(Fee.updated_at > since, Fee.prev_at.is_not(None)),
+    )
+    return sorted({(at.year, at.month) for at in db.scalars(select(prev.subquery().c[0]))})
 
-        cogs = (p.cost or 0.0) * units
+def compute_month_metrics(db: Session, year: int, month: int, only_products=None) -> list[dict]:
+    """
+    Строки MetricSnapshot за месяц: по одному сгруппированному запросу на таблицу
+    (products, sales, fees), соединение в памяти. only_products — select(product_id) для ограничения.
+    """
+    start, end = month_bounds(year, month)
+    period = start.strftime("%Y-%m")
+
+    prod_q = select(Product.id, Product.cost)
+    sales_q = (
+        select(
+            Sale.product_id,
+            func.coalesce(func.sum(Sale.price * Sale.units), 0.0),
+            func.coalesce(func.sum(Sale.units), 0),
+        )
+        .where(Sale.at >= start, Sale.at < end)
+        .group_by(Sale.product_id)
+    )
+    fees_q = (
+        select(Fee.product_id, func.coalesce(func.sum(Fee.amount), 0.0))
+        .where(Fee.at >= start, Fee.at < end)
+        .group_by(Fee.product_id)
+    )
+    if only_products is not None:
+        ids = only_products.subquery()
+        prod_q = prod_q.where(Product.id.in_(select(ids.c[0])))
+        sales_q = sales_q.where(Sale.product_id.in_(select(ids.c[0])))
+        fees_q = fees_q.where(Fee.product_id.in_(select(ids.c[0])))
 
-        fees = db.scalar(
-            select(func.coalesce(func.sum(Fee.amount), 0.0))
-            .where(Fee.product_id == p.id, Fee.at >= start, Fee.at < end)
-        ) or 0.0
+    sales = {pid: (rev, units) for pid, rev, units in db.execute(sales_q)}
+    fees = dict(db.execute(fees_q).all())
 
-        profit = revenue - cogs - fees
+    rows = []
+    for pid, cost in db.execute(prod_q):
+        revenue, units = sales.get(pid, (0.0, 0))
+        cogs = (cost or 0.0) * (units or 0)
+        fee_sum = fees.get(pid) or 0.0
+        profit = (revenue or 0.0) - cogs - fee_sum
         roi = (profit / cogs * 100.0) if cogs > 0 else 0.0
+        rows.append({
+            "product_id": pid,
+            "period": period,
+            "revenue": float(revenue or 0.0),
+            "cogs": float(cogs),
+            "fees": float(fee_sum),
+            "profit": float(profit),
+            "roi": float(roi),
+        })
+    return rows
+
+def upsert_metric_rows(db: Session, rows: list[dict], at: Optional[datetime] = None) -> int:
+    """INSERT ... ON CONFLICT(product_id, period) DO UPDATE пачками; без commit."""
+    at = at or datetime.utcnow()
+    for i in range(0, len(rows), UPSERT_CHUNK):
+        chunk = [dict(r, at=at) for r in rows[i:i + UPSERT_CHUNK]]
+        stmt = dialect_insert(db, MetricSnapshot.__table__).values(chunk)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[MetricSnapshot.product_id, MetricSnapshot.period],
+            set_={k: stmt.excluded[k] for k in ("revenue", "cogs", "fees", "profit", "roi", "at")},
+        )
+        db.execute(stmt)
+    return len(rows)
 
-        # upsert MetricSnapshot
-        ms = db.query(MetricSnapshot).filter_by(product_id=p.id, period=period).one_or_none()
-        if not ms:
-            ms = MetricSnapshot(product_id=p.id, period=period)
-            db.add(ms)
-        ms.revenue = float(revenue)
-        ms.cogs = float(cogs)
-        ms.fees = float(fees)
-        ms.profit = float(profit)
-        ms.roi = float(roi)
-    db.commit()
+def recompute_metrics_for_month(db: Session, year: int, month: int, incremental: bool = False) -> int:
+    """
+    Aggregate revenue, cogs (cost * units), fees per product for given month.
+    incremental=True — пересчитываются только товары, по которым с прошлого расчёта
+    этого периода загружены новые или изменены ревизией продажи/комиссии, включая
+    ушедшие ревизией в другой месяц (изменения Product.cost так не ловятся —
+    для них нужен полный пересчёт). Возвращает число записанных строк.
+    """
+    run_at = datetime.utcnow()  # фиксируем до чтения, чтобы не потерять строки, пришедшие во время расчёта
+    start, end = month_bounds(year, month)
+    only = None
+    if incremental:
+        only = _touched_products(db, start, end, start.strftime("%Y-%m"))
+    with telemetry.span("compute"):
+        rows = compute_month_metrics(db, year, month, only)
+    telemetry.add_rows(len(rows))
+    with telemetry.span("write"):
+        n = upsert_metric_rows(db, rows, at=run_at)
+        db.commit()
+    return n
@@ -0,0 +1,78 @@
+from __future__ import annotations
+import base64
+from datetime import datetime
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from sqlalchemy import and_, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+# -------- keyset-пагинация по (date, id) DESC --------
+
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 5000
+STREAM_CHUNK = 1000  # строк за один fetch с курсора БД при NDJSON-стриминге
+
+def encode_cursor(date_iso: str, row_id: int) -> str:
+    """Непрозрачный курсор: base64url("<date iso>|<id>") последней отданной строки."""
+    raw = f"{date_iso}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        dt, row_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(dt), int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def _keyset_stmt(stmt, date_col, id_col, limit: Optional[int], cursor: Optional[str]):
+    """stmt, ограниченный страницей после cursor (limit + 1 строка — признак следующей страницы)."""
+    limit = max(1, min(limit or DEFAULT_LIMIT, MAX_LIMIT))
+    if cursor:
+        c_dt, c_id = decode_cursor(cursor)
+        stmt = stmt.where(or_(date_col < c_dt, and_(date_col == c_dt, id_col < c_id)))
+    return stmt.order_by(date_col.desc(), id_col.desc()).limit(limit + 1), limit
+
+def _keyset_result(rows, to_dict: Callable[[object], Dict], limit: int) -> Dict:
+    items = [to_dict(r) for r in rows]
+    next_cursor = None
+    if len(items) > limit:
+        items.pop()
+        next_cursor = encode_cursor(items[-1]["date"], items[-1]["id"])
+    return {"items": items, "next_cursor": next_cursor}
+
+def keyset_page(
+    db: Session,
+    stmt,
+    date_col,
+    id_col,
+    to_dict: Callable[[object], Dict],
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+) -> Dict:
+    """
+    Одна страница stmt (select колонок; to_dict получает Row) в порядке date DESC, id DESC.
+    Возвращает {"items": [...], "next_cursor": str | None}.
+    """
+    stmt, limit = _keyset_stmt(stmt, date_col, id_col, limit, cursor)
+    return _keyset_result(db.execute(stmt), to_dict, limit)
+
+async def keyset_page_async(
+    db: AsyncSession,
+    stmt,
+    date_col,
+    id_col,
+    to_dict: Callable[[object], Dict],
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+) -> Dict:
+    """То же для AsyncSession."""
+    stmt, limit = _keyset_stmt(stmt, date_col, id_col, limit, cursor)
+    return _keyset_result(await db.execute(stmt), to_dict, limit)
+
+def iter_rows(db: Session, stmt, date_col, id_col, to_dict: Callable[[object], Dict]) -> Iterator[Dict]:
+    """Все строки stmt по мере чтения с курсора БД (yield_per), без сборки списка."""
+    stmt = stmt.order_by(date_col.desc(), id_col.desc()).execution_options(yield_per=STREAM_CHUNK)
+    for r in db.execute(stmt):
+        yield to_dict(r)
@@ -1,8 +1,11 @@
 from __future__ import annotations
+import csv
+import io
 from datetime import datetime
-from typing import Optional, List
+from typing import BinaryIO, Optional, List
 
-from sqlalchemy import select, func
+from sqlalchemy import Row, insert, select, func, true, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from ..models import (
@@ -13,6 +16,8 @@ from ..models import (
     LabelingCost,
     POStatus,
 )
+from . import changes  # события Session: счётчики изменений purchase_orders / purchase_order_items
+from .paging import DEFAULT_LIMIT, MAX_LIMIT
 
 # -------- helpers --------
 
@@ -41,51 +46,156 @@ def _to_float(x) -> float:
         return float(x)
     return float(str(x).replace(",", "."))
 
-# -------- tiny upserts/links --------
+def _normalize_items(payload: dict) -> List[dict]:
+    """Validates PO items before anything is written."""
+    if not (payload.get("po_name") or "").strip():
+        raise ValueError("PO name is required.")
+    items = []
+    for n, row in enumerate(payload.get("items", []), start=1):
+        where = f"PO '{payload.get('po_name')}', item {n}"
+        asin = (row.get("asin") or "").strip()
+        if not asin:
+            raise ValueError(f"{where}: ASIN is required for each item.")
+        title = (row.get("listing_title") or "").strip()
+        if not title:
+            raise ValueError(f"{where}: Listing title is required for each item.")
+        qty = int(row.get("quantity") or 0)
+        if qty <= 0:
+            raise ValueError(f"{where}: Quantity must be positive.")
+        items.append({
+            "asin": asin,
+            "listing_title": title,
+            "amazon_link": row.get("amazon_link"),
+            "supplier_mfr_code": row.get("supplier_mfr_code"),
+            "quantity": qty,
+            "purchase_price": _to_float(row.get("purchase_price")),
+            "sales_tax": _to_float(row.get("sales_tax")),
+            "shipping": _to_float(row.get("shipping")),
+            "discount": _to_float(row.get("discount")),
+            "cost_hint": row.get("purchase_price"),
+        })
+    return items
 
-def _upsert_supplier(db: Session, name: Optional[str]) -> Optional[Supplier]:
-    if not name:
-        return None
-    s = db.query(Supplier).filter_by(name=name).one_or_none()
-    if not s:
-        s = Supplier(name=name)
-        db.add(s)
-        db.commit()
-        db.refresh(s)
-    return s
+# -------- batched lookups (one IN query each, no commits) --------
 
-def _attach_product(
-    db: Session,
-    asin: str,
-    listing_title: str,
-    supplier: Optional[Supplier],
-    cost_hint: Optional[float],
-) -> Optional[Product]:
-    """Find or create Product by ASIN and update minimal fields."""
-    p = db.query(Product).filter_by(asin=asin).first()
-    if not p:
-        p = Product(
-            sku=f"AUTO-{asin}",
-            asin=asin,
-            title=listing_title or asin,
-            supplier_id=(supplier.id if supplier else None),
-            cost=_to_float(cost_hint),
+def _resolve_suppliers(db: Session, names: set) -> dict:
+    """name -> Supplier; missing suppliers are created and flushed to get ids."""
+    if not names:
+        return {}
+    found = {s.name: s for s in db.scalars(select(Supplier).where(Supplier.name.in_(names)))}
+    missing = [Supplier(name=n) for n in names if n not in found]
+    if missing:
+        db.add_all(missing)
+        db.flush()
+        found.update({s.name: s for s in missing})
+    return found
+
+def _merge_product(p: dict, item: dict, supplier: Optional[Supplier]) -> None:
+    """Minimal product field updates from a PO item (same rules for new and existing)."""
+    if item["listing_title"]:
+        p["title"] = item["listing_title"]
+    if supplier:
+        p["supplier_id"] = supplier.id
+    if item["cost_hint"] and not p["cost"]:
+        p["cost"] = _to_float(item["cost_hint"])
+
+def _resolve_products(db: Session, rows: List[tuple]) -> dict:
+    """
+    rows: [(item, supplier | None), ...] in payload order -> {asin: product_id}.
+    One SELECT ... WHERE asin IN (...), then one executemany UPDATE for existing
+    products and one executemany INSERT for the missing ones.
+    """
+    asins = {item["asin"] for item, _ in rows}
+    existing = {
+        r.asin: dict(r._mapping)
+        for r in db.execute(
+            select(Product.id, Product.asin, Product.title, Product.supplier_id, Product.cost)
+            .where(Product.asin.in_(asins))
         )
-        db.add(p)
-        db.commit()
-        db.refresh(p)
-    else:
-        if listing_title:
-            p.title = listing_title
-        if supplier:
-            p.supplier_id = supplier.id
-        if cost_hint and not p.cost:
-            p.cost = _to_float(cost_hint)
-        db.commit()
-    return p
+    }
+    before = {asin: dict(p) for asin, p in existing.items()}
+    new: dict = {}
+    for item, supplier in rows:
+        p = existing.get(item["asin"])
+        if p is None:
+            p = new.get(item["asin"])
+        if p is None:
+            new[item["asin"]] = {
+                "sku": f"AUTO-{item['asin']}",
+                "asin": item["asin"],
+                "title": item["listing_title"] or item["asin"],
+                "supplier_id": (supplier.id if supplier else None),
+                "cost": _to_float(item["cost_hint"]),
+            }
+        else:
+            _merge_product(p, item, supplier)
+
+    changed = [
+        {"id": p["id"], "title": p["title"], "supplier_id": p["supplier_id"], "cost": p["cost"]}
+        for asin, p in existing.items() if p != before[asin]
+    ]
+    if changed:
+        db.execute(update(Product), changed)
+    ids = {asin: p["id"] for asin, p in existing.items()}
+    if new:
+        db.execute(insert(Product), list(new.values()))
+        ids.update(db.execute(select(Product.asin, Product.id).where(Product.asin.in_(list(new)))).all())
+    return ids
 
 # -------- core API used by endpoints --------
 
+def create_purchase_orders(db: Session, payloads: List[dict]) -> List[PurchaseOrder]:
+    """
+    Creates many POs in one transaction: all items are validated first, suppliers
+    and products are resolved in batches, and there is a single commit. Any error
+    rolls back everything, so a partial PO is never left behind.
+    """
+    try:
+        normalized = [(p, _normalize_items(p)) for p in payloads]
+        suppliers = _resolve_suppliers(
+            db, {p["supplier_name"] for p, _ in normalized if p.get("supplier_name")}
+        )
+        product_ids = _resolve_products(
+            db,
+            [(item, suppliers.get(p.get("supplier_name"))) for p, items in normalized for item in items],
+        )
+
+        pos = []
+        for payload, items in normalized:
+            supplier = suppliers.get(payload.get("supplier_name"))
+            pos.append(PurchaseOrder(
+                supplier_id=(supplier.id if supplier else None),
+                name=payload["po_name"],
+                invoice_number=payload.get("invoice_number"),
+                order_date=_parse_date(payload.get("order_date")),
+                status=POStatus.NEW,
+                subtotal=float(sum(i["quantity"] * i["purchase_price"] for i in items)),
+                sales_tax=_to_float(payload.get("sales_tax")),
+                shipping=_to_float(payload.get("shipping")),
+                discount=_to_float(payload.get("discount")),
+            ))
+        db.add_all(pos)
+        db.flush()
+
+        item_rows = [
+            {
+                "po_id": po.id,
+                "product_id": product_ids[i["asin"]],
+                **{k: v for k, v in i.items() if k != "cost_hint"},
+            }
+            for po, (_, items) in zip(pos, normalized)
+            for i in items
+        ]
+        if item_rows:
+            db.execute(insert(PurchaseOrderItem), item_rows)
+
+        _recalculate_pos(db, [po.id for po in pos])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return pos
+
 def create_purchase_order(db: Session, payload: dict) -> PurchaseOrder:
     """
     payload = {
@@ -106,108 +216,146 @@ def create_purchase_order(db: Session, payload: dict) -> PurchaseOrder:
         ]
     }
     """
-    supplier = _upsert_supplier(db, payload.get("supplier_name"))
-    po = PurchaseOrder(
-        supplier_id=(supplier.id if supplier else None),
-        name=payload["po_name"],
-        invoice_number=payload.get("invoice_number"),
-        order_date=_parse_date(payload.get("order_date")),
-        status=POStatus.NEW,
-    )
-    db.add(po)
-    db.commit()
-    db.refresh(po)
+    return create_purchase_orders(db, [payload])[0]
 
-    subtotal = 0.0
-    for row in payload.get("items", []):
-        asin = (row.get("asin") or "").strip()
-        if not asin:
-            raise ValueError("ASIN is required for each item.")
-        title = (row.get("listing_title") or "").strip()
-        if not title:
-            raise ValueError("Listing title is required for each item.")
+# supplier invoice CSV: one row per item, rows with the same po_name/invoice_number form one PO
+_PO_FIELDS = ("supplier_name", "po_name", "invoice_number", "order_date")
+_PO_TOTAL_FIELDS = ("po_sales_tax", "po_shipping", "po_discount")
 
-        p = _attach_product(db, asin, title, supplier, row.get("purchase_price"))
+def parse_po_csv(fileobj: BinaryIO) -> List[dict]:
+    """
+    Reads a supplier invoice CSV into create_purchase_orders payloads.
+    Columns: po_name, supplier_name, invoice_number, order_date, asin, listing_title,
+    quantity, purchase_price, amazon_link, supplier_mfr_code, sales_tax, shipping, discount,
+    and optional PO-level po_sales_tax/po_shipping/po_discount (default: sum of item values).
+    """
+    reader = csv.DictReader(io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline=""))
+    reader.fieldnames = [(h or "").strip().lower().replace(" ", "_") for h in (reader.fieldnames or [])]
+    if "po_name" not in reader.fieldnames or "asin" not in reader.fieldnames:
+        raise ValueError("CSV must have at least po_name and asin columns.")
 
-        qty = int(row.get("quantity") or 0)
-        if qty <= 0:
-            raise ValueError("Quantity must be positive.")
-        price = _to_float(row.get("purchase_price"))
-        subtotal += qty * price
-
-        item = PurchaseOrderItem(
-            po_id=po.id,
-            product_id=(p.id if p else None),
-            asin=asin,
-            listing_title=title,
-            amazon_link=row.get("amazon_link"),
-            supplier_mfr_code=row.get("supplier_mfr_code"),
-            quantity=qty,
-            purchase_price=price,
-            sales_tax=_to_float(row.get("sales_tax")),
-            shipping=_to_float(row.get("shipping")),
-            discount=_to_float(row.get("discount")),
-        )
-        db.add(item)
+    payloads: dict = {}
+    for row in reader:
+        row = {k: (v.strip() if isinstance(v, str) else v) for k, v in row.items() if k}
+        if not any(row.values()):
+            continue
+        key = (row.get("po_name"), row.get("invoice_number"))
+        po = payloads.get(key)
+        if po is None:
+            po = payloads[key] = {k: row.get(k) or None for k in _PO_FIELDS}
+            po.update({k: None for k in _PO_TOTAL_FIELDS}, items=[])
+        for k in _PO_TOTAL_FIELDS:
+            if row.get(k):
+                po[k] = row[k]
+        po["items"].append(row)
 
-    po.subtotal = float(subtotal)
-    po.sales_tax = _to_float(payload.get("sales_tax"))
-    po.shipping = _to_float(payload.get("shipping"))
-    po.discount = _to_float(payload.get("discount"))
+    out = []
+    for po in payloads.values():
+        for k in _PO_TOTAL_FIELDS:
+            name = k[len("po_"):]
+            total = po.pop(k)
+            po[name] = total if total else sum(_to_float(i.get(name)) for i in po["items"])
+        out.append(po)
+    return out
 
-    db.commit()
+def _recalculate_pos(db: Session, po_ids: Optional[List[int]] = None) -> int:
+    """
+    Пересчёт unit_cogs/extended_total по строкам, Product.cost и итогов PO
+    фиксированным числом запросов (po_ids=None — все PO):
+    1 select PO, 1 select строк с агрегатом labeling, 3 bulk update.
+    """
+    po_q = select(
+        PurchaseOrder.id, PurchaseOrder.subtotal, PurchaseOrder.sales_tax,
+        PurchaseOrder.shipping, PurchaseOrder.discount,
+    )
+    if po_ids is not None:
+        po_q = po_q.where(PurchaseOrder.id.in_(po_ids))
+    pos = {r.id: r for r in db.execute(po_q)}
+    if not pos:
+        return 0
 
-    _recalculate_po_totals_and_cogs(db, po.id)
-    db.refresh(po)
-    return po
+    # все PO — без фильтра: список id всех PO упёрся бы в лимит параметров SQLite
+    item_filter = true() if po_ids is None else PurchaseOrderItem.po_id.in_(list(pos))
+    lbl = (
+        select(LabelingCost.po_item_id, func.sum(LabelingCost.cost_total).label("lbl_sum"))
+        .where(LabelingCost.po_item_id.in_(select(PurchaseOrderItem.id).where(item_filter)))
+        .group_by(LabelingCost.po_item_id)
+        .subquery()
+    )
+    items = db.execute(
+        select(
+            PurchaseOrderItem.id, PurchaseOrderItem.po_id, PurchaseOrderItem.product_id,
+            PurchaseOrderItem.quantity, PurchaseOrderItem.purchase_price,
+            PurchaseOrderItem.sales_tax, PurchaseOrderItem.shipping, PurchaseOrderItem.discount,
+            func.coalesce(lbl.c.lbl_sum, 0.0).label("lbl_sum"),
+        )
+        .outerjoin(lbl, lbl.c.po_item_id == PurchaseOrderItem.id)
+        .join(PurchaseOrder, PurchaseOrder.id == PurchaseOrderItem.po_id)
+        .where(item_filter)
+        # порядок важен для Product.cost: побеждает строка из самого позднего PO
+        .order_by(PurchaseOrder.order_date, PurchaseOrder.id, PurchaseOrderItem.id)
+    ).all()
 
-def _recalculate_po_totals_and_cogs(db: Session, po_id: int) -> None:
-    po = db.get(PurchaseOrder, po_id)
-    items: List[PurchaseOrderItem] = db.query(PurchaseOrderItem).filter_by(po_id=po_id).all()
-    total_units = sum(i.quantity for i in items) or 1
+    by_po: dict = {po_id: [] for po_id in pos}
+    for i in items:
+        by_po[i.po_id].append(i)
 
-    # pools to allocate per unit (only remaining parts)
-    alloc_tax_pool = po.sales_tax - sum(i.sales_tax for i in items)
-    alloc_ship_pool = po.shipping - sum(i.shipping for i in items)
-    alloc_disc_pool = po.discount - sum(i.discount for i in items)  # discount will be negative per unit
+    item_updates, product_cost, po_updates = [], {}, []
+    for po_id, po_items in by_po.items():
+        po = pos[po_id]
+        total_units = sum(i.quantity for i in po_items) or 1
+
+        # pools to allocate per unit (only remaining parts)
+        alloc_tax_pool = (po.sales_tax or 0.0) - sum(i.sales_tax or 0.0 for i in po_items)
+        alloc_ship_pool = (po.shipping or 0.0) - sum(i.shipping or 0.0 for i in po_items)
+        alloc_disc_pool = (po.discount or 0.0) - sum(i.discount or 0.0 for i in po_items)
 
-    for i in items:
         per_unit_tax = (alloc_tax_pool / total_units) if alloc_tax_pool else 0.0
         per_unit_ship = (alloc_ship_pool / total_units) if alloc_ship_pool else 0.0
-        per_unit_disc = (alloc_disc_pool / total_units) if alloc_disc_pool else 0.0
-        per_unit_disc *= -1.0  # скидка уменьшает себестоимость
-
-        lbl_sum = db.scalar(
-            select(func.coalesce(func.sum(LabelingCost.cost_total), 0.0)).where(LabelingCost.po_item_id == i.id)
-        ) or 0.0
-        per_unit_label = lbl_sum / i.quantity if i.quantity else 0.0
-
-        unit_cogs = (
-            float(i.purchase_price)
-            + (i.sales_tax / i.quantity if i.quantity else 0.0) + per_unit_tax
-            + (i.shipping / i.quantity if i.quantity else 0.0) + per_unit_ship
-            + per_unit_label
-            + per_unit_disc
-        )
+        per_unit_disc = -(alloc_disc_pool / total_units) if alloc_disc_pool else 0.0  # скидка уменьшает себестоимость
 
-        i.unit_cogs = round(unit_cogs, 6)
-        i.extended_total = round(i.unit_cogs * i.quantity, 6)
+        for i in po_items:
+            qty = i.quantity
+            unit_cogs = round(
+                float(i.purchase_price or 0.0)
+                + ((i.sales_tax or 0.0) / qty if qty else 0.0) + per_unit_tax
+                + ((i.shipping or 0.0) / qty if qty else 0.0) + per_unit_ship
+                + (i.lbl_sum / qty if qty else 0.0)
+                + per_unit_disc,
+                6,
+            )
+            item_updates.append(
+                {"id": i.id, "unit_cogs": unit_cogs, "extended_total": round(unit_cogs * qty, 6)}
+            )
+            if i.product_id:
+                product_cost[i.product_id] = float(unit_cogs)
 
-        if i.product_id:
-            prod = db.get(Product, i.product_id)
-            prod.cost = float(i.unit_cogs)
+        labeling_total = float(sum(i.lbl_sum for i in po_items))
+        po_updates.append({
+            "id": po_id,
+            "labeling_total": labeling_total,
+            "total_expense": float(
+                (po.subtotal or 0.0) + (po.sales_tax or 0.0) + (po.shipping or 0.0)
+                - (po.discount or 0.0) + labeling_total
+            ),
+        })
 
-    po.labeling_total = float(
-        db.scalar(
-            select(func.coalesce(func.sum(LabelingCost.cost_total), 0.0)).where(
-                LabelingCost.po_item_id.in_([x.id for x in items])
-            )
-        )
-        or 0.0
-    )
-    po.total_expense = float(po.subtotal + po.sales_tax + po.shipping - po.discount + po.labeling_total)
+    if item_updates:
+        db.execute(update(PurchaseOrderItem), item_updates)
+    if product_cost:
+        db.execute(update(Product), [{"id": k, "cost": v} for k, v in product_cost.items()])
+    db.execute(update(PurchaseOrder), po_updates)
+    return len(po_updates)
 
+def _recalculate_po_totals_and_cogs(db: Session, po_id: int) -> None:
+    _recalculate_pos(db, [po_id])
+    db.commit()
+
+def recalculate_all_purchase_orders(db: Session) -> int:
+    """Массовый пересчёт всех PO (например, после корректировки себестоимости)."""
+    n = _recalculate_pos(db)
     db.commit()
+    return n
 
 def add_labeling_cost(db: Session, po_item_id: int, note: Optional[str], cost_total: float) -> LabelingCost:
     lc = LabelingCost(po_item_id=po_item_id, note=note, cost_total=_to_float(cost_total))
@@ -218,27 +366,96 @@ def add_labeling_cost(db: Session, po_item_id: int, note: Optional[str], cost_to
     _recalculate_po_totals_and_cogs(db, item.po_id)
     return lc
 
-def list_purchase_orders(db: Session):
-    pos = db.query(PurchaseOrder).order_by(PurchaseOrder.order_date.desc(), PurchaseOrder.id.desc()).all()
-    # отдаём лёгкий словарь для UI
-    out = []
-    for p in pos:
-        out.append(
-            {
-                "id": p.id,
-                "name": p.name,
-                "supplier": (p.supplier.name if p.supplier else None),
-                "order_date": p.order_date.isoformat() if p.order_date else None,
-                "status": p.status.value,
-                "subtotal": p.subtotal,
-                "sales_tax": p.sales_tax,
-                "shipping": p.shipping,
-                "discount": p.discount,
-                "labeling_total": p.labeling_total,
-                "total_expense": p.total_expense,
-            }
+def _po_list_query():
+    # колонки PO + имя поставщика одним LEFT JOIN (не сущности и не SELECT на каждый PO)
+    return (
+        select(
+            PurchaseOrder.id, PurchaseOrder.name, Supplier.name.label("supplier"), PurchaseOrder.order_date,
+            PurchaseOrder.status, PurchaseOrder.subtotal, PurchaseOrder.sales_tax, PurchaseOrder.shipping,
+            PurchaseOrder.discount, PurchaseOrder.labeling_total, PurchaseOrder.total_expense,
         )
-    return out
+        .outerjoin(Supplier, Supplier.id == PurchaseOrder.supplier_id)
+        .order_by(PurchaseOrder.order_date.desc(), PurchaseOrder.id.desc())
+    )
+
+def _po_dict(p: Row) -> dict:
+    # отдаём лёгкий словарь для UI
+    return {
+        "id": p.id,
+        "name": p.name,
+        "supplier": p.supplier,
+        "order_date": p.order_date.isoformat() if p.order_date else None,
+        "status": p.status.value,
+        "subtotal": p.subtotal,
+        "sales_tax": p.sales_tax,
+        "shipping": p.shipping,
+        "discount": p.discount,
+        "labeling_total": p.labeling_total,
+        "total_expense": p.total_expense,
+    }
+
+def list_purchase_orders(db: Session):
+    return [_po_dict(p) for p in db.execute(_po_list_query())]
+
+async def list_purchase_orders_async(db: AsyncSession):
+    return [_po_dict(p) for p in await db.execute(_po_list_query())]
+
+# -------- позиции PO для страниц Label / Transport / Inventory --------
+
+PO_ITEM_FIELDS = {c.name: c for c in PurchaseOrderItem.__table__.c}
+
+def _po_item_columns(fields: Optional[str]) -> list:
+    """?fields=asin,quantity -> колонки; id отдаётся всегда (курсор и ключ строки в UI)."""
+    if not fields:
+        return list(PO_ITEM_FIELDS.values())
+    names = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [n for n in names if n not in PO_ITEM_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return [PurchaseOrderItem.id] + [PO_ITEM_FIELDS[n] for n in dict.fromkeys(names) if n != "id"]
+
+def list_po_items(
+    db: Session,
+    po_id: Optional[int] = None,
+    status: Optional[str] = None,
+    asin: Optional[str] = None,
+    open_only: bool = False,
+    fields: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+) -> dict:
+    """
+    Страница позиций PO (по id): только запрошенные колонки, плоскими словарями.
+    Фильтры: po_id, status PO (NEW/CLOSED), префикс ASIN, open_only (= status NEW).
+    Возвращает {"items": [...], "next_cursor": str | None}.
+    """
+    q = select(*_po_item_columns(fields))
+    if status or open_only:
+        try:
+            st = POStatus(status) if status else POStatus.NEW
+        except ValueError:
+            raise ValueError(f"Bad status: {status}. Use one of: {', '.join(s.value for s in POStatus)}")
+        if open_only and st != POStatus.NEW:
+            return {"items": [], "next_cursor": None}
+        q = q.join(PurchaseOrder, PurchaseOrder.id == PurchaseOrderItem.po_id).where(PurchaseOrder.status == st)
+    if po_id is not None:
+        q = q.where(PurchaseOrderItem.po_id == po_id)
+    if asin:
+        q = q.where(PurchaseOrderItem.asin.startswith(asin, autoescape=True))
+    if cursor:
+        try:
+            q = q.where(PurchaseOrderItem.id > int(cursor))
+        except ValueError:
+            raise ValueError("Invalid cursor")
+    limit = max(1, min(limit or DEFAULT_LIMIT, MAX_LIMIT))
+    q = q.order_by(PurchaseOrderItem.id).limit(limit + 1)
+
+    items = [dict(r) for r in db.execute(q).mappings()]
+    next_cursor = None
+    if len(items) > limit:
+        items.pop()
+        next_cursor = str(items[-1]["id"])
+    return {"items": items, "next_cursor": next_cursor}
 
 def get_po_with_items(db: Session, po_id: int) -> PurchaseOrder:
     return db.query(PurchaseOrder).filter_by(id=po_id).one()
@@ -0,0 +1,182 @@
+
+"""
+Content-addressed кэш документов отчётов: файл хранится один раз по sha256 распакованного
+содержимого (REPORT_CACHE_DIR/ab/abcd....csv.gz), в report_documents — запись на
+report_type + окно + хэш. Документ, байт-в-байт совпадающий с уже загруженным, повторно не ингестится.
+"""
+import gzip
+import hashlib
+import os
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from .. import telemetry
+from ..config import settings
+from ..models import ReportDocument
+from ..spapi.parser import ReportSource, open_report_bytes
+from .ingest import ingest_report, load_sku_map
+
+READ_CHUNK = 1 << 16
+
+def _cache_dir() -> Path:
+    return Path(settings.report_cache_dir)
+
+def _spool(source: ReportSource) -> tuple[str, Path]:
+    """
+    Один проход по документу: sha256 распакованного содержимого + сжатая копия во временном
+    файле рядом с кэшем (поток источника читается ровно один раз).
+    """
+    root = _cache_dir()
+    root.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=root, suffix=".part")
+    h = hashlib.sha256()
+    try:
+        with os.fdopen(fd, "wb") as out, gzip.GzipFile(fileobj=out, mode="wb", mtime=0) as gz, \
+                open_report_bytes(source) as raw:
+            while block := raw.read(READ_CHUNK):
+                h.update(block)
+                gz.write(block)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return h.hexdigest(), Path(tmp)
+
+def store_document(
+    db: Session,
+    report_type: str,
+    source: ReportSource,
+    window_start: Optional[datetime] = None,
+    window_end: Optional[datetime] = None,
+) -> tuple[ReportDocument, bool]:
+    """
+    Кладёт документ в кэш. Возвращает (запись, нужен ли ingest): False, если документ
+    того же типа с таким же содержимым уже был загружен (в любом окне).
+    """
+    sha, tmp = _spool(source)
+    target = _cache_dir() / sha[:2] / f"{sha}.csv.gz"
+    if target.exists():
+        tmp.unlink()
+    else:
+        target.parent.mkdir(exist_ok=True)
+        tmp.replace(target)
+
+    doc = db.scalars(select(ReportDocument).where(
+        ReportDocument.report_type == report_type,
+        ReportDocument.window_start.is_not_distinct_from(window_start),
+        ReportDocument.window_end.is_not_distinct_from(window_end),
+        ReportDocument.sha256 == sha,
+    )).one_or_none()
+    if doc is None:
+        doc = ReportDocument(report_type=report_type, window_start=window_start, window_end=window_end, sha256=sha)
+        db.add(doc)
+    doc.path = str(target)
+    doc.size = target.stat().st_size
+    doc.fetched_at = datetime.utcnow()
+    # файл мог быть вытеснен и скачан заново — восстанавливаем путь у всех записей с этим хэшем
+    db.execute(update(ReportDocument).where(ReportDocument.sha256 == sha).values(path=str(target), size=doc.size))
+    db.commit()
+
+    already = db.scalar(select(func.count()).select_from(ReportDocument).where(
+        ReportDocument.report_type == report_type,
+        ReportDocument.sha256 == sha,
+        ReportDocument.ingested_at.is_not(None),
+    ))
+    return doc, not already
+
+def ingest_document(db: Session, doc: ReportDocument, sku_map: Optional[dict[str, int]] = None) -> dict:
+    """Ingest из кэша (без обращения к API) и отметка в report_documents."""
+    if not doc.path or not os.path.exists(doc.path):
+        raise FileNotFoundError(f"report document {doc.id} ({doc.sha256[:12]}) is not in the cache")
+    result = ingest_report(db, doc.report_type, Path(doc.path), sku_map)
+    doc.ingested_at = datetime.utcnow()
+    doc.rows = result["inserted"]
+    db.commit()
+    return result
+
+def fetch_and_ingest(
+    db: Session,
+    report_type: str,
+    source: ReportSource,
+    window_start: Optional[datetime] = None,
+    window_end: Optional[datetime] = None,
+    sku_map: Optional[dict[str, int]] = None,
+) -> dict:
+    """Шаг daily_job: кэшировать документ и загрузить, если такого содержимого ещё не было."""
+    with telemetry.span("cache"):
+        doc, fresh = store_document(db, report_type, source, window_start, window_end)
+    if not fresh:
+        if doc.ingested_at is None:
+            # то же содержимое уже загружено под другим окном — этот документ считаем обработанным
+            doc.ingested_at, doc.rows = datetime.utcnow(), 0
+            db.commit()
+        return {"document": doc.sha256, "skipped": True, "inserted": 0}
+    return {"document": doc.sha256, "skipped": False, **ingest_document(db, doc, sku_map)}
+
+def replay(
+    db: Session,
+    report_type: Optional[str] = None,
+    since: Optional[datetime] = None,
+    pending_only: bool = False,
+) -> list[dict]:
+    """Повторный ingest закэшированных документов в порядке получения, без обращения к API."""
+    q = select(ReportDocument).where(ReportDocument.path.is_not(None)).order_by(ReportDocument.fetched_at, ReportDocument.id)
+    if report_type:
+        q = q.where(ReportDocument.report_type == report_type)
+    if since:
+        q = q.where(ReportDocument.fetched_at >= since)
+    if pending_only:
+        q = q.where(ReportDocument.ingested_at.is_(None))
+    sku_map = load_sku_map(db)
+    out, seen = [], set()
+    for doc in db.scalars(q).all():
+        # одно и то же содержимое под разными окнами грузим один раз
+        if (doc.report_type, doc.sha256) in seen:
+            continue
+        seen.add((doc.report_type, doc.sha256))
+        result = ingest_document(db, doc, sku_map)
+        out.append({"id": doc.id, "report_type": doc.report_type, "document": doc.sha256, **result})
+    return out
+
+def evict(db: Session, max_bytes: Optional[int] = None, max_age_days: Optional[float] = None) -> dict:
+    """
+    Вытеснение файлов: старше max_age_days, затем самые старые, пока кэш больше max_bytes.
+    Ещё не загруженные документы не трогаем. Записи остаются (path=None) — по хэшу
+    повторный документ всё равно распознаётся.
+    """
+    max_bytes = settings.report_cache_max_mb * 1024 * 1024 if max_bytes is None else max_bytes
+    max_age_days = settings.report_cache_max_age_days if max_age_days is None else max_age_days
+    cutoff = datetime.utcnow() - timedelta(days=max_age_days)
+
+    # по файлу: последний fetched_at и загружены ли все записи, что на него ссылаются
+    blobs = db.execute(
+        select(
+            ReportDocument.sha256,
+            func.max(ReportDocument.path),
+            func.max(ReportDocument.size),
+            func.max(ReportDocument.fetched_at),
+            func.count(ReportDocument.id) - func.count(ReportDocument.ingested_at),
+        )
+        .where(ReportDocument.path.is_not(None))
+        .group_by(ReportDocument.sha256)
+        .order_by(func.max(ReportDocument.fetched_at))
+    ).all()
+    total = sum(size or 0 for _, _, size, _, _ in blobs)
+    evicted, freed = [], 0
+    for sha, path, size, last_fetched, pending in blobs:
+        if pending:
+            continue
+        if last_fetched >= cutoff and total - freed <= max_bytes:
+            continue
+        if path and os.path.exists(path):
+            os.unlink(path)
+        evicted.append(sha)
+        freed += size or 0
+    if evicted:
+        db.execute(update(ReportDocument).where(ReportDocument.sha256.in_(evicted)).values(path=None))
+        db.commit()
+    return {"evicted": len(evicted), "freed_bytes": freed, "cache_bytes": total - freed}
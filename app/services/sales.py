@@ -1,46 +1,128 @@
 from __future__ import annotations
+import codecs
+import csv
+import re
 from datetime import datetime
-from typing import Optional, List, Dict
+from itertools import chain
+from typing import BinaryIO, Iterator, Optional, List, Dict
+from sqlalchemy import Row, select, func
 from sqlalchemy.orm import Session
+from app.db import dialect_insert
 from app.models import SalesRecord, PurchaseOrderItem
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.services.paging import keyset_page, keyset_page_async, iter_rows
 
-def list_sales(db: Session, month: Optional[int] = None, year: Optional[int] = None) -> List[dict]:
-    q = db.query(SalesRecord)
+# только колонки, которые уходят в ответ: Row-кортежи вместо ORM-сущностей (без identity map)
+_SALES_COLUMNS = (
+    SalesRecord.id, SalesRecord.external_id, SalesRecord.date, SalesRecord.asin, SalesRecord.description,
+    SalesRecord.amount, SalesRecord.type, SalesRecord.party, SalesRecord.month, SalesRecord.units_sold,
+    SalesRecord.cogs_per_unit, SalesRecord.fba_fee_per_unit, SalesRecord.amazon_fee_per_unit,
+    SalesRecord.after_fees_per_unit, SalesRecord.net_per_unit, SalesRecord.pay_supplier_per_unit,
+    SalesRecord.prep_per_unit, SalesRecord.ship_to_amz_per_unit, SalesRecord.po_id, SalesRecord.po_item_id,
+)
+
+def _sales_query(month: Optional[int], year: Optional[int]):
+    q = select(*_SALES_COLUMNS)
     if year:
-        q = q.filter(SalesRecord.year == year)
+        q = q.where(SalesRecord.year == year)
     if month:
-        q = q.filter(SalesRecord.month == month)
-    q = q.order_by(SalesRecord.date.desc(), SalesRecord.id.desc())
-
-    out = []
-    for s in q.all():
-        out.append({
-            "id": s.id,
-            "external_id": s.external_id,
-            "date": s.date.isoformat(),
-            "asin": s.asin,
-            "description": s.description,
-            "amount": s.amount,
-            "type": s.type,
-            "party": s.party,
-            "month": s.month,
-            "units_sold": s.units_sold,
-            "cogs_per_unit": s.cogs_per_unit,
-            "fba_fee_per_unit": s.fba_fee_per_unit,
-            "amazon_fee_per_unit": s.amazon_fee_per_unit,
-            "after_fees_per_unit": s.after_fees_per_unit,
-            "net_per_unit": s.net_per_unit,
-            "pay_supplier_per_unit": s.pay_supplier_per_unit,
-            "prep_per_unit": s.prep_per_unit,
-            "ship_to_amz_per_unit": s.ship_to_amz_per_unit,
-            "po_id": s.po_id,
-            "po_item_id": s.po_item_id
-        })
-    return out
-
-def upsert_sales(db: Session, records: List[Dict]) -> int:
+        q = q.where(SalesRecord.month == month)
+    return q
+
+def _sales_dict(s: Row) -> dict:
+    return {
+        "id": s.id,
+        "external_id": s.external_id,
+        "date": s.date.isoformat(),
+        "asin": s.asin,
+        "description": s.description,
+        "amount": s.amount,
+        "type": s.type,
+        "party": s.party,
+        "month": s.month,
+        "units_sold": s.units_sold,
+        "cogs_per_unit": s.cogs_per_unit,
+        "fba_fee_per_unit": s.fba_fee_per_unit,
+        "amazon_fee_per_unit": s.amazon_fee_per_unit,
+        "after_fees_per_unit": s.after_fees_per_unit,
+        "net_per_unit": s.net_per_unit,
+        "pay_supplier_per_unit": s.pay_supplier_per_unit,
+        "prep_per_unit": s.prep_per_unit,
+        "ship_to_amz_per_unit": s.ship_to_amz_per_unit,
+        "po_id": s.po_id,
+        "po_item_id": s.po_item_id
+    }
+
+def list_sales(
+    db: Session,
+    month: Optional[int] = None,
+    year: Optional[int] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+) -> dict:
+    """Страница продаж (новые сначала): {"items": [...], "next_cursor": ...}."""
+    return keyset_page(
+        db, _sales_query(month, year), SalesRecord.date, SalesRecord.id, _sales_dict, limit, cursor
+    )
+
+async def list_sales_async(
+    db: AsyncSession,
+    month: Optional[int] = None,
+    year: Optional[int] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+) -> dict:
+    return await keyset_page_async(
+        db, _sales_query(month, year), SalesRecord.date, SalesRecord.id, _sales_dict, limit, cursor
+    )
+
+def iter_sales(db: Session, month: Optional[int] = None, year: Optional[int] = None) -> Iterator[dict]:
+    return iter_rows(db, _sales_query(month, year), SalesRecord.date, SalesRecord.id, _sales_dict)
+
+# размер пачки для INSERT ... ON CONFLICT (20 колонок * 500 строк < лимита параметров SQLite)
+UPSERT_CHUNK = 500
+
+_FLOAT_FIELDS = (
+    "cogs_per_unit", "fba_fee_per_unit", "amazon_fee_per_unit", "after_fees_per_unit",
+    "net_per_unit", "pay_supplier_per_unit", "prep_per_unit", "ship_to_amz_per_unit",
+)
+
+def _sales_row(r: Dict) -> Optional[dict]:
+    """Нормализует входной record в словарь колонок sales_records; None — строку пропускаем."""
+    ext = str(r.get("external_id") or "").strip()
+    asin = str(r.get("asin") or "").strip()
+    if not ext or not asin:
+        return None
+    try:
+        dt = datetime.fromisoformat(r.get("date"))
+    except:
+        dt = datetime.utcnow()
+
+    row = {
+        "external_id": ext,
+        "date": dt,
+        "asin": asin,
+        "description": r.get("description"),
+        "amount": float(r.get("amount") or 0),
+        "type": r.get("type"),
+        "party": r.get("party"),
+        "month": int(r.get("month") or dt.month),
+        "year": int(r.get("year") or dt.year),
+        "units_sold": int(r.get("units_sold") or 0),
+        "po_item_id": int(r["po_item_id"]) if r.get("po_item_id") else None,
+        "po_id": None,
+    }
+    for k in _FLOAT_FIELDS:
+        row[k] = float(r.get(k) or 0)
+    return row
+
+def _chunks(seq: List, size: int):
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+def upsert_sales(db: Session, records: List[Dict]) -> Dict[str, int]:
     """
-    Простая загрузка из Sellerboard/Amazon (JSON).
+    Загрузка из Sellerboard/Amazon (JSON) пачками INSERT ... ON CONFLICT(external_id) DO UPDATE.
     Ожидаемый формат record:
     {
       "external_id": "...", "date": "YYYY-MM-DD", "asin": "...",
@@ -49,49 +131,175 @@ def upsert_sales(db: Session, records: List[Dict]) -> int:
       "after_fees_per_unit": 0, "net_per_unit": 0, "pay_supplier_per_unit": 0,
       "prep_per_unit": 0, "ship_to_amz_per_unit": 0, "po_item_id": 123 (optional)
     }
+    Записи без external_id или ASIN пропускаются. Возвращает {"inserted", "updated", "skipped"}.
     """
-    cnt = 0
+    skipped = 0
+    rows: Dict[str, dict] = {}  # external_id -> row; дубликаты внутри загрузки — побеждает последний
     for r in records:
-        ext = (r.get("external_id") or "").strip()
-        date_str = r.get("date")
-        try:
-            dt = datetime.fromisoformat(date_str)
-        except:
-            dt = datetime.utcnow()
-
-        sr = db.query(SalesRecord).filter_by(external_id=ext).one_or_none()
-        if not sr:
-            sr = SalesRecord(external_id=ext)
-            db.add(sr)
-
-        sr.date = dt
-        sr.asin = r.get("asin")
-        sr.description = r.get("description")
-        sr.amount = float(r.get("amount") or 0)
-        sr.type = r.get("type")
-        sr.party = r.get("party")
-        sr.month = int(r.get("month") or dt.month)
-        sr.year = int(r.get("year") or dt.year)
-
-        sr.units_sold = int(r.get("units_sold") or 0)
-        sr.cogs_per_unit = float(r.get("cogs_per_unit") or 0)
-        sr.fba_fee_per_unit = float(r.get("fba_fee_per_unit") or 0)
-        sr.amazon_fee_per_unit = float(r.get("amazon_fee_per_unit") or 0)
-        sr.after_fees_per_unit = float(r.get("after_fees_per_unit") or 0)
-        sr.net_per_unit = float(r.get("net_per_unit") or 0)
-        sr.pay_supplier_per_unit = float(r.get("pay_supplier_per_unit") or 0)
-        sr.prep_per_unit = float(r.get("prep_per_unit") or 0)
-        sr.ship_to_amz_per_unit = float(r.get("ship_to_amz_per_unit") or 0)
-
-        po_item_id = r.get("po_item_id")
-        if po_item_id:
-            sr.po_item_id = int(po_item_id)
-            # при желании подтянем po_id
-            poi = db.get(PurchaseOrderItem, int(po_item_id))
-            if poi:
-                sr.po_id = poi.po_id
-
-        cnt += 1
+        row = _sales_row(r)
+        if row is None:
+            skipped += 1
+            continue
+        if row["external_id"] in rows:
+            skipped += 1
+        rows[row["external_id"]] = row
+
+    inserted = updated = 0
+    for chunk in _chunks(list(rows.values()), UPSERT_CHUNK):
+        ext_ids = [row["external_id"] for row in chunk]
+        existing = set(db.scalars(
+            select(SalesRecord.external_id).where(SalesRecord.external_id.in_(ext_ids))
+        ))
+
+        # po_id подтягиваем одним запросом на пачку
+        poi_ids = {row["po_item_id"] for row in chunk if row["po_item_id"]}
+        if poi_ids:
+            po_by_item = dict(db.execute(
+                select(PurchaseOrderItem.id, PurchaseOrderItem.po_id).where(PurchaseOrderItem.id.in_(poi_ids))
+            ).all())
+            for row in chunk:
+                if row["po_item_id"]:
+                    row["po_id"] = po_by_item.get(row["po_item_id"])
+
+        stmt = dialect_insert(db, SalesRecord.__table__).values(chunk)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[SalesRecord.external_id],
+            set_={
+                k: stmt.excluded[k]
+                for k in chunk[0]
+                # po_item_id/po_id не затираем, если в новой записи их нет
+                if k not in ("external_id", "po_item_id", "po_id")
+            } | {
+                "po_item_id": func.coalesce(stmt.excluded.po_item_id, SalesRecord.po_item_id),
+                "po_id": func.coalesce(stmt.excluded.po_id, SalesRecord.po_id),
+            },
+        )
+        db.execute(stmt)
+
+        updated += len(existing)
+        inserted += len(chunk) - len(existing)
 
     db.commit()
-    return cnt
+    return {"inserted": inserted, "updated": updated, "skipped": skipped}
+
+
+# -------- Sellerboard CSV (серверный потоковый импорт) --------
+
+# поле -> допустимые заголовки колонок (в нижнем регистре)
+SELLERBOARD_COLUMNS = {
+    "id": ("id", "order id", "номер заказа"),
+    "date": ("date", "дата"),
+    "asin": ("asin",),
+    "desc": ("title", "описание"),
+    "units": ("units", "qty", "кол-во"),
+    "amount": ("sales", "amount", "выручка"),
+    "fba": ("fba", "fba fee"),
+    "amz": ("amazon fee", "commission"),
+}
+
+READ_CHUNK = 64 * 1024   # байт за одно чтение из загруженного файла
+IMPORT_BATCH = 2000      # записей на один вызов upsert_sales
+
+def _iter_text_lines(fileobj: BinaryIO, chunk_size: int = READ_CHUNK) -> Iterator[str]:
+    """Читает бинарный поток кусками фиксированного размера и отдаёт строки по одной."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    tail = ""
+    while True:
+        chunk = fileobj.read(chunk_size)
+        text = tail + decoder.decode(chunk, final=not chunk)
+        parts = text.split("\n")
+        tail = parts.pop()
+        for line in parts:
+            yield line + "\n"
+        if not chunk:
+            break
+    if tail:
+        yield tail
+
+_THOUSANDS_COMMA = re.compile(r"^\d{1,3}(,\d{3})+(\.\d+)?$")
+_NOT_NUMERIC = re.compile(r"[^\d,.\-]")
+
+def _sb_number(v: Optional[str]) -> float:
+    """
+    Число из экспорта Sellerboard: "1,234" / "1,234.56" — запятая-разделитель тысяч,
+    иначе запятая десятичная ("3,0", "10,5", "1.234,56"). Пробелы и символы валют отбрасываются.
+    """
+    s = _NOT_NUMERIC.sub("", str(v or ""))
+    if "," in s:
+        s = s.replace(",", "") if _THOUSANDS_COMMA.match(s) else s.replace(".", "").replace(",", ".")
+    try:
+        return float(s) if s else 0.0
+    except ValueError:
+        return 0.0
+
+def _sb_units(v: Optional[str]) -> int:
+    return int(round(_sb_number(v)))
+
+def _sb_date(s: Optional[str]) -> Optional[str]:
+    """YYYY-MM-DD | DD.MM.YYYY | MM/DD/YYYY -> YYYY-MM-DD"""
+    s = (s or "").strip()
+    if re.match(r"^\d{4}-\d{2}-\d{2}", s):
+        return s[:10]
+    m = re.match(r"^(\d{1,2})\.(\d{1,2})\.(\d{4})", s)
+    if m:
+        return f"{m[3]}-{int(m[2]):02d}-{int(m[1]):02d}"
+    m = re.match(r"^(\d{1,2})/(\d{1,2})/(\d{4})", s)
+    if m:
+        return f"{m[3]}-{int(m[1]):02d}-{int(m[2]):02d}"
+    return s or None
+
+def iter_sellerboard_records(fileobj: BinaryIO, chunk_size: int = READ_CHUNK) -> Iterator[Dict]:
+    """
+    Потоково разбирает экспорт Sellerboard (Reports → Orders → Export CSV) в records для upsert_sales.
+    Разделитель (`,` или `;`) определяется по строке заголовка.
+    """
+    lines = _iter_text_lines(fileobj, chunk_size)
+    header = next(lines, "")
+    delimiter = ";" if header.count(";") > header.count(",") else ","
+    reader = csv.reader(chain([header], lines), delimiter=delimiter)
+
+    head = [h.strip().lower() for h in next(reader, [])]
+    idx = {}
+    for key, names in SELLERBOARD_COLUMNS.items():
+        idx[key] = next((head.index(n) for n in names if n in head), -1)
+    if idx["id"] < 0 or idx["date"] < 0 or idx["asin"] < 0:
+        raise ValueError("Не найдены ключевые колонки (ID / Date / ASIN)")
+
+    def col(c: List[str], key: str) -> Optional[str]:
+        i = idx[key]
+        return c[i] if 0 <= i < len(c) else None
+
+    for c in reader:
+        asin = (col(c, "asin") or "").strip()
+        if not asin:
+            continue
+        units = _sb_units(col(c, "units"))
+        fba = _sb_number(col(c, "fba"))
+        amz = _sb_number(col(c, "amz"))
+        yield {
+            "external_id": col(c, "id"),
+            "date": _sb_date(col(c, "date")),
+            "asin": asin,
+            "description": col(c, "desc") or "",
+            "amount": _sb_number(col(c, "amount")),
+            "type": "Order",
+            "party": "Amazon",
+            "units_sold": units or 1,
+            "fba_fee_per_unit": fba / units if units else 0.0,
+            "amazon_fee_per_unit": amz / units if units else 0.0,
+        }
+
+def import_sellerboard_csv(db: Session, fileobj: BinaryIO, batch_size: int = IMPORT_BATCH) -> Dict[str, int]:
+    """Импорт CSV пачками по batch_size: в памяти одновременно не больше одной пачки."""
+    totals = {"inserted": 0, "updated": 0, "skipped": 0}
+    batch: List[Dict] = []
+    for rec in iter_sellerboard_records(fileobj):
+        batch.append(rec)
+        if len(batch) >= batch_size:
+            for k, v in upsert_sales(db, batch).items():
+                totals[k] += v
+            batch = []
+    if batch:
+        for k, v in upsert_sales(db, batch).items():
+            totals[k] += v
+    return totals
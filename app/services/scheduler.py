@@ -1,40 +1,106 @@
 
+from apscheduler.executors.pool import ThreadPoolExecutor as APThreadPool
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.cron import CronTrigger
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from pathlib import Path
 from sqlalchemy.orm import Session
-from ..db import SessionLocal
-from ..services.metrics import recompute_metrics_for_month
+from ..db import SessionLocal, engine
+from ..services.metrics import recompute_metrics_for_month, revised_periods
 from ..spapi.reports import fetch_reports_stub
-from ..spapi.parser import parse_inventory_csv, parse_orders_csv, parse_settlement_csv
-from ..services.ingest import ingest_inventory_snapshots, ingest_sales, ingest_fees
+from ..spapi.client import REPORT_TYPES, fetch_reports
+from ..config import settings
+from ..services.ingest import fetch_window, load_sku_map
+from ..services import jobs, report_cache
 
-scheduler = BackgroundScheduler(timezone="UTC")
+JOB = "daily_sync"
 
-def daily_job():
+# Задачи хранятся в БД (переживают рестарт), выполняются в отдельном потоке;
+# max_instances=1 + coalesce: пропущенные/наложившиеся запуски схлопываются в один.
+scheduler = BackgroundScheduler(
+    jobstores={"default": SQLAlchemyJobStore(engine=engine)},
+    executors={"default": APThreadPool(1)},
+    job_defaults={"max_instances": 1, "coalesce": True, "misfire_grace_time": 3600},
+    timezone="UTC",
+)
+
+# ручные запуски (/admin/run-sync) — в своём потоке, чтобы не ждать планировщик
+_manual = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sync")
+
+def _daily_sync(ctx: jobs.RunContext):
     db: Session = SessionLocal()
+    started = datetime.utcnow()
     try:
-        # 1) Fetch latest CSVs (stubbed) and parse
-        inv_csv, orders_csv, sett_csv = fetch_reports_stub()
+        # 1) Fetch: SP-API (параллельно, в файлы) при наличии кредов, иначе стаб.
+        #    Окно по каждому типу — от его watermark, т.е. только новые данные.
+        with ctx.stage("fetch"):
+            end = datetime.utcnow().replace(microsecond=0)
+            if settings.spapi_refresh_token:
+                windows = {rt: fetch_window(db, rt, end) for rt in REPORT_TYPES}
+                reports = fetch_reports(windows=windows)
+            else:
+                inv_csv, orders_csv, sett_csv = fetch_reports_stub()
+                reports = {"inventory": inv_csv, "orders": orders_csv, "settlement": sett_csv}
+                windows = {}
 
-        inv_rows = parse_inventory_csv(inv_csv)
-        order_rows = parse_orders_csv(orders_csv)
-        fee_rows = parse_settlement_csv(sett_csv)
+        # 2) Документ -> кэш; parse + ingest потоково, только если такое содержимое ещё не грузили.
+        #    Строки, уже загруженные из пересекающегося окна, отсекаются по натуральному ключу.
+        #    Сбой одного отчёта не мешает остальным.
+        sku_map = load_sku_map(db)
+        for report_type, source in reports.items():
+            with ctx.stage(f"ingest:{report_type}", swallow=True):
+                start, stop = windows.get(report_type, (None, None))
+                try:
+                    report_cache.fetch_and_ingest(db, report_type, source, start, stop, sku_map=sku_map)
+                except Exception:
+                    db.rollback()
+                    raise
+            if isinstance(source, Path):
+                source.unlink(missing_ok=True)  # сжатая копия уже в кэше
 
-        # 2) Ingest
-        ingest_inventory_snapshots(db, inv_rows)
-        ingest_sales(db, order_rows)
-        ingest_fees(db, fee_rows)
+        # 3) Recompute metrics for current month + месяцы, из которых ревизии заказов увели строки
+        with ctx.stage("metrics"):
+            now = datetime.utcnow()
+            recompute_metrics_for_month(db, now.year, now.month)
+            for year, month in revised_periods(db, started):
+                if (year, month) != (now.year, now.month):
+                    recompute_metrics_for_month(db, year, month, incremental=True)
 
-        # 3) Recompute metrics for current month
-        now = datetime.utcnow()
-        recompute_metrics_for_month(db, now.year, now.month)
+        with ctx.stage("cache_evict", swallow=True):
+            report_cache.evict(db)
     finally:
         db.close()
 
-def start_scheduler():
-    from ..config import settings
-    # run once at startup
-    daily_job()
-    # schedule daily at 03:00 UTC (configurable via cron if needed)
-    scheduler.add_job(daily_job, "cron", hour=3, minute=0)
+def run_sync(run_id: int | None = None, trigger: str = "cron") -> str:
+    """Один прогон синхронизации с записью в job_runs; при уже идущем прогоне — skipped."""
+    if run_id is None:
+        run_id = jobs.create_run(JOB, trigger)
+    return jobs.execute_run(run_id, JOB, _daily_sync)
+
+def trigger_sync(trigger: str = "manual") -> int:
+    """Ставит прогон в очередь и сразу возвращает его id."""
+    run_id = jobs.create_run(JOB, trigger)
+    _manual.submit(run_sync, run_id, trigger)
+    return run_id
+
+def daily_job() -> str:
+    """Синхронный прогон (скрипты, отладка)."""
+    return run_sync(trigger="manual")
+
+def start_scheduler(run_now: bool = False):
+    """Не блокирует: cron-задача из SCHEDULE_CRON_DAILY; run_now — первый прогон в фоне."""
+    if scheduler.running:
+        return
+    scheduler.add_job(
+        run_sync, CronTrigger.from_crontab(settings.schedule_cron_daily, timezone="UTC"),
+        id=JOB, name=JOB, replace_existing=True,
+    )
     scheduler.start()
+    if run_now:
+        trigger_sync("startup")
+
+def stop_scheduler():
+    if scheduler.running:
+        scheduler.shutdown(wait=False)
@@ -0,0 +1,237 @@
+
+"""
+Асинхронный клиент Reports API (SP-API): createReport -> getReport (поллинг) ->
+getReportDocument -> потоковое скачивание документа на диск. Отчёты разных типов
+запрашиваются параллельно, у каждой операции свой token bucket, на 429/5xx —
+экспоненциальный backoff с учётом Retry-After.
+"""
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterable, Optional
+
+import httpx
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+REPORTS_PATH = "/reports/2021-06-30"
+
+# внутренний report_type (как в parser.REPORT_PARSERS) -> reportType SP-API
+REPORT_TYPES = {
+    "inventory": "GET_FBA_MYI_UNSUPPRESSED_INVENTORY_DATA",
+    "orders": "GET_FLAT_FILE_ALL_ORDERS_DATA_BY_LAST_UPDATE_GENERAL",
+    "settlement": "GET_V2_SETTLEMENT_REPORT_DATA_FLAT_FILE",
+}
+
+# operation -> (rate в запросах/сек, burst); значения из документации Reports API 2021-06-30
+RATE_LIMITS = {
+    "createReport": (0.0167, 15),
+    "getReport": (2.0, 15),
+    "getReportDocument": (0.0167, 15),
+}
+
+DONE_STATUSES = {"DONE", "CANCELLED", "FATAL"}
+
+class SpApiError(Exception):
+    pass
+
+class TokenBucket:
+    """Классический token bucket; ожидающие корутины обслуживаются по очереди."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+    def set_rate(self, rate: float) -> None:
+        if rate > 0 and rate != self.rate:
+            self._refill()
+            self.rate = rate
+
+class SpApiClient:
+    def __init__(
+        self,
+        endpoint: Optional[str] = None,
+        lwa_endpoint: Optional[str] = None,
+        download_dir: Optional[str] = None,
+        rate_limits: Optional[dict] = None,
+        poll_interval: Optional[float] = None,
+        poll_timeout: float = 3600.0,
+        max_retries: int = 6,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.endpoint = (endpoint or settings.spapi_endpoint).rstrip("/")
+        self.lwa_endpoint = lwa_endpoint or settings.spapi_lwa_endpoint
+        self.download_dir = Path(download_dir or settings.report_dir)
+        self.poll_interval = poll_interval if poll_interval is not None else settings.spapi_poll_interval
+        self.poll_timeout = poll_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        limits = {**RATE_LIMITS, **(rate_limits or {})}
+        self.limiters = {op: TokenBucket(rate, burst) for op, (rate, burst) in limits.items()}
+        self.http = httpx.AsyncClient(transport=transport, timeout=httpx.Timeout(30.0, read=120.0))
+        self._token: Optional[str] = None
+        self._token_expires = 0.0
+        self._token_lock = asyncio.Lock()
+
+    async def __aenter__(self) -> "SpApiClient":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.http.aclose()
+
+    # -------- transport --------
+
+    async def _access_token(self) -> str:
+        """LWA access token (refresh_token grant), кэшируется до истечения."""
+        async with self._token_lock:
+            if self._token and time.monotonic() < self._token_expires - 60:
+                return self._token
+            resp = await self.http.post(self.lwa_endpoint, data={
+                "grant_type": "refresh_token",
+                "refresh_token": settings.spapi_refresh_token,
+                "client_id": settings.spapi_client_id,
+                "client_secret": settings.spapi_client_secret,
+            })
+            if resp.status_code != 200:
+                raise SpApiError(f"LWA token exchange failed: {resp.status_code} {resp.text[:200]}")
+            body = resp.json()
+            self._token = body["access_token"]
+            self._token_expires = time.monotonic() + float(body.get("expires_in", 3600))
+            return self._token
+
+    def _backoff(self, attempt: int, resp: httpx.Response) -> float:
+        delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        try:
+            delay = max(delay, float(resp.headers.get("Retry-After", 0)))
+        except ValueError:
+            pass
+        return delay + random.uniform(0, delay * 0.1)
+
+    async def _call(self, operation: str, method: str, path: str, **kwargs) -> dict:
+        limiter = self.limiters[operation]
+        for attempt in range(self.max_retries + 1):
+            await limiter.acquire()
+            headers = {"x-amz-access-token": await self._access_token()}
+            resp = await self.http.request(method, self.endpoint + path, headers=headers, **kwargs)
+            # SP-API сообщает фактический лимит операции для этого аккаунта — подстраиваемся под него
+            try:
+                limiter.set_rate(float(resp.headers.get("x-amzn-RateLimit-Limit", 0)))
+            except ValueError:
+                pass
+            if resp.status_code == 429 or resp.status_code >= 500:
+                if attempt == self.max_retries:
+                    break
+                delay = self._backoff(attempt, resp)
+                logger.info("%s: HTTP %d, retry %d in %.1fs", operation, resp.status_code, attempt + 1, delay)
+                await asyncio.sleep(delay)
+                continue
+            if resp.status_code >= 400:
+                raise SpApiError(f"{operation}: {resp.status_code} {resp.text[:200]}")
+            return resp.json()
+        raise SpApiError(f"{operation}: gave up after {self.max_retries} retries (HTTP {resp.status_code})")
+
+    # -------- Reports API --------
+
+    async def create_report(self, report_type: str, start: datetime, end: datetime) -> str:
+        body = await self._call("createReport", "POST", f"{REPORTS_PATH}/reports", json={
+            "reportType": REPORT_TYPES.get(report_type, report_type),
+            "marketplaceIds": [settings.marketplace_id],
+            "dataStartTime": start.isoformat(timespec="seconds") + "Z",
+            "dataEndTime": end.isoformat(timespec="seconds") + "Z",
+        })
+        return body["reportId"]
+
+    async def wait_report(self, report_id: str) -> str:
+        """Поллит getReport до DONE; интервал растёт в 1.5 раза до минуты. Возвращает reportDocumentId."""
+        deadline = time.monotonic() + self.poll_timeout
+        interval = self.poll_interval
+        while True:
+            body = await self._call("getReport", "GET", f"{REPORTS_PATH}/reports/{report_id}")
+            status = body.get("processingStatus")
+            if status == "DONE":
+                return body["reportDocumentId"]
+            if status in DONE_STATUSES:
+                raise SpApiError(f"report {report_id} finished with {status}")
+            if time.monotonic() + interval > deadline:
+                raise SpApiError(f"report {report_id} not ready after {self.poll_timeout:.0f}s ({status})")
+            await asyncio.sleep(interval)
+            interval = min(interval * 1.5, 60.0)
+
+    async def download_document(self, document_id: str, report_type: str) -> Path:
+        """getReportDocument + потоковая запись на диск (gzip не распаковываем — парсер это умеет)."""
+        doc = await self._call("getReportDocument", "GET", f"{REPORTS_PATH}/documents/{document_id}")
+        suffix = ".csv.gz" if doc.get("compressionAlgorithm") == "GZIP" else ".csv"
+        self.download_dir.mkdir(parents=True, exist_ok=True)
+        path = self.download_dir / f"{report_type}-{document_id}{suffix}"
+        tmp = path.with_name(path.name + ".part")
+        async with self.http.stream("GET", doc["url"]) as resp:
+            if resp.status_code != 200:
+                raise SpApiError(f"document {document_id}: download failed with {resp.status_code}")
+            with open(tmp, "wb") as f:
+                async for chunk in resp.aiter_bytes(1 << 16):
+                    f.write(chunk)
+        tmp.replace(path)
+        return path
+
+    async def fetch_report(self, report_type: str, start: datetime, end: datetime) -> Path:
+        t0 = time.perf_counter()
+        report_id = await self.create_report(report_type, start, end)
+        document_id = await self.wait_report(report_id)
+        path = await self.download_document(document_id, report_type)
+        logger.info("%s report %s -> %s in %.1fs", report_type, report_id, path, time.perf_counter() - t0)
+        return path
+
+async def fetch_reports_async(
+    report_types: Iterable[str] = tuple(REPORT_TYPES),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    windows: Optional[dict[str, tuple[datetime, datetime]]] = None,
+    **client_kwargs,
+) -> dict[str, Path]:
+    """
+    Все отчёты параллельно. Окно — windows[report_type] (например, от watermark),
+    иначе start..end, по умолчанию последние сутки (UTC, naive).
+    """
+    end = end or datetime.utcnow().replace(microsecond=0)
+    start = start or end - timedelta(days=1)
+    windows = windows or {}
+    report_types = list(report_types)
+    async with SpApiClient(**client_kwargs) as client:
+        paths = await asyncio.gather(*(
+            client.fetch_report(rt, *windows.get(rt, (start, end))) for rt in report_types
+        ))
+    return dict(zip(report_types, paths))
+
+def fetch_reports(
+    report_types: Iterable[str] = tuple(REPORT_TYPES),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    windows: Optional[dict[str, tuple[datetime, datetime]]] = None,
+    **client_kwargs,
+) -> dict[str, Path]:
+    """Синхронная обёртка для планировщика (работает в своём потоке, без event loop)."""
+    return asyncio.run(fetch_reports_async(report_types, start, end, windows, **client_kwargs))
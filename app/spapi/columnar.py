@@ -0,0 +1,108 @@
+
+"""
+Колоночный (векторизованный) парсер отчётов: pandas, а при наличии pyarrow — его потоковый
+CSV-ридер. Отдаёт типизированные DataFrame-пачки для services.ingest.ingest_frames.
+Понимает и внутренний формат (sku,units,price,at ...), и таб-разделённые GET_FLAT_FILE_*.
+"""
+import io
+from typing import Iterator, Optional
+
+from .columns import COLUMN_ALIASES, FEE_AMOUNT_TYPE, FEE_DESCRIPTIONS, NUMERIC
+from .parser import CHUNK_ROWS, ReportSource, open_report_bytes
+
+try:
+    import pandas as pd
+except ImportError:  # pragma: no cover - pandas есть в requirements, но бэкенд опциональный
+    pd = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+except ImportError:
+    pa = pacsv = None
+
+def available() -> bool:
+    return pd is not None
+
+def _header(raw: io.BufferedReader) -> tuple[list[str], str]:
+    line = raw.peek(1 << 16).split(b"\n", 1)[0].decode("utf-8-sig", errors="replace").rstrip("\r")
+    delimiter = "\t" if "\t" in line else ","
+    return [c.strip() for c in line.split(delimiter)], delimiter
+
+def _timestamps(col: "pd.Series") -> "pd.Series":
+    # settlement пишет "2025-10-12 12:00:00 UTC"; остальные — ISO 8601 (с Z или смещением)
+    col = col.str.replace(" UTC", "", regex=False)
+    return pd.to_datetime(col, utc=True, errors="coerce", format="ISO8601")
+
+def _normalize(df: "pd.DataFrame", report_type: str) -> "pd.DataFrame":
+    df = df.rename(columns=COLUMN_ALIASES[report_type])
+    df = df[df["sku"].notna() & (df["sku"] != "")].copy()
+    for c in NUMERIC & set(df.columns):
+        df[c] = pd.to_numeric(df[c], errors="coerce")
+    df["at"] = _timestamps(df["at"].astype("string")) if "at" in df else pd.NaT
+    for c in ("order_id", "settlement_id"):
+        df[c] = df[c].fillna("").astype(object) if c in df else ""
+
+    if report_type == "inventory":
+        df["qty"] = df["qty"].fillna(0).astype("int64")
+        if "fc" not in df:
+            df["fc"] = "FBA"
+        return df[["sku", "qty", "fc", "at"]]
+
+    if report_type == "orders":
+        df["units"] = df["units"].fillna(0).astype("int64")
+        if "price" not in df:
+            # item-price в flat file — сумма по строке заказа, нам нужна цена за единицу
+            df["price"] = (df["item_price"] / df["units"].where(df["units"] > 0)).fillna(0.0)
+        return df[["sku", "units", "price", "at", "order_id"]]
+
+    # settlement: из flat file берём только комиссии (ItemFees), знак — положительный
+    if "amount_type" in df:
+        df = df[df["amount_type"] == FEE_AMOUNT_TYPE].copy()
+        df["amount"] = -df["amount"]
+    df["type"] = df["type"].replace(FEE_DESCRIPTIONS) if "type" in df else "OTHER"
+    df["amount"] = df["amount"].fillna(0.0)
+    return df[["sku", "type", "amount", "at", "order_id", "settlement_id"]]
+
+def read_report_frames(
+    source: ReportSource,
+    report_type: str,
+    chunk_size: int = CHUNK_ROWS,
+    engine: Optional[str] = None,
+) -> Iterator["pd.DataFrame"]:
+    """
+    Типизированные пачки отчёта (sku + колонки целевой таблицы, at — datetime64[UTC]).
+    engine: "pyarrow" | "c" | None (pyarrow, если установлен).
+    """
+    if pd is None:
+        raise RuntimeError("pandas is not installed; use the pure-Python parser")
+    aliases = COLUMN_ALIASES[report_type]
+    raw = open_report_bytes(source)
+    try:
+        names, delimiter = _header(raw)
+        cols = [c for c in names if c in aliases]
+        dtypes = {c: ("float64" if aliases[c] in NUMERIC else "string") for c in cols}
+        engine = engine or ("pyarrow" if pacsv is not None else "c")
+
+        if engine == "pyarrow":
+            reader = pacsv.open_csv(
+                raw,
+                read_options=pacsv.ReadOptions(block_size=max(chunk_size * 64, 1 << 16)),
+                parse_options=pacsv.ParseOptions(delimiter=delimiter),
+                convert_options=pacsv.ConvertOptions(
+                    include_columns=cols,
+                    column_types={c: pa.float64() if t == "float64" else pa.string() for c, t in dtypes.items()},
+                    strings_can_be_null=True,
+                ),
+            )
+            for batch in reader:
+                yield _normalize(batch.to_pandas(), report_type)
+        else:
+            text = io.TextIOWrapper(raw, encoding="utf-8-sig", errors="replace", newline="")
+            for df in pd.read_csv(
+                text, sep=delimiter, usecols=cols, dtype=dtypes, chunksize=chunk_size,
+                keep_default_na=False, na_values=[""],
+            ):
+                yield _normalize(df, report_type)
+    finally:
+        raw.close()
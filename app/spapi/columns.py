@@ -0,0 +1,50 @@
+
+"""
+Колонки отчётов: внутренний формат (sku,units,price,at ...) и flat file'ы SP-API
+(GET_FLAT_FILE_*, GET_V2_SETTLEMENT_*) приводятся к одним внутренним именам.
+Общие для построчного (parser) и колоночного (columnar) парсеров.
+"""
+
+# колонка отчёта -> внутреннее имя
+COLUMN_ALIASES = {
+    "inventory": {
+        "sku": "sku", "qty": "qty", "fc": "fc", "at": "at",
+        "afn-fulfillable-quantity": "qty",                      # GET_FBA_MYI_UNSUPPRESSED_INVENTORY_DATA
+    },
+    "orders": {
+        "sku": "sku", "units": "units", "price": "price", "at": "at", "order_id": "order_id",
+        "quantity": "units", "item-price": "item_price",        # GET_FLAT_FILE_ALL_ORDERS_DATA_BY_LAST_UPDATE_*
+        "purchase-date": "at", "amazon-order-id": "order_id",
+    },
+    "settlement": {
+        "sku": "sku", "type": "type", "amount": "amount", "at": "at",
+        "order_id": "order_id", "settlement_id": "settlement_id",
+        "amount-type": "amount_type", "amount-description": "type",  # GET_V2_SETTLEMENT_REPORT_DATA_FLAT_FILE
+        "posted-date-time": "at", "order-id": "order_id", "settlement-id": "settlement_id",
+    },
+}
+
+NUMERIC = {"qty", "units", "price", "item_price", "amount"}
+
+# из settlement flat file берём только строки комиссий; сумма в отчёте отрицательная
+FEE_AMOUNT_TYPE = "ItemFees"
+
+# amount-description из settlement -> FeeType
+FEE_DESCRIPTIONS = {
+    "FBAPerUnitFulfillmentFee": "FBA",
+    "FBAWeightBasedFee": "FBA",
+    "Commission": "REFERRAL",
+    "FBAStorageFee": "STORAGE",
+    "StorageFee": "STORAGE",
+}
+
+def rename(r: dict, report_type: str) -> dict:
+    """Строка csv.DictReader с внутренними именами колонок; неизвестные колонки отбрасываются."""
+    aliases = COLUMN_ALIASES[report_type]
+    out = {}
+    for k, v in r.items():
+        name = aliases.get(k.strip()) if k else None
+        # внутреннее имя и алиас могут встретиться в одном файле — непустое значение не затираем
+        if name is not None and (v or name not in out):
+            out[name] = v
+    return out
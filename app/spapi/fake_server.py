@@ -0,0 +1,161 @@
+
+"""
+Локальный фейковый SP-API (LWA + Reports API 2021-06-30) для разработки и проверки клиента:
+медленная генерация отчётов, throttling по операциям (429 + Retry-After), gzip-документы.
+
+    python -m app.spapi.fake_server --port 8001 --generation 5 --rows 100000
+    SPAPI_ENDPOINT=http://127.0.0.1:8001 SPAPI_LWA_ENDPOINT=http://127.0.0.1:8001/auth/o2/token ...
+"""
+import argparse
+import gzip
+import itertools
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
+
+from .client import REPORT_TYPES, REPORTS_PATH
+from .reports import fetch_reports_stub
+
+# reportType SP-API -> внутренний report_type
+INTERNAL_TYPES = {v: k for k, v in REPORT_TYPES.items()}
+
+SKUS = ["SKU-AAA", "SKU-BBB", "SKU-CCC"]
+
+def _synthetic_report(report_type: str, rows: int) -> str:
+    rnd = random.Random(rows)
+    at = datetime.utcnow().replace(microsecond=0)
+    sku = lambda: rnd.choice(SKUS)
+    if report_type == "inventory":
+        lines = ["sku\tqty\tfc\tat"] + [f"{sku()}\t{rnd.randint(0, 500)}\tFBA\t{at.isoformat()}Z" for _ in range(rows)]
+    elif report_type == "orders":
+        lines = ["sku\tunits\tprice\tat"] + [
+            f"{sku()}\t{rnd.randint(1, 4)}\t{rnd.uniform(5, 60):.2f}\t{(at - timedelta(minutes=i)).isoformat()}Z"
+            for i in range(rows)
+        ]
+    else:
+        lines = ["sku\ttype\tamount\tat"] + [
+            f"{sku()}\t{rnd.choice(['FBA', 'REFERRAL'])}\t{rnd.uniform(1, 9):.2f}\t{at.isoformat()}Z"
+            for _ in range(rows)
+        ]
+    return "\n".join(lines) + "\n"
+
+def create_app(
+    generation_s: float = 2.0,
+    rows: int = 0,
+    rate_limits: Optional[dict] = None,
+    throttle_prob: float = 0.0,
+    retry_after: float = 1.0,
+) -> FastAPI:
+    """
+    generation_s — сколько «генерируется» отчёт; rows — 0: стабовые CSV из reports.py,
+    иначе синтетические таб-отчёты такого размера; rate_limits — operation -> (rate/сек, burst);
+    throttle_prob — доля случайных 429 сверх лимитов.
+    """
+    app = FastAPI(title="fake SP-API")
+    app.state.calls = {}                    # operation -> [ok, throttled]
+    stub = dict(zip(("inventory", "orders", "settlement"), fetch_reports_stub()))
+    reports: dict[str, dict] = {}
+    documents: dict[str, bytes] = {}
+    ids = itertools.count(1)
+    buckets = {
+        op: {"rate": rate, "burst": burst, "tokens": float(burst), "at": time.monotonic()}
+        for op, (rate, burst) in (rate_limits or {
+            "createReport": (1.0, 3), "getReport": (5.0, 5), "getReportDocument": (1.0, 3),
+        }).items()
+    }
+
+    def throttle(op: str):
+        b = buckets[op]
+        now = time.monotonic()
+        b["tokens"] = min(b["burst"], b["tokens"] + (now - b["at"]) * b["rate"])
+        b["at"] = now
+        stats = app.state.calls.setdefault(op, [0, 0])
+        if b["tokens"] < 1 or random.random() < throttle_prob:
+            stats[1] += 1
+            return JSONResponse(
+                {"errors": [{"code": "QuotaExceeded", "message": "You exceeded your quota for the requested resource."}]},
+                status_code=429, headers={"Retry-After": str(retry_after)},
+            )
+        b["tokens"] -= 1
+        stats[0] += 1
+        return None
+
+    def check_token(token: Optional[str]):
+        if not token or not token.startswith("Atza|fake"):
+            raise HTTPException(403, "Access to requested resource is denied.")
+
+    @app.post("/auth/o2/token")
+    async def lwa_token(request: Request):
+        form = await request.form()
+        if form.get("grant_type") != "refresh_token" or not form.get("refresh_token"):
+            return JSONResponse({"error": "invalid_grant"}, status_code=400)
+        return {"access_token": f"Atza|fake{next(ids)}", "token_type": "bearer", "expires_in": 3600}
+
+    @app.post(f"{REPORTS_PATH}/reports")
+    async def create_report(request: Request, x_amz_access_token: Optional[str] = Header(None)):
+        check_token(x_amz_access_token)
+        if (r := throttle("createReport")) is not None:
+            return r
+        body = await request.json()
+        if body.get("reportType") not in INTERNAL_TYPES:
+            raise HTTPException(400, f"Unsupported reportType {body.get('reportType')}")
+        report_id = str(next(ids))
+        reports[report_id] = {"type": INTERNAL_TYPES[body["reportType"]], "created": time.monotonic()}
+        return JSONResponse({"reportId": report_id}, status_code=202)
+
+    @app.get(f"{REPORTS_PATH}/reports/{{report_id}}")
+    async def get_report(report_id: str, x_amz_access_token: Optional[str] = Header(None)):
+        check_token(x_amz_access_token)
+        if (r := throttle("getReport")) is not None:
+            return r
+        rep = reports.get(report_id)
+        if rep is None:
+            raise HTTPException(404, "Report not found")
+        elapsed = time.monotonic() - rep["created"]
+        if elapsed < generation_s:
+            status = "IN_QUEUE" if elapsed < generation_s / 3 else "IN_PROGRESS"
+            return {"reportId": report_id, "processingStatus": status}
+        if "document" not in rep:
+            doc_id = f"amzn1.spdoc.{report_id}"
+            text = _synthetic_report(rep["type"], rows) if rows else stub[rep["type"]]
+            documents[doc_id] = gzip.compress(text.encode())
+            rep["document"] = doc_id
+        return {"reportId": report_id, "processingStatus": "DONE", "reportDocumentId": rep["document"]}
+
+    @app.get(f"{REPORTS_PATH}/documents/{{document_id}}")
+    async def get_report_document(document_id: str, request: Request, x_amz_access_token: Optional[str] = Header(None)):
+        check_token(x_amz_access_token)
+        if (r := throttle("getReportDocument")) is not None:
+            return r
+        if document_id not in documents:
+            raise HTTPException(404, "Document not found")
+        return {
+            "reportDocumentId": document_id,
+            "url": str(request.url_for("download", document_id=document_id)),
+            "compressionAlgorithm": "GZIP",
+        }
+
+    # «presigned S3 URL»: без токена и лимитов
+    @app.get("/download/{document_id}", name="download")
+    async def download(document_id: str):
+        if document_id not in documents:
+            raise HTTPException(404, "Document not found")
+        return Response(documents[document_id], media_type="application/octet-stream")
+
+    return app
+
+if __name__ == "__main__":
+    import uvicorn
+
+    ap = argparse.ArgumentParser(description="Fake SP-API server for local testing.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8001)
+    ap.add_argument("--generation", type=float, default=5.0, help="seconds until a report is DONE")
+    ap.add_argument("--rows", type=int, default=0, help="synthetic rows per report (0 = stub CSVs)")
+    ap.add_argument("--throttle-prob", type=float, default=0.0)
+    args = ap.parse_args()
+    uvicorn.run(create_app(args.generation, args.rows, throttle_prob=args.throttle_prob), host=args.host, port=args.port)
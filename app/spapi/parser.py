@@ -1,44 +1,149 @@
 
 import csv
-from io import StringIO
+import gzip
+import io
+import os
 from datetime import datetime
+from itertools import chain, islice
+from typing import Callable, Iterator, Optional, TextIO, Union
 
-def _csv_to_rows(csv_text: str) -> list[dict]:
-    reader = csv.DictReader(StringIO(csv_text))
-    return [dict(row) for row in reader]
-
-def parse_inventory_csv(csv_text: str) -> list[dict]:
-    rows = _csv_to_rows(csv_text)
-    out = []
-    for r in rows:
-        out.append({
-            "sku": r["sku"],
-            "qty": int(float(r["qty"])),
-            "fc": r.get("fc", "FBA"),
-            "at": datetime.fromisoformat(r["at"].replace("Z","+00:00")) if r.get("at") else None
-        })
-    return out
-
-def parse_orders_csv(csv_text: str) -> list[dict]:
-    rows = _csv_to_rows(csv_text)
-    out = []
-    for r in rows:
-        out.append({
-            "sku": r["sku"],
-            "units": int(float(r["units"])),
-            "price": float(r["price"]),
-            "at": datetime.fromisoformat(r["at"].replace("Z","+00:00")) if r.get("at") else None
-        })
-    return out
-
-def parse_settlement_csv(csv_text: str) -> list[dict]:
-    rows = _csv_to_rows(csv_text)
-    out = []
-    for r in rows:
-        out.append({
-            "sku": r["sku"],
-            "type": r.get("type", "OTHER"),
-            "amount": float(r["amount"]),
-            "at": datetime.fromisoformat(r["at"].replace("Z","+00:00")) if r.get("at") else None
-        })
-    return out
+from .columns import FEE_AMOUNT_TYPE, FEE_DESCRIPTIONS, rename
+
+# Источник отчёта: текст CSV, bytes, путь к файлу или файловый объект (текстовый/бинарный).
+# Сжатые gzip документы (compressionAlgorithm=GZIP в getReportDocument) распознаются по сигнатуре.
+ReportSource = Union[str, bytes, os.PathLike, io.IOBase]
+
+CHUNK_ROWS = 5000
+GZIP_MAGIC = b"\x1f\x8b"
+
+def open_report_bytes(source: ReportSource) -> io.BufferedIOBase:
+    """Бинарный поток отчёта (gzip уже распакован на лету). Текстовые источники кодируются в UTF-8."""
+    if isinstance(source, str):
+        source = source.encode("utf-8")
+    if isinstance(source, os.PathLike):
+        source = open(source, "rb")
+    elif isinstance(source, bytes):
+        source = io.BytesIO(source)
+    elif isinstance(source, io.TextIOBase):
+        raise TypeError("binary stream required")
+    raw = source if isinstance(source, io.BufferedReader) else io.BufferedReader(source)
+    if raw.peek(2)[:2] == GZIP_MAGIC:
+        raw = io.BufferedReader(gzip.GzipFile(fileobj=raw, mode="rb"))
+    return raw
+
+def open_report(source: ReportSource, encoding: str = "utf-8-sig") -> TextIO:
+    if isinstance(source, str):
+        return io.StringIO(source)
+    if isinstance(source, io.TextIOBase):
+        return source
+    return io.TextIOWrapper(open_report_bytes(source), encoding=encoding, errors="replace", newline="")
+
+def _dict_rows(stream: TextIO) -> Iterator[dict]:
+    """csv.DictReader с разделителем по заголовку: таб (GET_FLAT_FILE_*) или запятая."""
+    header = stream.readline()
+    delimiter = "\t" if "\t" in header else ","
+    return csv.DictReader(chain([header], stream), delimiter=delimiter)
+
+def _ts(v):
+    # settlement пишет "2025-10-12 12:00:00 UTC"; остальные — ISO 8601 (с Z или смещением)
+    if not v:
+        return None
+    return datetime.fromisoformat(v.replace(" UTC", "+00:00").replace("Z", "+00:00"))
+
+def _num(v) -> float:
+    return float(v) if v not in (None, "") else 0.0
+
+# row builders: строка отчёта (внутренние или SP-API колонки) -> нормализованная строка;
+# None — строка пропускается (пустой sku, не комиссия в settlement)
+
+def _inventory_row(r: dict) -> Optional[dict]:
+    r = rename(r, "inventory")
+    if not r.get("sku"):
+        return None
+    return {
+        "sku": r["sku"],
+        "qty": int(_num(r.get("qty"))),
+        "fc": r.get("fc") or "FBA",
+        "at": _ts(r.get("at")),
+    }
+
+def _orders_row(r: dict) -> Optional[dict]:
+    r = rename(r, "orders")
+    if not r.get("sku"):
+        return None
+    units = int(_num(r.get("units")))
+    if r.get("price") not in (None, ""):
+        price = float(r["price"])
+    else:
+        # item-price в flat file — сумма по строке заказа, нам нужна цена за единицу
+        price = _num(r.get("item_price")) / units if units > 0 else 0.0
+    return {
+        "sku": r["sku"],
+        "units": units,
+        "price": price,
+        "at": _ts(r.get("at")),
+        "order_id": r.get("order_id") or "",
+    }
+
+def _settlement_row(r: dict) -> Optional[dict]:
+    r = rename(r, "settlement")
+    if not r.get("sku"):
+        return None
+    amount = _num(r.get("amount"))
+    if "amount_type" in r:
+        # из flat file берём только комиссии (ItemFees), знак — положительный
+        if r["amount_type"] != FEE_AMOUNT_TYPE:
+            return None
+        amount = -amount
+    fee = r.get("type") or "OTHER"
+    return {
+        "sku": r["sku"],
+        "type": FEE_DESCRIPTIONS.get(fee, fee),
+        "amount": amount,
+        "at": _ts(r.get("at")),
+        "order_id": r.get("order_id") or "",
+        "settlement_id": r.get("settlement_id") or "",
+    }
+
+def iter_report_chunks(
+    source: ReportSource, normalize: Callable[[dict], Optional[dict]], chunk_size: int = CHUNK_ROWS
+) -> Iterator[list[dict]]:
+    """
+    Лениво отдаёт нормализованные строки пачками по chunk_size (строки, для которых normalize
+    вернул None, пропускаются); в памяти — одна пачка.
+    Поток источника закрывается, когда генератор исчерпан или закрыт.
+    """
+    stream = open_report(source)
+    try:
+        rows = filter(None, map(normalize, _dict_rows(stream)))
+        while chunk := list(islice(rows, chunk_size)):
+            yield chunk
+    finally:
+        stream.close()
+
+def iter_inventory_chunks(source: ReportSource, chunk_size: int = CHUNK_ROWS) -> Iterator[list[dict]]:
+    return iter_report_chunks(source, _inventory_row, chunk_size)
+
+def iter_orders_chunks(source: ReportSource, chunk_size: int = CHUNK_ROWS) -> Iterator[list[dict]]:
+    return iter_report_chunks(source, _orders_row, chunk_size)
+
+def iter_settlement_chunks(source: ReportSource, chunk_size: int = CHUNK_ROWS) -> Iterator[list[dict]]:
+    return iter_report_chunks(source, _settlement_row, chunk_size)
+
+# report_type -> парсер (те же ключи, что у services.ingest)
+REPORT_PARSERS = {
+    "inventory": iter_inventory_chunks,
+    "orders": iter_orders_chunks,
+    "settlement": iter_settlement_chunks,
+}
+
+# -------- списком целиком (для маленьких отчётов) --------
+
+def parse_inventory_csv(csv_text: ReportSource) -> list[dict]:
+    return [r for chunk in iter_inventory_chunks(csv_text) for r in chunk]
+
+def parse_orders_csv(csv_text: ReportSource) -> list[dict]:
+    return [r for chunk in iter_orders_chunks(csv_text) for r in chunk]
+
+def parse_settlement_csv(csv_text: ReportSource) -> list[dict]:
+    return [r for chunk in iter_settlement_chunks(csv_text) for r in chunk]
@@ -0,0 +1,146 @@
+
+"""
+Лёгкая телеметрия этапов: время, строки, rows/sec, число SQL-запросов и время в БД
+(через события Engine), пик памяти (tracemalloc, если TELEMETRY_TRACEMALLOC=1) и
+вложенные span'ы (parse / write / compute ...). Каждый этап — единица работы для app.profiler. Текущий этап живёт в ContextVar, поэтому
+сервисы просто вызывают span()/add_rows() — вне этапа это no-op.
+"""
+import time
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterable, Iterator, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from . import profiler
+from .config import settings
+
+class StageStats:
+    __slots__ = ("name", "started", "duration", "rows", "queries", "db_time", "peak_mem", "spans")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.rows = 0
+        self.queries = 0
+        self.db_time = 0.0
+        self.peak_mem: Optional[float] = None   # MB
+        self.spans: dict[str, float] = {}
+
+    @property
+    def rows_per_s(self) -> Optional[float]:
+        return round(self.rows / self.duration, 1) if self.rows and self.duration > 0 else None
+
+    def as_dict(self) -> dict:
+        return {
+            "stage": self.name,
+            "duration_s": round(self.duration, 4),
+            "rows": self.rows,
+            "rows_per_s": self.rows_per_s,
+            "queries": self.queries,
+            "db_s": round(self.db_time, 4),
+            "peak_mem_mb": self.peak_mem,
+            "spans": {k: round(v, 4) for k, v in self.spans.items()},
+        }
+
+    def summary(self) -> str:
+        parts = [f"{self.name} {self.duration:.2f}s"]
+        if self.rows:
+            parts.append(f"{self.rows}r" + (f" {self.rows_per_s:,.0f}r/s" if self.rows_per_s else ""))
+        parts.append(f"{self.queries}q/{self.db_time:.2f}s db")
+        if self.peak_mem is not None:
+            parts.append(f"peak {self.peak_mem:.1f}MB")
+        parts += [f"{k} {v:.2f}s" for k, v in self.spans.items()]
+        return " ".join(parts)
+
+_current: ContextVar[Optional[StageStats]] = ContextVar("telemetry_stage", default=None)
+
+# -------- SQL: счётчик запросов и время в БД для текущего этапа --------
+
+# время старта — на контексте выполнения: у упавшего запроса after_cursor_execute не вызывается,
+# и ничего не должно оставаться висеть на соединении из пула
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._tm_start = time.perf_counter()
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._tm_start
+    st = _current.get()
+    if st is not None:
+        st.queries += 1
+        st.db_time += elapsed
+    profiler.record(statement, elapsed, executemany)
+
+# -------- API для сервисов --------
+
+@contextmanager
+def stage(name: str, memory: Optional[bool] = None) -> Iterator[StageStats]:
+    """
+    Этап верхнего уровня (вложенный этап считается отдельно и не суммируется во внешний).
+    memory — мерить пик tracemalloc (по умолчанию TELEMETRY_TRACEMALLOC).
+    """
+    st = StageStats(name)
+    trace = settings.telemetry_tracemalloc if memory is None else memory
+    if trace:
+        started_trace = not tracemalloc.is_tracing()
+        if started_trace:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+    token = _current.set(st)
+    try:
+        with profiler.unit(name):
+            yield st
+    finally:
+        _current.reset(token)
+        st.duration = time.perf_counter() - st.started
+        if trace:
+            st.peak_mem = round(tracemalloc.get_traced_memory()[1] / 1e6, 1)
+            if started_trace:
+                tracemalloc.stop()
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Время части этапа (суммируется, если span повторяется в цикле)."""
+    st = _current.get()
+    if st is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        st.spans[name] = st.spans.get(name, 0.0) + time.perf_counter() - t0
+
+def timed_iter(items: Iterable, name: str) -> Iterator:
+    """Итератор, время ожидания next() которого идёт в span name (ленивый парсинг и т.п.)."""
+    it = iter(items)
+    while True:
+        with span(name):
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+        yield item
+
+def add_rows(n: int) -> None:
+    st = _current.get()
+    if st is not None:
+        st.rows += n
+
+def current() -> Optional[StageStats]:
+    return _current.get()
+
+def max_rss_mb() -> Optional[float]:
+    """Пиковый RSS процесса (Linux: ru_maxrss в КБ)."""
+    if resource is None:
+        return None
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
@@ -0,0 +1,27 @@
+
+import argparse
+import time
+
+from app.db import init_db
+from app.services.backfill import backfill_metrics
+
+def main():
+    ap = argparse.ArgumentParser(description="Recompute metric snapshots for a range of months.")
+    ap.add_argument("--start", required=True, help="first month, YYYY-MM")
+    ap.add_argument("--end", required=True, help="last month, YYYY-MM")
+    ap.add_argument("--workers", type=int, default=None, help="processes (default: CPU count; 1 = sequential)")
+    args = ap.parse_args()
+
+    init_db()
+    t0 = time.perf_counter()
+    report = backfill_metrics(
+        args.start, args.end, args.workers,
+        progress=lambda e: print(
+            f"[{e['done']}/{e['total']}] {e['period']}: {e['rows']} rows, "
+            f"compute {e['compute_s']:.3f}s, write {e['write_s']:.3f}s", flush=True,
+        ),
+    )
+    print(f"Done: {len(report)} months, {sum(e['rows'] for e in report)} rows in {time.perf_counter() - t0:.2f}s.")
+
+if __name__ == "__main__":
+    main()
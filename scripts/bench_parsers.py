@@ -0,0 +1,78 @@
+
+import argparse
+import gc
+import gzip
+import random
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app.models import Base, Product
+from app.services.ingest import ingest_chunks, ingest_frames
+from app.spapi import columnar
+from app.spapi.parser import iter_orders_chunks
+
+def make_orders_report(rows: int, skus: int, gz: bool) -> bytes:
+    """Синтетический таб-разделённый orders-отчёт (sku, units, price, at)."""
+    rnd = random.Random(42)
+    t0 = datetime(2025, 1, 1)
+    lines = ["sku\tunits\tprice\tat"]
+    for _ in range(rows):
+        at = t0 + timedelta(seconds=rnd.randint(0, 365 * 86400))
+        lines.append(f"SKU-{rnd.randrange(skus)}\t{rnd.randint(1, 5)}\t{rnd.uniform(5, 80):.2f}\t{at.isoformat()}Z")
+    data = ("\n".join(lines) + "\n").encode()
+    return gzip.compress(data) if gz else data
+
+def measure(label: str, rows: int, fn) -> None:
+    gc.collect()
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    n = fn()
+    elapsed = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert n == rows, (label, n)
+    print(f"{label:<28} {elapsed:8.3f}s {rows / elapsed:12,.0f} rows/s   peak {peak / 1e6:8.1f} MB")
+
+def parse_only(report: bytes) -> None:
+    rows = args.rows
+    measure("python csv", rows, lambda: sum(len(c) for c in iter_orders_chunks(report, args.chunk)))
+    if columnar.available():
+        measure("pandas (c engine)", rows, lambda: sum(
+            len(df) for df in columnar.read_report_frames(report, "orders", args.chunk, engine="c")))
+        if columnar.pacsv is not None:
+            measure("pandas (pyarrow engine)", rows, lambda: sum(
+                len(df) for df in columnar.read_report_frames(report, "orders", args.chunk, engine="pyarrow")))
+
+def parse_and_ingest(report: bytes) -> None:
+    def run(label, fn):
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(engine)
+        with Session(engine) as db:
+            db.add_all([Product(sku=f"SKU-{i}", asin=f"B{i:09d}") for i in range(args.skus)])
+            db.commit()
+            measure(label, args.rows, lambda: fn(db)["inserted"])
+        engine.dispose()
+
+    run("python csv + ingest", lambda db: ingest_chunks(db, "orders", iter_orders_chunks(report, args.chunk)))
+    if columnar.available():
+        run("columnar + ingest", lambda db: ingest_frames(
+            db, "orders", columnar.read_report_frames(report, "orders", args.chunk)))
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Pure-Python vs columnar report parser benchmark.")
+    ap.add_argument("--rows", type=int, default=200_000)
+    ap.add_argument("--skus", type=int, default=5_000)
+    ap.add_argument("--chunk", type=int, default=50_000)
+    ap.add_argument("--gzip", action="store_true", help="benchmark a gzip-compressed document")
+    ap.add_argument("--ingest", action="store_true", help="also ingest into an in-memory SQLite DB")
+    args = ap.parse_args()
+
+    report = make_orders_report(args.rows, args.skus, args.gzip)
+    print(f"{args.rows:,} rows, {len(report) / 1e6:.1f} MB{' gzip' if args.gzip else ''}, chunk {args.chunk:,}")
+    parse_only(report)
+    if args.ingest:
+        parse_and_ingest(report)
@@ -0,0 +1,122 @@
+
+import argparse
+import gc
+import os
+import random
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert, inspect, make_url, select
+from sqlalchemy.orm import Session
+
+from app.models import Base, GLTransaction, PurchaseOrder, SalesRecord, Supplier
+from app.services import accounting, purchase_orders, sales
+from app.services.paging import iter_rows
+
+def seed(db: Session, rows: int, pos: int) -> None:
+    rnd = random.Random(42)
+    t0 = datetime(2025, 1, 1)
+    sales_rows, gl_rows = [], []
+    for i in range(rows):
+        at = t0 + timedelta(minutes=rnd.randint(0, 365 * 1440))
+        sales_rows.append({
+            "external_id": f"E{i}", "date": at, "asin": f"B{rnd.randrange(5000):09d}", "description": "order",
+            "amount": rnd.uniform(5, 80), "type": "Order", "party": "Amazon", "month": at.month, "year": at.year,
+            "units_sold": rnd.randint(1, 5), "cogs_per_unit": rnd.uniform(1, 20),
+        })
+        gl_rows.append({
+            "date": at, "nc_code": "4000", "account_name": f"Account {rnd.randrange(40)}", "reference": f"R{i}",
+            "description": "posting", "amount": 10.0, "dr": 10.0, "cr": 0.0, "value": 10.0,
+            "month": at.month, "year": at.year,
+        })
+    db.execute(insert(SalesRecord), sales_rows)
+    db.execute(insert(GLTransaction), gl_rows)
+    db.execute(insert(Supplier), [{"id": i + 1, "name": f"Supplier {i}"} for i in range(200)])
+    db.execute(insert(PurchaseOrder), [
+        {"name": f"PO-{i}", "supplier_id": rnd.randint(1, 200), "order_date": t0 + timedelta(hours=i)}
+        for i in range(pos)
+    ])
+    db.commit()
+
+def measure(label: str, engine, fn) -> None:
+    """
+    rows/s — прогон без tracemalloc (он искажает время в разы); пик памяти, приведённый
+    к 100k строк, — отдельным прогоном. Каждый прогон — в чистой сессии.
+    """
+    with Session(engine) as db:
+        gc.collect()
+        t0 = time.perf_counter()
+        n = fn(db)
+        elapsed = time.perf_counter() - t0
+    with Session(engine) as db:
+        gc.collect()
+        tracemalloc.start()
+        fn(db)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    print(f"{label:<38} {n:>9,} rows {elapsed:8.3f}s {n / elapsed:12,.0f} rows/s   "
+          f"{peak / 1e6 * 100_000 / max(n, 1):8.1f} MB/100k")
+
+# -------- до: ORM-сущности --------
+
+def _entities_sales(db: Session) -> int:
+    q = select(SalesRecord).order_by(SalesRecord.date.desc(), SalesRecord.id.desc())
+    return len([sales._sales_dict(s) for s in db.scalars(q)])
+
+def _entities_gl(db: Session) -> int:
+    q = select(GLTransaction).order_by(GLTransaction.date.desc(), GLTransaction.id.desc())
+    return len([accounting._gl_dict(r) for r in db.scalars(q)])
+
+def _entities_pos(db: Session) -> int:
+    # как было: сущности PO + ленивая загрузка supplier на каждую строку
+    q = select(PurchaseOrder).order_by(PurchaseOrder.order_date.desc(), PurchaseOrder.id.desc())
+    return len([{"id": p.id, "supplier": p.supplier.name if p.supplier else None} for p in db.scalars(q)])
+
+# -------- после: Core-проекции сервисов --------
+
+def _projection_sales(db: Session) -> int:
+    return len(list(iter_rows(db, sales._sales_query(None, None), SalesRecord.date, SalesRecord.id, sales._sales_dict)))
+
+def _projection_gl(db: Session) -> int:
+    return len(list(iter_rows(
+        db, accounting._gl_query(None, None), GLTransaction.date, GLTransaction.id, accounting._gl_dict
+    )))
+
+def _projection_pos(db: Session) -> int:
+    return len(purchase_orders.list_purchase_orders(db))
+
+def main():
+    ap = argparse.ArgumentParser(description="ORM entity hydration vs Core column projections on the read path.")
+    ap.add_argument("--rows", type=int, default=100_000, help="sales records and GL transactions")
+    ap.add_argument("--pos", type=int, default=5_000, help="purchase orders")
+    ap.add_argument("--db", default="sqlite://",
+                    help="database URL (default: in-memory SQLite); an existing database is only read")
+    ap.add_argument("--seed", action="store_true",
+                    help="create tables and write synthetic rows into --db (throwaway databases only)")
+    args = ap.parse_args()
+
+    url = make_url(args.db)
+    sqlite = url.get_backend_name() == "sqlite"
+    in_memory = sqlite and url.database in (None, "", ":memory:")
+    if not (in_memory or args.seed) and sqlite and not os.path.exists(url.database):
+        ap.error(f"{args.db}: no such database; pass --seed to create and fill a throwaway one")
+    engine = create_engine(url)
+    if in_memory or args.seed:
+        Base.metadata.create_all(engine)
+        with Session(engine) as db:
+            if db.scalar(select(SalesRecord.id).limit(1)) is None:
+                seed(db, args.rows, args.pos)
+    elif not inspect(engine).has_table(SalesRecord.__tablename__):
+        ap.error(f"{args.db}: no sales_records table; pass --seed to fill a throwaway database")
+
+    measure("sales: ORM entities", engine, _entities_sales)
+    measure("sales: Core projection", engine, _projection_sales)
+    measure("gl: ORM entities", engine, _entities_gl)
+    measure("gl: Core projection", engine, _projection_gl)
+    measure("purchase orders: ORM + lazy supplier", engine, _entities_pos)
+    measure("purchase orders: projection + join", engine, _projection_pos)
+    engine.dispose()
+
+if __name__ == "__main__":
+    main()
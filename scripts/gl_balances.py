@@ -0,0 +1,27 @@
+
+import argparse
+import json
+
+from app.db import SessionLocal, init_db
+from app.services.accounting import rebuild_gl_balances, verify_gl_balances
+
+def main():
+    ap = argparse.ArgumentParser(description="Verify (and optionally rebuild) materialized GL balances.")
+    ap.add_argument("--rebuild", action="store_true", help="rebuild gl_balances from gl_transactions")
+    args = ap.parse_args()
+
+    init_db()
+    db = SessionLocal()
+    try:
+        if args.rebuild:
+            print(f"Rebuilt gl_balances: {rebuild_gl_balances(db)} rows.")
+        mismatches = verify_gl_balances(db)
+        for m in mismatches:
+            print(json.dumps(m, ensure_ascii=False))
+        print("OK" if not mismatches else f"{len(mismatches)} mismatching periods.")
+        raise SystemExit(1 if mismatches else 0)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
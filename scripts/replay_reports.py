@@ -0,0 +1,31 @@
+
+import argparse
+from datetime import datetime
+
+from app.db import SessionLocal, init_db
+from app.services import report_cache
+
+def main():
+    ap = argparse.ArgumentParser(description="Re-ingest cached SP-API report documents without calling the API.")
+    ap.add_argument("--type", choices=["inventory", "orders", "settlement"], help="only this report type")
+    ap.add_argument("--since", help="only documents fetched on/after this date, YYYY-MM-DD")
+    ap.add_argument("--pending", action="store_true", help="only documents that were cached but never ingested")
+    ap.add_argument("--evict", action="store_true", help="run cache eviction afterwards")
+    args = ap.parse_args()
+
+    init_db()
+    db = SessionLocal()
+    try:
+        since = datetime.fromisoformat(args.since) if args.since else None
+        results = report_cache.replay(db, args.type, since, args.pending)
+        for r in results:
+            print(f"#{r['id']} {r['report_type']:<10} {r['document'][:12]}  "
+                  f"inserted={r['inserted']} quarantined={r['quarantined']}")
+        print(f"Replayed {len(results)} documents.")
+        if args.evict:
+            print(report_cache.evict(db))
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,11 @@
 
-from app.db import Base, engine, SessionLocal
+from app.db import init_db, SessionLocal
 from app.models import Supplier, Product, InventorySnapshot, Sale, Fee, FeeType
 from app.services.metrics import recompute_metrics_for_month
 from datetime import datetime
 
 def main():
-    Base.metadata.create_all(bind=engine)
+    init_db()
     db = SessionLocal()
 
     # Suppliers
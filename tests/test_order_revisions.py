@@ -0,0 +1,49 @@
+import time
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from app.migrations import migrate
+from app.models import MetricSnapshot, Product
+from app.services import ingest, metrics
+
+HEADER = "amazon-order-id\tpurchase-date\tsku\tquantity\titem-price\n"
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    migrate(engine)
+    with Session(engine) as session:
+        session.add(Product(sku="A1", asin="B1", title="t", cost=1))
+        session.commit()
+        yield session
+
+def _revenue(db: Session) -> dict:
+    return dict(db.execute(select(MetricSnapshot.period, MetricSnapshot.revenue)).all())
+
+def _later():
+    # updated_at ревизии должен быть строго позже прошлого расчёта
+    time.sleep(0.01)
+
+def test_incremental_recompute_sees_price_revision(db):
+    ingest.ingest_report(db, "orders", HEADER + "111\t2025-10-01T10:00:00Z\tA1\t1\t100\n"
+                                                "112\t2025-10-02T10:00:00Z\tA1\t1\t124.95\n")
+    metrics.recompute_metrics_for_month(db, 2025, 10)
+    _later()
+    ingest.ingest_report(db, "orders", HEADER + "111\t2025-10-01T10:00:00Z\tA1\t1\t500\n")
+    metrics.recompute_metrics_for_month(db, 2025, 10, incremental=True)
+    assert _revenue(db)["2025-10"] == pytest.approx(624.95)
+
+def test_revision_moving_row_to_another_month(db):
+    ingest.ingest_report(db, "orders", HEADER + "111\t2025-10-01T10:00:00Z\tA1\t1\t100\n")
+    metrics.recompute_metrics_for_month(db, 2025, 10)
+    metrics.recompute_metrics_for_month(db, 2025, 9)
+    _later()
+    since = datetime.utcnow()
+    ingest.ingest_report(db, "orders", HEADER + "111\t2025-09-30T10:00:00Z\tA1\t1\t100\n")
+    assert metrics.revised_periods(db, since) == [(2025, 10)]
+    for year, month in [(2025, 9), (2025, 10)]:
+        metrics.recompute_metrics_for_month(db, year, month, incremental=True)
+    assert _revenue(db) == {"2025-09": pytest.approx(100.0), "2025-10": pytest.approx(0.0)}
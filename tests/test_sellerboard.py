@@ -0,0 +1,33 @@
+import io
+
+import pytest
+
+from app.services.sales import _sb_number, _sb_units, iter_sellerboard_records
+
+@pytest.mark.parametrize("raw, expected", [
+    ("3,0", 3.0),
+    ("10,5", 10.5),
+    ("1,234", 1234.0),
+    ("1,234.56", 1234.56),
+    ("1 234,56", 1234.56),
+    ("1.234,56", 1234.56),
+    ("$ 12.50", 12.5),
+    ("-3,5 €", -3.5),
+    ("", 0.0),
+    (None, 0.0),
+    ("n/a", 0.0),
+])
+def test_sb_number(raw, expected):
+    assert _sb_number(raw) == pytest.approx(expected)
+
+@pytest.mark.parametrize("raw, expected", [("3,0", 3), ("3.0", 3), ("1,234", 1234), ("2", 2), ("", 0)])
+def test_sb_units(raw, expected):
+    assert _sb_units(raw) == expected
+
+def test_semicolon_export_uses_decimal_comma():
+    csv = "Order ID;Date;ASIN;Units;Sales;FBA fee\nX1;01.02.2025;B01;3,0;10,5;3,0\n"
+    [rec] = iter_sellerboard_records(io.BytesIO(csv.encode()))
+    assert rec["units_sold"] == 3
+    assert rec["amount"] == pytest.approx(10.5)
+    assert rec["fba_fee_per_unit"] == pytest.approx(1.0)
+    assert rec["date"] == "2025-02-01"
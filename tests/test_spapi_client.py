@@ -0,0 +1,44 @@
+import asyncio
+import random
+
+import httpx
+import pytest
+
+from app.config import settings
+from app.spapi.client import REPORT_TYPES, SpApiError, fetch_reports_async
+from app.spapi.fake_server import create_app
+from app.spapi.parser import REPORT_PARSERS
+
+@pytest.fixture(autouse=True)
+def refresh_token(monkeypatch):
+    monkeypatch.setattr(settings, "spapi_refresh_token", "Atzr|test")
+    random.seed(7)
+
+def _fetch(app, tmp_path, **kw):
+    return asyncio.run(fetch_reports_async(
+        endpoint="http://testserver",
+        lwa_endpoint="http://testserver/auth/o2/token",
+        transport=httpx.ASGITransport(app=app),
+        download_dir=tmp_path,
+        **kw,
+    ))
+
+def test_fetch_reports_through_throttling(tmp_path):
+    app = create_app(generation_s=0.5, throttle_prob=0.3, retry_after=0.1)
+    paths = _fetch(app, tmp_path, poll_interval=0.1, backoff_base=0.05)
+
+    assert set(paths) == set(REPORT_TYPES)
+    for report_type, path in paths.items():
+        assert path.exists() and path.name.endswith(".csv.gz")
+        rows = [r for chunk in REPORT_PARSERS[report_type](path) for r in chunk]
+        assert rows and all(r["sku"].startswith("SKU-") for r in rows)
+    assert sum(throttled for _ok, throttled in app.state.calls.values()) > 0
+    # каждый отчёт прошёл весь цикл createReport -> getReport -> getReportDocument
+    assert app.state.calls["createReport"][0] == app.state.calls["getReportDocument"][0] == len(REPORT_TYPES)
+
+def test_gives_up_after_max_retries(tmp_path):
+    app = create_app(generation_s=0, throttle_prob=1.0, retry_after=0)
+    with pytest.raises(SpApiError, match="gave up after 2 retries"):
+        _fetch(app, tmp_path, report_types=["orders"], max_retries=2, backoff_base=0.01)
+    assert app.state.calls["createReport"] == [0, 3]
+    assert not list(tmp_path.iterdir())